@@ -0,0 +1,95 @@
+"""
+Measure the saving of skipping the ``BeforeRetry`` event when it has no
+subscribers.
+
+The step the policy runs for every retried attempt is timed directly, once
+as it was before, always creating the event and dispatching it, and once
+checking for subscribers first. The application has a ``NewRequest``
+subscriber such that ``registry.notify`` cannot bail out early, as is the
+case in most real applications.
+
+For scale, the cost of a whole retried attempt of a minimal application is
+measured as well. The saving is a small fraction of it, too small to show
+reliably in a whole-request benchmark.
+
+Run with ``python benchmarks/bench_before_retry.py``.
+
+"""
+
+from pyramid.config import Configurator
+from pyramid.events import NewRequest
+from pyramid.request import Request
+import timeit
+
+from pyramid_retry import (
+    BeforeRetry,
+    RetryableException,
+    _has_retry_subscribers,
+    is_last_attempt,
+)
+
+ATTEMPTS = 10
+NUMBER = 2000
+STEP_NUMBER = 200000
+REPEAT = 7
+
+
+def make_app():
+    config = Configurator(settings={'retry.attempts': ATTEMPTS})
+    config.include('pyramid_retry')
+    config.add_subscriber(lambda event: None, NewRequest)
+
+    def view(request):
+        if not is_last_attempt(request):
+            raise RetryableException
+        return request.response
+
+    config.add_view(view)
+    return config.make_wsgi_app()
+
+
+def best_us(func, number):
+    return (
+        min(timeit.repeat(func, number=number, repeat=REPEAT)) / number * 1e6
+    )
+
+
+def us_per_retry(app):
+    environ = Request.blank('/').environ
+
+    def run():
+        app(dict(environ), lambda status, headers: None)
+
+    return best_us(run, NUMBER) / (ATTEMPTS - 1)
+
+
+def main():
+    app = make_app()
+    registry = app.registry
+    request = Request.blank('/')
+    request.registry = registry
+    exc = RetryableException()
+
+    def always_notify():
+        registry.notify(BeforeRetry(request, exc, response=None))
+
+    def skip_without_subscribers():
+        if _has_retry_subscribers(registry):
+            registry.notify(BeforeRetry(request, exc, response=None))
+
+    before = best_us(always_notify, STEP_NUMBER)
+    after = best_us(skip_without_subscribers, STEP_NUMBER)
+    attempt = us_per_retry(app)
+
+    print('BeforeRetry step per retried attempt')
+    print('%-34s %8.3fus' % ('always notify BeforeRetry', before))
+    print('%-34s %8.3fus' % ('skip without subscribers', after))
+    print('%-34s %8.3fus' % ('saving', before - after))
+    print(
+        '%-34s %8.2fus'
+        % ('whole retried attempt, %d attempts' % ATTEMPTS, attempt)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare the cost of classifying exceptions with and without the per-type
+cache used by ``pyramid_retry.is_error_retryable``.
+
+Run with ``python benchmarks/bench_classify.py``.
+
+"""
+
+from pyramid.request import Request
+import timeit
+
+from pyramid_retry import (
+    ErrorClassifier,
+    IRetryableError,
+    RetryableException,
+    is_error_retryable,
+    is_last_attempt,
+    mark_error_retryable,
+)
+
+DEPTH = 20
+# many short runs, of which the fastest is kept, are less affected by noise
+NUMBER = 20000
+REPEAT = 200
+
+
+def make_hierarchy(name, base=Exception):
+    classes = [base]
+    for i in range(DEPTH):
+        classes.append(type('%s%d' % (name, i), (classes[-1],), {}))
+    return classes
+
+
+def uncached_classify(exc):
+    # the check used prior to the per-type cache
+    return isinstance(exc, RetryableException) or IRetryableError.providedBy(
+        exc
+    )
+
+
+def uncached_is_error_retryable(request, exc):
+    # the implementation prior to the per-type cache and request memo
+    if is_last_attempt(request):
+        return False
+    return uncached_classify(exc)
+
+
+def ns(func):
+    best = min(timeit.repeat(func, number=NUMBER, repeat=REPEAT))
+    return best / NUMBER * 1e9
+
+
+def main():
+    marked = make_hierarchy('Marked')
+    mark_error_retryable(marked[1])
+    plain = make_hierarchy('Plain')
+    subclassed = make_hierarchy('Sub', RetryableException)
+    instance = plain[-1]()
+    mark_error_retryable(instance)
+
+    cases = [
+        ('shallow RetryableException', RetryableException()),
+        ('deep RetryableException subclass', subclassed[-1]()),
+        ('deep type marked near the root', marked[-1]()),
+        ('deep non-retryable', plain[-1]()),
+        ('deep instance marked', instance),
+    ]
+
+    classifier = ErrorClassifier()
+    request = Request.blank('/')
+    request.environ['retry.attempt'] = 0
+    request.environ['retry.attempts'] = 3
+
+    print('classification of a single exception')
+    print('%-34s %10s %10s' % ('case', 'before', 'after'))
+    for name, exc in cases:
+        before = ns(lambda exc=exc: uncached_classify(exc))
+        after = ns(lambda exc=exc: classifier.classify(exc))
+        print('%-34s %8.0fns %8.0fns' % (name, before, after))
+
+    print()
+    print('is_error_retryable repeated for the same request and exception')
+    print('%-34s %10s %10s' % ('case', 'before', 'after'))
+    for name, exc in cases:
+        before = ns(lambda exc=exc: uncached_is_error_retryable(request, exc))
+        after = ns(lambda exc=exc: is_error_retryable(request, exc))
+        print('%-34s %8.0fns %8.0fns' % (name, before, after))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ docs_require = [
 ]
 
 tests_require = [
+    'opentelemetry-sdk',
     'pytest',
     'pytest-cov',
     'WebTest',
@@ -1,13 +1,39 @@
 import inspect
+import itertools
 from pyramid.config import PHASE1_CONFIG
 from pyramid.exceptions import ConfigurationError
+from pyramid.interfaces import IRequestFactory
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.tweens import EXCVIEW, MAIN
+import sys
+import time
+import traceback
+import weakref
 from zope.interface import (
     Attribute,
     Interface,
     alsoProvides,
     classImplements,
+    implementedBy,
     implementer,
 )
+from zope.interface.interfaces import IInterface
+
+from .backoff import backoff_from_settings
+from .body import make_body_replayable, rewind_body
+from .breaker import IRetryCircuitBreaker, breaker_from_settings
+from .budget import budget_from_settings
+from .conflicts import serializer_from_settings
+from .deadline import deadlines_from_settings
+from .hedge import hedger_from_settings
+from .limiter import RetrySlot, limiter_from_settings
+from .metrics import CompositeMetrics, IRetryMetrics, metrics_from_settings
+from .rules import IRetryRules, RetryRules, add_retry_rule, parse_rules
+from .state import RetryState, retry_state
+from .stats import IRetryStats, RetryStats, stats_view
+from .tracing import NOOP_SPAN, tracer_from_settings
 
 
 class IRetryableError(Interface):
@@ -32,13 +58,21 @@ class IBeforeRetry(Interface):
 
     environ = Attribute('The environ object that is reused between requests.')
     request = Attribute('The request object that is being discarded.')
-    exception = Attribute('The exception that request processing raised.')
+    exception = Attribute(
+        'The exception that request processing raised. Once the event was '
+        'handled the frames of its traceback are cleared and only a summary '
+        'is kept as its ``retry_traceback`` attribute.'
+    )
     response = Attribute(
         'The response object that is being discarded. '
         'This may be ``None`` if no response was generated, '
         'which happens when request processing raises an '
         "exception that isn't caught by any exception view."
     )
+    span = Attribute(
+        'The span of the failed attempt, see :mod:`pyramid_retry.tracing`. '
+        'This is a no-op span if no tracer is configured.'
+    )
 
 
 @implementer(IBeforeRetry)
@@ -53,21 +87,118 @@ class BeforeRetry(object):
     :ivar request: The :class:`pyramid.request.Request` object that is being
                    discarded.
 
+    The event is only created if there is at least one subscriber for it.
+
     """
 
-    def __init__(self, request, exception, response=None):
+    __slots__ = ('request', 'environ', 'exception', 'response', 'span')
+
+    def __init__(self, request, exception, response=None, span=NOOP_SPAN):
         self.request = request
         self.environ = request.environ
         self.exception = exception
         self.response = response
+        self.span = span
+
+
+class IBeforeViewRetry(Interface):
+    """
+    An event emitted before a view configured with the ``retry`` view option
+    is called again with the same request.
+
+    Subscribers may reset any state that the failed call left behind on the
+    request, see :func:`pyramid_retry.retry_view_deriver`.
+
+    """
+
+    request = Attribute('The request object that is being reused.')
+    context = Attribute('The context the view is called with.')
+    exception = Attribute(
+        'The exception that the view raised, see '
+        ':attr:`pyramid_retry.IBeforeRetry.exception`.'
+    )
+
+
+@implementer(IBeforeViewRetry)
+class BeforeViewRetry(object):
+    """
+    An event emitted before a view configured with the ``retry`` view option
+    is called again with the same request.
+
+    The event is only created if there is at least one subscriber for it.
+
+    """
+
+    __slots__ = ('request', 'context', 'exception')
+
+    def __init__(self, request, context, exception):
+        self.request = request
+        self.context = context
+        self.exception = exception
+
+
+_before_retry_spec = (implementedBy(BeforeRetry),)
+_before_view_retry_spec = (implementedBy(BeforeViewRetry),)
+
+
+def _has_retry_subscribers(registry, spec=_before_retry_spec):
+    # the answer is remembered on the registry until the generation of its
+    # adapter registry changes, which happens whenever subscribers are added
+    # or removed, such that a retry without subscribers neither allocates an
+    # event nor looks up subscribers
+    adapters = registry.adapters
+    generation = getattr(adapters, '_generation', None)
+    cached = registry.__dict__.get('_pyramid_retry_has_subscribers')
+    if cached is None or generation is None or cached[0] != generation:
+        cached = registry._pyramid_retry_has_subscribers = (generation, {})
+    found = cached[1].get(spec)
+    if found is None:
+        found = cached[1][spec] = bool(adapters.subscriptions(spec, None))
+    return found
 
 
 @implementer(IRetryableError)
 class RetryableException(Exception):
-    """A retryable exception should be raised when an error occurs."""
+    """
+    A retryable exception should be raised when an error occurs.
 
+    If ``retry_after`` is set, the next attempt starts after this many
+    seconds instead of waiting for the :term:`backoff strategy`. It is
+    stored as the ``pyramid_retry_after`` attribute. If ``retryable`` is
+    ``False`` the request is not retried at all.
 
-def RetryableExecutionPolicy(attempts=3, activate_hook=None):
+    """
+
+    pyramid_retry_after = None
+    retryable = True
+
+    # the hints live in __dict__ which pickle and copy preserve
+    def __init__(self, *args, retry_after=None, retryable=True):  # noqa: B042
+        super().__init__(*args)
+        self.pyramid_retry_after = retry_after
+        self.retryable = retryable
+
+
+def RetryableExecutionPolicy(
+    attempts=3,
+    activate_hook=None,
+    backoff=None,
+    max_total_backoff=None,
+    max_retry_after=None,
+    budget=None,
+    rules=None,
+    body_max_memory=None,
+    body_max_size=None,
+    body_lazy=False,
+    classifier=None,
+    metrics=None,
+    tracer=None,
+    hedger=None,
+    deadlines=None,
+    breaker=None,
+    limiter=None,
+    serializer=None,
+):
     """
     Create a :term:`execution policy` that catches any
     :term:`retryable error` and sends it through the pipeline again up to
@@ -78,29 +209,153 @@ def RetryableExecutionPolicy(attempts=3, activate_hook=None):
     of attempts to be used or ``None`` which will indicate to use the default
     number of attempts.
 
+    If ``rules`` is set it should be a :class:`pyramid_retry.rules.RetryRules`
+    table which selects the number of attempts based on the request method
+    and path. The rules are only consulted if there is no ``activate_hook``
+    or if it returned ``None``.
+
+    Requests that may be retried must buffer their body so that it can be
+    read again by later attempts. If ``body_max_memory`` is set, bodies larger
+    than this many bytes are spooled to a temporary file and memory-mapped
+    rather than copied into memory. If ``body_max_size`` is set, requests with
+    a larger body (or a body of unknown size) are not buffered at all and
+    instead only get a single attempt. If ``body_lazy`` is ``True`` the body
+    is instead copied incrementally as the application reads it, see
+    :class:`pyramid_retry.body.TeeInput`.
+
+    If ``classifier`` is set it should be a
+    :class:`pyramid_retry.ErrorClassifier` used to decide which errors are
+    retryable. By default the classifier registered by
+    :func:`pyramid_retry.includeme` is used.
+
+    If ``backoff`` is set it should be a :term:`backoff strategy` which will
+    be consulted after each failed attempt to determine how many seconds to
+    wait before starting the next attempt. See :mod:`pyramid_retry.backoff`
+    for the builtin strategies. By default the next attempt starts
+    immediately.
+
+    If ``max_total_backoff`` is set, the total time spent waiting between
+    attempts of a single request will not exceed this many seconds.
+
+    A retryable error with a number as its ``pyramid_retry_after`` attribute
+    overrides the backoff strategy, the next attempt starts after this many
+    seconds, capped at ``max_retry_after`` seconds if set. No delay extends
+    past the time needed to start another attempt before the deadline of
+    the request.
+
+    The :class:`pyramid_retry.ErrorPolicy` of a retryable error may override
+    the number of attempts and the backoff strategy for the remaining
+    attempts of the request.
+
+    If ``budget`` is set it should be a
+    :class:`pyramid_retry.budget.RetryBudget` which is consulted prior to
+    each attempt that may be followed by a retry.
+    When the budget is exhausted the attempt is treated as the last attempt
+    for the request.
+
+    If ``metrics`` is set it should be a :term:`metrics sink` which receives
+    the metrics described in :mod:`pyramid_retry.metrics`.
+
+    If ``tracer`` is set it should be a :term:`tracer` used to wrap each
+    attempt in a span as described in :mod:`pyramid_retry.tracing`.
+
+    If ``hedger`` is set it should be a :class:`pyramid_retry.hedge.Hedger`
+    which runs the first attempt of requests matching a rule with
+    ``hedge=True`` and hedges it if it takes too long.
+
+    If ``deadlines`` is set it should be a
+    :class:`pyramid_retry.deadline.Deadlines` which determines the deadline
+    of each request. An attempt is treated as the last attempt for the
+    request when the time left cannot fit another attempt.
+
+    If ``breaker`` is set it should be a
+    :class:`pyramid_retry.breaker.RetryCircuitBreaker` which stops retrying
+    kinds of errors whose retries keep failing. By default the breaker
+    registered by :func:`pyramid_retry.includeme` is used, if any.
+
+    If ``limiter`` is set it should be a
+    :class:`pyramid_retry.limiter.RetryLimiter` which caps the number of
+    retried attempts running at once. A failed attempt is only retried if a
+    slot can be taken for the next attempt.
+
+    If ``serializer`` is set it should be a
+    :class:`pyramid_retry.conflicts.ConflictSerializer` which derives a
+    conflict key from each retryable error. The later attempts of requests
+    with the same key run one at a time.
+
     """
     assert attempts > 0
+    assert max_total_backoff is None or max_total_backoff >= 0
+    assert max_retry_after is None or max_retry_after >= 0
+
+    def record_attempt(request, exc, number, started, span, retried):
+        if tracer is not None:
+            if exc is not None:
+                exc_type = exc.__class__
+                span.set_attribute(
+                    'exception.type',
+                    exc_type.__module__ + '.' + exc_type.__qualname__,
+                )
+                squashed = exc is request.__dict__.get('exception')
+                span.set_attribute('retry.squashed', squashed)
+            span.set_attribute('retry.retried', retried)
+            if metrics is None:
+                return
+
+        tags = () if exc is None else (('exception', exc.__class__.__name__),)
+        duration = (time.perf_counter() - started) * 1000
+        route = getattr(request, 'matched_route', None)
+        if route is None:
+            metrics.observe('attempt_duration', duration, tags)
+        else:
+            route_tags = tags + (('route', route.name),)
+            metrics.observe('attempt_duration', duration, route_tags)
+        if retried:
+            metrics.increment('retries', tags)
+            return
+
+        metrics.observe('attempts_per_request', number + 1)
+        if exc is None:
+            if number > 0:
+                metrics.increment('recovered')
+        elif _error_policy(request, exc, classifier) is not None:
+            metrics.increment('exhausted', tags)
 
     def retry_policy(environ, router):
+        handled = sys.exc_info()[1]
+
         # make the original request
         request_ctx = router.request_context(environ)
         request = request_ctx.begin()
         try:
+            retry_attempts = None
+            hedge_key = None
             if activate_hook:
                 retry_attempts = activate_hook(request)
-                if retry_attempts is None:
-                    retry_attempts = attempts
-                else:
-                    assert retry_attempts > 0
-            else:
+            if retry_attempts is None and rules is not None:
+                rule = rules.lookup(request.method, request.path_info)
+                if rule is not None:
+                    retry_attempts = rule.attempts
+                    if rule.hedge and hedger is not None:
+                        hedge_key = rule
+            if retry_attempts is None:
                 retry_attempts = attempts
+            else:
+                assert retry_attempts > 0
 
             # if we are supporting multiple attempts then we must make
             # make the body seekable in order to re-use it across multiple
-            # attempts. make_body_seekable will copy wsgi.input if
+            # attempts. make_body_replayable will copy wsgi.input if
             # necessary, otherwise it will rewind the copy to position zero
-            if retry_attempts != 1:
-                request.make_body_seekable()
+            # if the body is too large to copy then only one attempt is made
+            if retry_attempts != 1 and not make_body_replayable(
+                request, body_max_memory, body_max_size, body_lazy
+            ):
+                retry_attempts = 1
+
+            deadline = None
+            if deadlines is not None:
+                deadline = deadlines.deadline(request)
 
         # Catch make_body_seekable (e.g. 408 RequestTimeout)
         # and activate_hook exceptions and clean up.
@@ -108,79 +363,591 @@ def RetryableExecutionPolicy(attempts=3, activate_hook=None):
             request_ctx.end()
             raise
 
-        for number in range(retry_attempts):
+        state = environ['retry.state'] = RetryState(
+            retry_attempts, time.monotonic(), deadline, budget
+        )
+        last_delay = None
+        route_name = None
+        error_backoff = None
+        retry_after = None
+        breaker_retry = None
+        conflict_key = None
+        next_slot = False
+        observed = metrics is not None or tracer is not None
+
+        if budget is not None:
+            budget.record_request()
+        if metrics is not None:
+            metrics.increment('first_attempts')
+
+        for number in itertools.count():
+            if budget is not None:
+                if number > 0:
+                    budget.record_retry()
+
+                # if the budget cannot afford another retry then this
+                # attempt becomes the last one, the loop ends because no
+                # error will be considered retryable from here on
+                if number + 1 < retry_attempts and not budget.can_retry():
+                    retry_attempts = number + 1
+
+            # likewise this attempt becomes the last one if the time left
+            # cannot fit it, the backoff after it and another attempt
+            if deadline is not None and number + 1 < retry_attempts:
+                needed = 2 * deadlines.estimate(route_name) + (last_delay or 0)
+                if deadline - time.monotonic() < needed:
+                    retry_attempts = number + 1
+
+            # or if there is no slot left for another attempt to retry, unless
+            # this request already holds one
+            if (
+                limiter is not None
+                and number + 1 < retry_attempts
+                and not next_slot
+                and limiter.saturated()
+            ):
+                retry_attempts = number + 1
+
             # track the attempt info in the environ
             # try to set it as soon as possible so that it's available
             # in the request factory and elsewhere if people want it
             # note: set all of these values here as they are cleared after
             # each attempt
-            environ['retry.attempt'] = number
-            environ['retry.attempts'] = retry_attempts
-
-            # if we are not on the first attempt then we should start
-            # with a new request object and throw away any changes to
-            # the old object, however we do this carefully to try and
-            # avoid extra copies of the body
-            if number > 0:
-                # try to make sure this code stays in sync with pyramid's
-                # router which normally creates requests
-                request_ctx = router.request_context(environ)
-                request = request_ctx.begin()
+            environ['retry.attempt'] = state.attempt = number
+            environ['retry.attempts'] = state.attempts = retry_attempts
 
+            # a retried attempt holds the slot taken when the previous attempt
+            # failed, it is given back if the attempt cannot be started
+            holding_slot, next_slot = next_slot, False
+            try:
+                # if we are not on the first attempt then we should start
+                # with a new request object and throw away any changes to
+                # the old object, however we do this carefully to try and
+                # avoid extra copies of the body
+                slept = 0.0
+                if number > 0:
+                    # spread out attempts that are likely to collide again by
+                    # waiting before starting over
+                    strategy = error_backoff or backoff
+                    delay = None
+                    if retry_after is not None:
+                        # the error knows best how long to wait
+                        delay = last_delay = retry_after
+                        if max_retry_after is not None:
+                            delay = min(delay, max_retry_after)
+                    elif strategy is not None:
+                        delay = last_delay = strategy(number - 1, last_delay)
+                    if delay is not None:
+                        if max_total_backoff is not None:
+                            delay = min(
+                                delay, max_total_backoff - state.total_backoff
+                            )
+                        if deadline is not None:
+                            delay = min(
+                                delay,
+                                deadline
+                                - time.monotonic()
+                                - deadlines.estimate(route_name),
+                            )
+                        if delay > 0:
+                            state.total_backoff += delay
+                            slept = delay
+                            time.sleep(delay)
+
+                    # try to make sure this code stays in sync with pyramid's
+                    # router which normally creates requests
+                    request_ctx = router.request_context(environ)
+                    request = request_ctx.begin()
+
+                    # replay the body from the start for the new request
+                    rewind_body(request)
+
+            except BaseException:
+                if holding_slot:
+                    limiter.release()
+                raise
+
+            # everything taken from here on is given back by the finally
+            # clause below, even if the attempt fails before it is invoked
+            slot = conflict_lock = None
+            span = NOOP_SPAN
             try:
-                response = router.invoke_request(request)
-
-                # check for a squashed exception and handle it
-                # this would happen if an exception view was invoked and
-                # rendered an error response
-                exc = getattr(request, 'exception', None)
-                if exc is not None:
-                    # if this is a retryable exception then continue to the
-                    # next attempt, discarding the current response
-                    if is_error_retryable(request, exc):
-                        request.registry.notify(
-                            BeforeRetry(request, exc, response=response)
+                # the slot for the next attempt may also be taken by the retry
+                # tween before it short-circuits the error
+                if limiter is not None:
+                    slot = environ['retry.slot'] = RetrySlot(
+                        limiter, holding_slot
+                    )
+
+                # retries conflicting on the same resource run one at a time,
+                # an attempt which cannot get the lock in time runs anyway but
+                # it will be the last one
+                if conflict_key is not None:
+                    max_wait = None
+                    if deadline is not None:
+                        max_wait = (
+                            deadline
+                            - time.monotonic()
+                            - deadlines.estimate(route_name)
+                        )
+                    conflict_lock = serializer.acquire(conflict_key, max_wait)
+                    if conflict_lock is None and number + 1 < retry_attempts:
+                        retry_attempts = number + 1
+                        environ['retry.attempts'] = state.attempts = (
+                            retry_attempts
                         )
-                        continue
 
-                return response
+                state.attempt_started = time.monotonic()
+                if observed:
+                    started = time.perf_counter()
+                    if tracer is not None:
+                        span = tracer.start_span(
+                            'pyramid_retry.attempt',
+                            {
+                                'retry.attempt': number,
+                                'retry.attempts': retry_attempts,
+                                'retry.backoff': slept,
+                            },
+                        )
 
-            except Exception as exc:
-                # if this was the last attempt or the exception is not
-                # retryable then there's nothing left for us to do
-                if not is_error_retryable(request, exc):
-                    raise
+                try:
+                    if hedge_key is not None and number == 0:
+                        # the winning attempt may have used its own request
+                        request, response = hedger.invoke(
+                            router, request, hedge_key
+                        )
+                    else:
+                        response = router.invoke_request(request)
+
+                except Exception as caught:
+                    # report the outcome of a retry to the circuit breaker
+                    if breaker_retry is not None:
+                        breaker_retry[0].record(breaker_retry[1], False)
+                        breaker_retry = None
+
+                    # if this was the last attempt or the exception is not
+                    # retryable then there's nothing left for us to do
+                    if not is_error_retryable(
+                        request, caught, classifier, breaker
+                    ) or not _acquire_retry_slot(slot):
+                        if observed:
+                            record_attempt(
+                                request, caught, number, started, span, False
+                            )
+                        raise
+                    exc, response = caught, None
 
                 else:
-                    request.registry.notify(BeforeRetry(request, exc))
+                    # check for a squashed exception and handle it
+                    # this would happen if an exception view was invoked and
+                    # rendered an error response
+                    exc = getattr(request, 'exception', None)
+                    if breaker_retry is not None:
+                        breaker_retry[0].record(breaker_retry[1], exc is None)
+                        breaker_retry = None
+                    if (
+                        exc is None
+                        or not is_error_retryable(
+                            request, exc, classifier, breaker
+                        )
+                        or not _acquire_retry_slot(slot)
+                    ):
+                        if observed:
+                            record_attempt(
+                                request, exc, number, started, span, False
+                            )
+                        return response
+
+                if observed:
+                    record_attempt(request, exc, number, started, span, True)
+
+                # the kind of error may change the limit and the delay for
+                # the remaining attempts of the request
+                error_policy = _error_policy(request, exc, classifier)
+                if error_policy.attempts is not None:
+                    retry_attempts = error_policy.attempts
+                error_backoff = error_policy.backoff
+                retry_after = _retry_after(exc)
+
+                # remember which circuit allowed the retry to report the
+                # outcome of the next attempt
+                breaker_memo = request.__dict__.get('_retry_breaker_memo')
+                if breaker_memo is not None and breaker_memo[2] is not None:
+                    breaker_retry = breaker_memo[2:]
+
+                if serializer is not None:
+                    conflict_key = serializer.key(request, exc)
+
+                state.record_error(exc)
+
+                # this is a retryable exception so continue to the next
+                # attempt, discarding the current response
+                registry = request.registry
+                if _has_retry_subscribers(registry):
+                    registry.notify(
+                        BeforeRetry(request, exc, response=response, span=span)
+                    )
+                _discard_attempt(exc, response, handled)
+
+                # the slot is carried over to the next attempt
+                next_slot = slot is not None
 
             # cleanup any changes we made to the request
             finally:
+                span.end()
                 request_ctx.end()
 
+                if slot is not None:
+                    del environ['retry.slot']
+                    if slot.close() and not next_slot:
+                        limiter.release()
+                if conflict_lock is not None:
+                    serializer.release(conflict_lock)
+
+                if deadlines is not None:
+                    route = getattr(request, 'matched_route', None)
+                    route_name = None if route is None else route.name
+                    deadlines.record(
+                        route_name, time.monotonic() - state.attempt_started
+                    )
+
                 del environ['retry.attempt']
                 del environ['retry.attempts']
 
+            # nothing of the discarded attempt is kept alive while waiting
+            # for the next one, the request context still refers to the
+            # request after it ended
+            request_ctx = request = response = exc = breaker_memo = None
+
     return retry_policy
 
 
-def mark_error_retryable(error):
+class IErrorClassifier(Interface):
+    """
+    The registry key for the :class:`pyramid_retry.ErrorClassifier` used by
+    :func:`pyramid_retry.is_error_retryable`.
+
+    """
+
+
+class ErrorPolicy(object):
+    """
+    The options registered for a kind of :term:`retryable error` via
+    :meth:`pyramid_retry.ErrorClassifier.add_error`.
+
+    :ivar classifier: A callable which receives the exception and returns
+                      ``True`` if it should be retried, or ``None``.
+    :ivar attempts: The maximum number of attempts for a request once it
+                    failed with this kind of error, or ``None`` to keep the
+                    current limit.
+    :ivar backoff: The :term:`backoff strategy` used before the next attempt
+                   after this kind of error, or ``None`` to use the policy's
+                   strategy.
+
+    """
+
+    def __init__(self, classifier=None, attempts=None, backoff=None):
+        self.classifier = classifier
+        self.attempts = attempts
+        self.backoff = backoff
+
+
+# the policy for errors which are only marked via IRetryableError
+_default_error_policy = ErrorPolicy()
+
+
+class ErrorClassifier(object):
+    """
+    Decide whether an exception is a :term:`retryable error` and which
+    :class:`pyramid_retry.ErrorPolicy` applies to it.
+
+    ``errors`` may be a sequence of dictionaries of keyword arguments which
+    are passed to :meth:`.add_error`.
+
+    The lookup is cached per exception type, such that classifying an
+    exception is usually a single dictionary lookup no matter how deep its
+    class hierarchy is. Exceptions which were individually marked via
+    :func:`pyramid_retry.mark_error_retryable` are cached by their
+    declaration, which is shared by instances marked alike. As long as no
+    errors are registered, a :class:`pyramid_retry.RetryableException` is
+    classified without any lookup.
+
+    The caches of all classifiers are cleared whenever
+    :func:`pyramid_retry.mark_error_retryable` is called with a type.
+
+    """
+
+    #: The maximum number of exception types to remember before starting
+    #: over, bounding the memory used by dynamically created types.
+    max_cache_size = 1024
+
+    def __init__(self, errors=()):
+        self._cache = {}
+        self._errors = {}
+        for kw in errors:
+            self.add_error(**kw)
+        _classifiers.add(self)
+
+    def add_error(self, error, classifier=None, attempts=None, backoff=None):
+        """
+        Treat ``error`` and its subclasses as retryable. ``error`` may be an
+        exception type or an interface extending
+        :class:`pyramid_retry.IRetryableError`.
+
+        If ``classifier`` is set it will be invoked with each exception of
+        this type and should return ``True`` if that exception is retryable.
+        For example, only some database errors are worth retrying:
+
+        .. code-block:: python
+
+            def is_serialization_failure(exc):
+                return getattr(exc.orig, 'pgcode', None) in ('40001', '40P01')
+
+            classifier.add_error(OperationalError, is_serialization_failure)
+
+        If ``attempts`` is set, a request failing with this kind of error is
+        allowed up to ``attempts`` attempts in total, replacing the limit
+        the request started with. If ``backoff`` is set it is the
+        :term:`backoff strategy` used before the next attempt.
+
+        The registration closest to the type of an exception in its
+        resolution order wins, including types that were marked retryable
+        via :class:`pyramid_retry.IRetryableError` and the interfaces they
+        provide.
+
+        """
+        if IInterface.providedBy(error):
+            if not error.isOrExtends(IRetryableError):
+                raise ValueError(
+                    'only interfaces extending IRetryableError may be '
+                    'registered'
+                )
+        elif not (inspect.isclass(error) and issubclass(error, BaseException)):
+            raise ValueError('only exception types may be registered')
+        if attempts is not None and attempts < 1:
+            raise ValueError('attempts must be >= 1')
+        self._errors[error] = ErrorPolicy(classifier, attempts, backoff)
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget every cached lookup."""
+        self._cache = {}
+
+    def _lookup(self, spec):
+        # walk the resolution order of the class or instance declarations to
+        # find the closest registration or marker, an Implements spec stands
+        # for the class it was created for
+        errors = self._errors
+        for base in spec.__sro__:
+            policy = errors.get(getattr(base, 'inherit', base))
+            if policy is not None:
+                return policy
+            if base is IRetryableError:
+                return _default_error_policy
+        return None
+
+    def lookup(self, exc):
+        """
+        Return the :class:`pyramid_retry.ErrorPolicy` for ``exc`` or ``None``
+        if it is not a :term:`retryable error`. An exception with a
+        ``retryable`` attribute set to ``False`` is never retryable.
+
+        """
+        # without registrations a RetryableException is always retryable
+        # with the default policy, which is as cheap as it gets
+        if isinstance(exc, RetryableException) and not self._errors:
+            if exc.retryable is False:
+                return None
+            return _default_error_policy
+        # an instance marked via alsoProvides carries its own declaration,
+        # which zope.interface shares between instances marked alike
+        cls = spec = exc.__class__
+        retryable = None
+        try:
+            instance_dict = exc.__dict__
+        except AttributeError:
+            instance_dict = None
+        if instance_dict:
+            retryable = instance_dict.get('retryable')
+            if retryable is False:
+                return None
+            spec = instance_dict.get('__provides__', cls)
+
+        cache = self._cache
+        try:
+            policy, blocked = cache[spec]
+        except KeyError:
+            if spec is cls:
+                policy = self._lookup(implementedBy(cls))
+            else:
+                policy = self._lookup(spec)
+            # the retryable attribute of the class is cached with it, an
+            # instance attribute still takes precedence
+            blocked = getattr(cls, 'retryable', True) is False
+            if len(cache) >= self.max_cache_size:
+                cache = self._cache = {}
+            cache[spec] = (policy, blocked)
+
+        if policy is None or blocked and retryable is None:
+            return None
+        if policy.classifier is not None and not policy.classifier(exc):
+            return None
+        return policy
+
+    def classify(self, exc):
+        """
+        Return ``True`` if ``exc`` is a :term:`retryable error`.
+
+        """
+        # the fast path of lookup() without a second call
+        if isinstance(exc, RetryableException) and not self._errors:
+            return exc.retryable is not False
+        return self.lookup(exc) is not None
+
+
+def parse_errors(value, maybe_dotted):
+    """
+    Parse the ``retry.errors`` setting into a list of keyword arguments for
+    :meth:`pyramid_retry.ErrorClassifier.add_error`.
+
+    Each non-empty line contains a dotted python name to an exception type
+    or an interface extending :class:`pyramid_retry.IRetryableError`,
+    optionally followed by a dotted python name to a classifier callable,
+    optionally followed by ``key=value`` options:
+
+    ``attempts``
+        The maximum number of attempts after this kind of error.
+
+    ``backoff``, ``backoff.base``, ``backoff.max_delay``
+        The backoff strategy used after this kind of error, accepting the
+        same values as the ``retry.backoff.*`` settings.
+
+    For example:
+
+    .. code-block:: ini
+
+        retry.errors =
+            myapp.errors.Deadlock attempts=6
+            myapp.errors.Disconnect attempts=2 backoff=constant backoff.base=1
+
+    """
+    result = []
+    for line in value.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        options = {}
+        while len(parts) > 1 and '=' in parts[-1]:
+            key, val = parts.pop().split('=', 1)
+            options[key] = val
+        if len(parts) > 2:
+            raise ConfigurationError('Invalid retryable error: %r.' % (line,))
+        error = maybe_dotted(parts[0])
+        if not (
+            IInterface.providedBy(error)
+            and error.isOrExtends(IRetryableError)
+            or inspect.isclass(error)
+            and issubclass(error, BaseException)
+        ):
+            raise ConfigurationError(
+                'Retryable error %r is not an exception type.' % (parts[0],)
+            )
+        kw = {'error': error}
+        if len(parts) == 2:
+            kw['classifier'] = maybe_dotted(parts[1])
+        try:
+            if 'attempts' in options:
+                kw['attempts'] = int(options.pop('attempts'))
+        except ValueError:
+            raise ConfigurationError('Invalid retryable error: %r.' % (line,))
+        backoff_settings = {}
+        for key in ('backoff', 'backoff.base', 'backoff.max_delay'):
+            if key in options:
+                backoff_settings['retry.' + key] = options.pop(key)
+        if options:
+            raise ConfigurationError(
+                'Unknown options %s for retryable error: %r.'
+                % (', '.join(sorted(options)), line)
+            )
+        backoff = backoff_from_settings(backoff_settings, maybe_dotted)
+        if backoff is not None:
+            kw['backoff'] = backoff
+        result.append(kw)
+    return result
+
+
+_classifiers = weakref.WeakSet()
+_default_classifier = ErrorClassifier()
+
+
+def mark_error_retryable(error, retry_after=None):
     """
     Mark an exception instance or type as retryable. If this exception
     is caught by ``pyramid_retry`` then it may retry the request.
 
+    If ``retry_after`` is set it is stored as the ``pyramid_retry_after``
+    attribute of ``error``, see :class:`pyramid_retry.RetryableException`.
+
     """
     if isinstance(error, Exception):
         alsoProvides(error, IRetryableError)
     elif inspect.isclass(error) and issubclass(error, Exception):
         classImplements(error, IRetryableError)
+        for classifier in list(_classifiers):
+            classifier.invalidate()
     else:
         raise ValueError(
             'only exception objects or types may be marked retryable'
         )
-
-
-def is_error_retryable(request, exc):
+    if retry_after is not None:
+        error.pyramid_retry_after = retry_after
+
+
+def _retry_after(exc):
+    # only a number of seconds is honored, the name is unlikely to be used
+    # for anything else but a bool is a number too
+    delay = getattr(exc, 'pyramid_retry_after', None)
+    if isinstance(delay, (int, float)) and not isinstance(delay, bool):
+        return delay
+    return None
+
+
+def _find_classifier(registry):
+    if registry is None:
+        return _default_classifier
+    return registry.queryUtility(IErrorClassifier, default=_default_classifier)
+
+
+def _error_policy(request, exc, classifier):
+    request_dict = request.__dict__
+    memo = request_dict.get('_retryable_error_memo')
+    if memo is not None and memo[0] is exc:
+        return memo[1]
+    if classifier is None:
+        classifier = _find_classifier(getattr(request, 'registry', None))
+    policy = classifier.lookup(exc)
+    request_dict['_retryable_error_memo'] = (exc, policy)
+    return policy
+
+
+def _breaker_allows(request, exc, breaker):
+    # the memo is checked by is_error_retryable
+    request_dict = request.__dict__
+    if breaker is None:
+        registry = getattr(request, 'registry', None)
+        if registry is not None:
+            breaker = registry.queryUtility(IRetryCircuitBreaker)
+        if breaker is None:
+            request_dict['_retry_breaker_memo'] = (exc, True, None, None)
+            return True
+    route = getattr(request, 'matched_route', None)
+    key = breaker.key(exc, None if route is None else route.name)
+    allowed = breaker.allow(key)
+    request_dict['_retry_breaker_memo'] = (exc, allowed, breaker, key)
+    return allowed
+
+
+def is_error_retryable(request, exc, classifier=None, breaker=None):
     """
     Return ``True`` if the exception is recognized as :term:`retryable error`.
 
@@ -188,13 +955,40 @@ def is_error_retryable(request, exc):
     This will return ``False`` if ``pyramid_retry`` is inactive for the
     request.
 
+    The exception is classified by ``classifier`` if set, otherwise by the
+    :class:`pyramid_retry.ErrorClassifier` registered by
+    :func:`pyramid_retry.includeme`.
+
+    If ``breaker`` is set, or a
+    :class:`pyramid_retry.breaker.RetryCircuitBreaker` is registered, and
+    the circuit for the exception is open, this returns ``False``.
+
+    The verdict is remembered on the request such that repeated checks of
+    the same exception, for example by several ``retryable_error`` view
+    predicates, are cheap.
+
     """
-    if is_last_attempt(request):
+    environ = request.environ
+    attempt = environ.get('retry.attempt')
+    attempts = environ.get('retry.attempts')
+    if attempt is None or attempts is None or attempt + 1 >= attempts:
         return False
 
-    return isinstance(exc, RetryableException) or IRetryableError.providedBy(
-        exc
-    )
+    # the memos are read inline as predicates check the same error often
+    request_dict = request.__dict__
+    memo = request_dict.get('_retryable_error_memo')
+    if memo is not None and memo[0] is exc:
+        policy = memo[1]
+    else:
+        policy = _error_policy(request, exc, classifier)
+    if policy is None:
+        return False
+    if policy.attempts is not None and attempt + 1 >= policy.attempts:
+        return False
+    memo = request_dict.get('_retry_breaker_memo')
+    if memo is not None and memo[0] is exc:
+        return memo[1]
+    return _breaker_allows(request, exc, breaker)
 
 
 def is_last_attempt(request):
@@ -203,6 +997,10 @@ def is_last_attempt(request):
     ``pyramid_retry`` will not be issuing any new attempts, regardless of
     what happens when executing this request.
 
+    If ``request.exception`` is set and its
+    :class:`pyramid_retry.ErrorPolicy` limits the number of attempts, that
+    limit is taken into account as well.
+
     This will return ``True`` if ``pyramid_retry`` is inactive for the
     request.
 
@@ -210,10 +1008,15 @@ def is_last_attempt(request):
     environ = request.environ
     attempt = environ.get('retry.attempt')
     attempts = environ.get('retry.attempts')
-    if attempt is None or attempts is None:
+    if attempt is None or attempts is None or attempt + 1 >= attempts:
         return True
 
-    return attempt + 1 == attempts
+    exc = request.__dict__.get('exception')
+    if exc is not None:
+        policy = _error_policy(request, exc, None)
+        if policy is not None and policy.attempts is not None:
+            return attempt + 1 >= policy.attempts
+    return False
 
 
 class RetryableErrorPredicate(object):
@@ -233,6 +1036,8 @@ class RetryableErrorPredicate(object):
                 'True or False.',
             )
         self.val = val
+        self.registry = config.registry
+        self.classifier = None
 
     def text(self):
         return 'retryable_error = %s' % (self.val,)
@@ -241,7 +1046,11 @@ class RetryableErrorPredicate(object):
 
     def __call__(self, context, request):
         exc = getattr(request, 'exception', None)
-        is_retryable = is_error_retryable(request, exc)
+        classifier = self.classifier
+        if classifier is None:
+            # the classifier is registered after the predicate is created
+            classifier = self.classifier = _find_classifier(self.registry)
+        is_retryable = is_error_retryable(request, exc, classifier)
         return (self.val and is_retryable) or (
             not self.val and not is_retryable
         )
@@ -275,6 +1084,362 @@ class LastAttemptPredicate(object):
         return (self.val and is_last) or (not self.val and not is_last)
 
 
+def retry_tween_factory(handler, registry):
+    """
+    A :term:`tween` factory which short-circuits :term:`retryable error`
+    exceptions on attempts that will be retried, before any exception view
+    is looked up or rendered.
+
+    The exception is stored on ``request.exception`` and
+    ``request.exc_info`` and an empty ``500 Internal Server Error``
+    response is returned in place of a rendered error page. To the
+    execution policy, and to any tweens above ``EXCVIEW`` such as
+    ``pyramid_tm``, this looks exactly like an exception which was squashed
+    by an exception view, so the request is retried as usual. Exception
+    views therefore only ever run for the last attempt and for errors which
+    are not retryable. If a :class:`pyramid_retry.limiter.RetryLimiter` is
+    used, the slot for the next attempt is taken first and, if there is none
+    left, the attempt becomes the last one and the error is raised.
+
+    The tween is added by :func:`pyramid_retry.includeme` below ``EXCVIEW``
+    and is only active if the ``retry.skip_exception_views`` setting is
+    ``true``, otherwise it is left out of the pipeline entirely.
+
+    """
+    if not asbool(registry.settings.get('retry.skip_exception_views')):
+        return handler
+
+    classifier = _find_classifier(registry)
+
+    def retry_tween(request):
+        try:
+            return handler(request)
+        except Exception as exc:
+            if not is_error_retryable(request, exc, classifier):
+                raise
+            # the empty response is only returned if the error will be
+            # retried, so the slot for the next attempt must be taken now
+            slot = request.environ.get('retry.slot')
+            if slot is not None and not slot.acquire():
+                _demote_request(request)
+                raise
+            request.exception = exc
+            request.exc_info = sys.exc_info()
+            return Response(status=500)
+
+    return retry_tween
+
+
+def retry_view_deriver(view, info):
+    """
+    A :term:`view deriver` which retries a view configured with the
+    ``retry`` view option, calling it again with the same request instead of
+    sending a new request through the whole pipeline:
+
+    .. code-block:: python
+
+        @view_config(route_name='orders', renderer='json', retry=5)
+        def create_order(request):
+            ...
+
+    The option is either ``True``, to allow as many attempts as the
+    ``retry.attempts`` setting, or a number of attempts. While the view is
+    called, ``retry.attempt`` and ``retry.attempts`` in the environ, as well
+    as the ``attempt``, ``attempts`` and ``attempt_started`` attributes of
+    ``request.retry``, describe the attempts of the view, such that
+    :func:`pyramid_retry.is_error_retryable` and
+    :func:`pyramid_retry.is_last_attempt` apply to them. A retryable error
+    raised by the last attempt of the view is not retried again by the
+    execution policy.
+
+    Before the view is called again, the body is rewound, the
+    ``request.response`` used by the failed call is discarded and a
+    :class:`pyramid_retry.BeforeViewRetry` event is emitted, which
+    subscribers may use to reset any other state of the request.
+
+    When the request is executed by the execution policy, the view is only
+    called again if the :class:`pyramid_retry.budget.RetryBudget` of the
+    request can afford another retry, which is then recorded, and if the
+    time left before the deadline of the request fits two more calls of
+    the view as long as the last one. Otherwise the current call becomes
+    the last one. None of the other protections of the execution policy
+    apply: the attempts of a view run back to back without any backoff or
+    ``Retry-After`` delay, they do not take a slot of the retry limiter
+    and they do not wait for the conflict serializer.
+
+    The deriver is added by :func:`pyramid_retry.includeme` and wraps the
+    view below the security checks and decorators, which run only once.
+
+    """
+    retry = info.options.get('retry')
+    if retry is None or retry is False:
+        return view
+    if retry is True:
+        attempts = None
+    elif isinstance(retry, int) and retry > 0:
+        attempts = retry
+    else:
+        raise ConfigurationError(
+            'The "retry" view option must be True, False or a number of '
+            'attempts >= 1.'
+        )
+    registry = info.registry
+    classifier = None
+
+    def retry_view(context, request):
+        nonlocal classifier
+        if classifier is None:
+            # the classifier is registered after the view is configured
+            classifier = _find_classifier(registry)
+        limit = attempts
+        if limit is None:
+            limit = int(registry.settings.get('retry.attempts') or 3)
+
+        # the body is only buffered by the execution policy if the request
+        # may be retried as a whole
+        if limit > 1 and not request.is_body_seekable:
+            request.make_body_seekable()
+
+        handled = sys.exc_info()[1]
+        environ = request.environ
+        outer_attempt = environ.get('retry.attempt')
+        outer_attempts = environ.get('retry.attempts')
+        state = environ.get('retry.state')
+        if state is not None:
+            outer_state = (
+                state.attempt,
+                state.attempts,
+                state.attempt_started,
+            )
+        breaker_retry = None
+        exhausted = False
+        duration = 0.0
+        try:
+            for number in itertools.count():
+                if state is not None:
+                    # like the execution policy, the call becomes the last one
+                    # if the budget cannot afford another retry or the time
+                    # left cannot fit it and another call
+                    budget = state.budget
+                    if budget is not None:
+                        if number > 0:
+                            budget.record_retry()
+                        if number + 1 < limit and not budget.can_retry():
+                            limit = number + 1
+                    deadline = state.deadline
+                    if (
+                        deadline is not None
+                        and number + 1 < limit
+                        and deadline - time.monotonic() < 2 * duration
+                    ):
+                        limit = number + 1
+                environ['retry.attempt'] = number
+                environ['retry.attempts'] = limit
+                if state is not None:
+                    state.attempt = number
+                    state.attempts = limit
+                    state.attempt_started = time.monotonic()
+                try:
+                    response = view(context, request)
+                except Exception as exc:
+                    if breaker_retry is not None:
+                        breaker_retry[0].record(breaker_retry[1], False)
+                        breaker_retry = None
+                    if not is_error_retryable(request, exc, classifier):
+                        exhausted = (
+                            _error_policy(request, exc, classifier) is not None
+                        )
+                        raise
+
+                    breaker_memo = request.__dict__.get('_retry_breaker_memo')
+                    if (
+                        breaker_memo is not None
+                        and breaker_memo[2] is not None
+                    ):
+                        breaker_retry = breaker_memo[2:]
+
+                    rewind_body(request)
+                    request.__dict__.pop('response', None)
+                    if _has_retry_subscribers(
+                        registry, _before_view_retry_spec
+                    ):
+                        registry.notify(BeforeViewRetry(request, context, exc))
+                    if state is not None:
+                        state.record_error(exc)
+                        duration = time.monotonic() - state.attempt_started
+                    _discard_attempt(exc, None, handled)
+                else:
+                    if breaker_retry is not None:
+                        breaker_retry[0].record(breaker_retry[1], True)
+                    return response
+
+        finally:
+            if state is not None:
+                (
+                    state.attempt,
+                    state.attempts,
+                    state.attempt_started,
+                ) = outer_state
+            if outer_attempt is None:
+                del environ['retry.attempt']
+                del environ['retry.attempts']
+            else:
+                environ['retry.attempt'] = outer_attempt
+                environ['retry.attempts'] = outer_attempts
+                # the view already used up its attempts on a retryable error
+                # so the whole request is not started over
+                if exhausted:
+                    _demote_request(request)
+
+    return retry_view
+
+
+retry_view_deriver.options = ('retry',)
+
+
+def invoke_subrequest_with_retry(
+    request, subrequest, use_tweens=False, attempts=None
+):
+    """
+    Invoke ``subrequest`` via ``request.invoke_subrequest`` and retry it on a
+    :term:`retryable error` up to ``attempts`` attempts in total, defaulting
+    to the ``retry.attempts`` setting. Only the failing subrequest is
+    executed again rather than the whole outer request:
+
+    .. code-block:: python
+
+        def batch_view(request):
+            results = []
+            for item in request.json_body:
+                subrequest = Request.blank(item['path'], POST=item['params'])
+                response = invoke_subrequest_with_retry(request, subrequest)
+                results.append(response.json_body)
+            return results
+
+    Each attempt has ``retry.attempt`` and ``retry.attempts`` set in the
+    environ of the subrequest, such that
+    :func:`pyramid_retry.is_error_retryable`,
+    :func:`pyramid_retry.is_last_attempt` and the view predicates apply to
+    it, and a :class:`pyramid_retry.BeforeRetry` event is emitted before
+    each retry. The body of the subrequest is buffered as by the execution
+    policy. Errors squashed by an exception view, which only runs if
+    ``use_tweens`` is ``True``, are retried as well.
+
+    Later attempts use a new request created for the same environ by the
+    :term:`Pyramid` request factory, so attributes set on ``subrequest``
+    itself rather than on its environ are not carried over. The attempts run
+    back to back without any backoff. If the last attempt fails with a
+    retryable error, ``request`` is not retried again as a whole.
+
+    """
+    registry = request.registry
+    if attempts is None:
+        attempts = int(registry.settings.get('retry.attempts') or 3)
+    assert attempts > 0
+    if attempts != 1:
+        make_body_replayable(subrequest)
+    classifier = _find_classifier(registry)
+    request_factory = registry.queryUtility(IRequestFactory, default=Request)
+
+    handled = sys.exc_info()[1]
+    environ = subrequest.environ
+    state = environ['retry.state'] = RetryState(attempts, time.monotonic())
+    breaker_retry = None
+    try:
+        for number in itertools.count():
+            environ['retry.attempt'] = state.attempt = number
+            environ['retry.attempts'] = attempts
+            state.attempt_started = time.monotonic()
+
+            if number > 0:
+                subrequest = request_factory(environ)
+                rewind_body(subrequest)
+
+            try:
+                response = request.invoke_subrequest(
+                    subrequest, use_tweens=use_tweens
+                )
+            except Exception as caught:
+                if breaker_retry is not None:
+                    breaker_retry[0].record(breaker_retry[1], False)
+                    breaker_retry = None
+                if not is_error_retryable(subrequest, caught, classifier):
+                    if (
+                        _error_policy(subrequest, caught, classifier)
+                        is not None
+                    ):
+                        _demote_request(request)
+                    raise
+                exc, response = caught, None
+            else:
+                exc = getattr(subrequest, 'exception', None)
+                if breaker_retry is not None:
+                    breaker_retry[0].record(breaker_retry[1], exc is None)
+                    breaker_retry = None
+                if exc is None or not is_error_retryable(
+                    subrequest, exc, classifier
+                ):
+                    return response
+
+            breaker_memo = subrequest.__dict__.get('_retry_breaker_memo')
+            if breaker_memo is not None and breaker_memo[2] is not None:
+                breaker_retry = breaker_memo[2:]
+
+            state.record_error(exc)
+
+            if _has_retry_subscribers(registry):
+                registry.notify(
+                    BeforeRetry(subrequest, exc, response=response)
+                )
+            _discard_attempt(exc, response, handled)
+            subrequest = response = exc = None
+
+    finally:
+        del environ['retry.attempt']
+        del environ['retry.attempts']
+
+
+def _acquire_retry_slot(slot):
+    # a failed attempt is only retried if the next attempt has a slot, the
+    # slot of a retried attempt is kept for the next one
+    return slot is None or slot.acquire()
+
+
+def _discard_attempt(exc, response, handled):
+    # close the response of an attempt which is thrown away and release the
+    # frames of its exception and of the exceptions chained to it, which may
+    # reference large objects such as database sessions or query results,
+    # keeping only a summary of where each one was raised, the exception
+    # which was being handled when the attempt started, and whatever it is
+    # chained to, belongs to the caller and is left alone
+    if response is not None:
+        close = getattr(response.app_iter, 'close', None)
+        if close is not None:
+            close()
+    seen = set()
+    while exc is not None and exc is not handled and id(exc) not in seen:
+        seen.add(id(exc))
+        tb = exc.__traceback__
+        if tb is not None:
+            exc.retry_traceback = traceback.StackSummary.extract(
+                traceback.walk_tb(tb), lookup_lines=False
+            )
+            traceback.clear_frames(tb)
+            exc.__traceback__ = None
+        exc = exc.__cause__ or exc.__context__
+
+
+def _demote_request(request):
+    # the current attempt of the request becomes its last one
+    environ = request.environ
+    attempt = environ.get('retry.attempt')
+    if attempt is not None:
+        environ['retry.attempts'] = attempt + 1
+        state = environ.get('retry.state')
+        if state is not None:
+            state.attempts = attempt + 1
+
+
 def includeme(config):
     """
     Activate the ``pyramid_retry`` execution policy in your application.
@@ -282,8 +1447,64 @@ def includeme(config):
     This will add the :func:`pyramid_retry.RetryableErrorPolicy` with
     ``attempts`` pulled from the ``retry.attempts`` setting.
 
+    A :term:`backoff strategy` may be configured using the ``retry.backoff``
+    setting, tuned by ``retry.backoff.base``, ``retry.backoff.max_delay``
+    and ``retry.backoff.max_total``. Delays requested by retryable errors are
+    capped by ``retry.backoff.max_retry_after``.
+
+    A :class:`pyramid_retry.budget.RetryBudget` may be configured using the
+    ``retry.budget.ratio``, ``retry.budget.min_retries_per_second`` and
+    ``retry.budget.window`` settings.
+
+    Body buffering may be tuned using the ``retry.body.max_memory``,
+    ``retry.body.max_size`` and ``retry.body.lazy`` settings.
+
+    A :term:`metrics sink` may be configured using the ``retry.metrics``
+    setting, see :func:`pyramid_retry.metrics.metrics_from_settings`.
+
+    A :term:`tracer` may be configured using the ``retry.tracer`` setting,
+    see :func:`pyramid_retry.tracing.tracer_from_settings`.
+
+    In-process statistics may be enabled using the ``retry.stats`` and
+    ``retry.stats.window`` settings and exposed as JSON under the path set
+    by ``retry.stats.path``, optionally protected by
+    ``retry.stats.permission``, see :mod:`pyramid_retry.stats`.
+
+    Additional retryable errors may be configured using the ``retry.errors``
+    setting, see :func:`pyramid_retry.parse_errors`.
+
+    Per-path attempts may be configured using the ``retry.rules`` setting
+    or the ``config.add_retry_rule`` directive, see
+    :func:`pyramid_retry.rules.add_retry_rule`.
+
+    Request deadlines may be configured using the ``retry.deadline`` and
+    ``retry.deadline.header`` settings, see
+    :func:`pyramid_retry.deadline.deadlines_from_settings`.
+
+    The number of retried attempts running at once may be limited using the
+    ``retry.concurrency.limit`` and ``retry.concurrency.timeout`` settings,
+    see :mod:`pyramid_retry.limiter`.
+
+    Retries conflicting on the same resource may be serialized using the
+    ``retry.conflict_key`` setting, see
+    :func:`pyramid_retry.conflicts.serializer_from_settings`.
+
+    A circuit breaker may be configured using the ``retry.breaker.*``
+    settings, see :func:`pyramid_retry.breaker.breaker_from_settings`.
+
+    Hedging of requests matching a rule with ``hedge=True`` may be enabled
+    using the ``retry.hedge.workers`` setting, see
+    :func:`pyramid_retry.hedge.hedger_from_settings`.
+
+    Exception views may be skipped on attempts that will be retried using
+    the ``retry.skip_exception_views`` setting, see
+    :func:`pyramid_retry.retry_tween_factory`.
+
     The ``last_retry_attempt`` and ``retryable_error`` view predicates
-    are registered.
+    are registered, as well as the ``retry`` view option, see
+    :func:`pyramid_retry.retry_view_deriver`, and the ``request.retry``
+    property returning the :class:`pyramid_retry.state.RetryState` of the
+    request.
 
     This should be included in your Pyramid application via
     ``config.include('pyramid_retry')``.
@@ -293,6 +1514,22 @@ def includeme(config):
 
     config.add_view_predicate('last_retry_attempt', LastAttemptPredicate)
     config.add_view_predicate('retryable_error', RetryableErrorPredicate)
+    config.add_directive('add_retry_rule', add_retry_rule)
+    config.add_request_method(retry_state, 'retry', reify=True)
+    config.add_view_deriver(retry_view_deriver)
+    config.add_tween(
+        'pyramid_retry.retry_tween_factory', under=EXCVIEW, over=MAIN
+    )
+
+    stats_path = settings.get('retry.stats.path')
+    if stats_path:
+        config.add_route('pyramid_retry.stats', stats_path)
+        config.add_view(
+            stats_view,
+            route_name='pyramid_retry.stats',
+            renderer='json',
+            permission=settings.get('retry.stats.permission'),
+        )
 
     def register():
         attempts = int(settings.get('retry.attempts') or 3)
@@ -301,9 +1538,73 @@ def includeme(config):
         activate_hook = settings.get('retry.activate_hook')
         activate_hook = config.maybe_dotted(activate_hook)
 
+        backoff = backoff_from_settings(settings, config.maybe_dotted)
+        max_total_backoff = settings.get('retry.backoff.max_total')
+        if max_total_backoff is not None:
+            max_total_backoff = float(max_total_backoff)
+        max_retry_after = settings.get('retry.backoff.max_retry_after')
+        if max_retry_after is not None:
+            max_retry_after = float(max_retry_after)
+
+        body_max_memory = settings.get('retry.body.max_memory')
+        if body_max_memory is not None:
+            body_max_memory = int(body_max_memory)
+        body_max_size = settings.get('retry.body.max_size')
+        if body_max_size is not None:
+            body_max_size = int(body_max_size)
+
+        classifier = ErrorClassifier(
+            parse_errors(
+                settings.get('retry.errors') or '', config.maybe_dotted
+            )
+        )
+        config.registry.registerUtility(classifier, IErrorClassifier)
+
+        rules = RetryRules()
+        for kw in parse_rules(settings.get('retry.rules') or ''):
+            rules.add(**kw)
+        config.registry.registerUtility(rules, IRetryRules)
+
+        metrics = metrics_from_settings(settings, config.maybe_dotted)
+        if stats_path or asbool(settings.get('retry.stats')):
+            stats_window = settings.get('retry.stats.window')
+            if stats_window is not None:
+                stats = RetryStats(window=float(stats_window))
+            else:
+                stats = RetryStats()
+            config.registry.registerUtility(stats, IRetryStats)
+            if metrics is None:
+                metrics = stats
+            else:
+                metrics = CompositeMetrics([metrics, stats])
+        if metrics is not None:
+            config.registry.registerUtility(metrics, IRetryMetrics)
+
+        tracer = tracer_from_settings(settings, config.maybe_dotted)
+
+        breaker = breaker_from_settings(settings, config.registry.notify)
+        if breaker is not None:
+            config.registry.registerUtility(breaker, IRetryCircuitBreaker)
+
         policy = RetryableExecutionPolicy(
             attempts,
             activate_hook=activate_hook,
+            backoff=backoff,
+            max_total_backoff=max_total_backoff,
+            max_retry_after=max_retry_after,
+            budget=budget_from_settings(settings, config.maybe_dotted),
+            rules=rules,
+            body_max_memory=body_max_memory,
+            body_max_size=body_max_size,
+            body_lazy=asbool(settings.get('retry.body.lazy')),
+            classifier=classifier,
+            metrics=metrics,
+            tracer=tracer,
+            hedger=hedger_from_settings(settings),
+            deadlines=deadlines_from_settings(settings),
+            breaker=breaker,
+            limiter=limiter_from_settings(settings),
+            serializer=serializer_from_settings(settings, config.maybe_dotted),
         )
         config.set_execution_policy(policy)
 
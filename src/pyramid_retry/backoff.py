@@ -0,0 +1,120 @@
+"""
+Backoff strategies used by :func:`pyramid_retry.RetryableExecutionPolicy`
+to decide how long to wait before starting the next attempt.
+
+A backoff strategy is any callable accepting ``(attempt, last_delay)`` and
+returning a delay in seconds. ``attempt`` is the zero-based number of the
+attempt that just failed and ``last_delay`` is the delay returned for the
+previous retry of the same request or ``None`` if this is the first retry.
+
+"""
+
+import random
+
+
+class ConstantBackoff(object):
+    """
+    Wait a fixed ``delay`` seconds between every attempt.
+
+    """
+
+    def __init__(self, delay=0.0):
+        assert delay >= 0
+        self.delay = delay
+
+    def __call__(self, attempt, last_delay):
+        return self.delay
+
+
+class ExponentialBackoff(object):
+    """
+    Wait ``base * multiplier ** attempt`` seconds, capped at ``max_delay``.
+
+    """
+
+    def __init__(self, base=0.05, max_delay=1.0, multiplier=2.0):
+        assert base >= 0
+        assert max_delay >= 0
+        assert multiplier >= 1
+        self.base = base
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def __call__(self, attempt, last_delay):
+        try:
+            delay = self.base * self.multiplier**attempt
+        except OverflowError:
+            return self.max_delay
+        return min(self.max_delay, delay)
+
+
+class FullJitterBackoff(ExponentialBackoff):
+    """
+    Wait a random amount of time between ``0`` and the delay computed by
+    :class:`.ExponentialBackoff`.
+
+    Randomizing the entire window spreads out requests that failed at the
+    same moment so that they do not collide again on their next attempt.
+
+    """
+
+    def __call__(self, attempt, last_delay):
+        ceiling = super(FullJitterBackoff, self).__call__(attempt, last_delay)
+        return random.uniform(0, ceiling)
+
+
+class DecorrelatedJitterBackoff(object):
+    """
+    Wait a random amount of time between ``base`` and three times the
+    previous delay, capped at ``max_delay``.
+
+    """
+
+    def __init__(self, base=0.05, max_delay=1.0):
+        assert base >= 0
+        assert max_delay >= 0
+        self.base = base
+        self.max_delay = max_delay
+
+    def __call__(self, attempt, last_delay):
+        if last_delay is None:
+            last_delay = self.base
+        delay = random.uniform(self.base, max(self.base, last_delay * 3))
+        return min(self.max_delay, delay)
+
+
+#: A mapping of the names accepted by the ``retry.backoff`` setting to the
+#: strategy types they create.
+BACKOFF_STRATEGIES = {
+    'constant': ConstantBackoff,
+    'exponential': ExponentialBackoff,
+    'full_jitter': FullJitterBackoff,
+    'decorrelated_jitter': DecorrelatedJitterBackoff,
+}
+
+
+def backoff_from_settings(settings, maybe_dotted):
+    """
+    Create a backoff strategy from the ``retry.backoff.*`` settings.
+
+    ``retry.backoff`` may be the name of one of the builtin strategies or
+    a dotted python name to a backoff callable. Returns ``None`` if no
+    backoff is configured.
+
+    """
+    name = settings.get('retry.backoff')
+    if not name:
+        return None
+
+    factory = BACKOFF_STRATEGIES.get(name)
+    if factory is None:
+        return maybe_dotted(name)
+
+    kw = {}
+    base = settings.get('retry.backoff.base')
+    if base is not None:
+        kw['delay' if factory is ConstantBackoff else 'base'] = float(base)
+    max_delay = settings.get('retry.backoff.max_delay')
+    if max_delay is not None and factory is not ConstantBackoff:
+        kw['max_delay'] = float(max_delay)
+    return factory(**kw)
@@ -0,0 +1,233 @@
+"""
+Helpers for buffering the request body so that it can be read again by
+every attempt of a request.
+
+"""
+
+import io
+import mmap
+import shutil
+import tempfile
+from webob.request import DisconnectionError
+
+
+class MappedBody(io.RawIOBase):
+    """
+    A seekable, read-only file backed by a memory mapping of ``fileobj``.
+
+    Attempts reading the body are served directly from the page cache
+    instead of each holding its own copy of the body on the heap. The
+    mapping and ``fileobj`` are closed when this file is closed.
+
+    """
+
+    def __init__(self, fileobj):
+        super(MappedBody, self).__init__()
+        self._file = fileobj
+        self._mmap = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def __len__(self):
+        return len(self._mmap)
+
+    def tell(self):
+        return self._mmap.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._mmap.tell()
+        elif whence == io.SEEK_END:
+            offset += len(self._mmap)
+        offset = max(0, min(offset, len(self._mmap)))
+        self._mmap.seek(offset)
+        return offset
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._mmap) - self._mmap.tell()
+        return self._mmap.read(size)
+
+    def readinto(self, buffer):
+        data = self._mmap.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        mm = self._mmap
+        start = mm.tell()
+        end = mm.find(b'\n', start)
+        end = len(mm) if end < 0 else end + 1
+        if size is not None and size >= 0:
+            end = min(end, start + size)
+        mm.seek(end)
+        return mm[start:end]
+
+    def close(self):
+        if not self.closed:
+            self._mmap.close()
+            self._file.close()
+        super(MappedBody, self).close()
+
+
+class TeeInput(io.RawIOBase):
+    """
+    A seekable, read-only file which lazily reads up to ``length`` bytes from
+    the ``raw`` stream, keeping a copy of every byte read so far.
+
+    Bytes are only pulled from ``raw`` when the application reads (or seeks)
+    past the data that was already buffered. Rewinding replays the buffered
+    prefix and then continues with the unread remainder of ``raw``, so a
+    body that is never read is never copied.
+
+    The copy is held in memory unless ``max_memory`` is set, in which case
+    it is spooled to a temporary file once it grows larger than
+    ``max_memory`` bytes.
+
+    """
+
+    def __init__(self, raw, length, max_memory=None):
+        super(TeeInput, self).__init__()
+        self._raw = raw
+        self._length = length
+        self._pos = 0
+        self._buffered = 0
+        if max_memory is None:
+            self._buffer = io.BytesIO()
+        else:
+            self._buffer = tempfile.SpooledTemporaryFile(max_memory)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        return self._pos
+
+    def _tee(self, size):
+        data = self._raw.read(size)
+        if not data:
+            raise DisconnectionError(
+                'The client disconnected while sending the body '
+                '(%d more bytes were expected)'
+                % (self._length - self._buffered,)
+            )
+        self._buffer.seek(self._buffered)
+        self._buffer.write(data)
+        self._buffered += len(data)
+        return data
+
+    def readinto(self, buffer):
+        # pull in anything that was skipped over by seeking forward
+        while self._buffered < self._pos:
+            self._tee(min(self._pos - self._buffered, 65536))
+
+        size = min(len(buffer), self._length - self._pos)
+        if size <= 0:
+            return 0
+        if self._pos < self._buffered:
+            size = min(size, self._buffered - self._pos)
+            self._buffer.seek(self._pos)
+            data = self._buffer.read(size)
+        else:
+            data = self._tee(size)
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._buffer.close()
+        super(TeeInput, self).close()
+
+
+def make_body_replayable(request, max_memory=None, max_size=None, lazy=False):
+    """
+    Make the body of ``request`` seekable so that it can be read by every
+    attempt, returning ``False`` if the body is too large to be buffered.
+
+    Bodies with a ``Content-Length`` larger than ``max_memory`` bytes are
+    spooled directly to a temporary file and served to each attempt via a
+    :class:`.MappedBody`. Smaller bodies are buffered in memory. If
+    ``max_memory`` is ``None`` the buffering is left to
+    ``request.make_body_seekable()``.
+
+    If ``lazy`` is ``True`` and the ``Content-Length`` is known, the body is
+    wrapped in a :class:`.TeeInput` instead, such that bytes are only copied
+    as the application reads them.
+
+    If the body is larger than ``max_size`` bytes, or its size is not known
+    upfront, the body is left untouched and ``False`` is returned, in which
+    case the request should not be retried.
+
+    Requests without a body, such as most ``GET`` and ``HEAD`` requests, are
+    left untouched and ``True`` is returned.
+
+    """
+    if not request.is_body_readable:
+        return True
+    if request.is_body_seekable:
+        request.body_file_raw.seek(0)
+        return True
+
+    length = request.content_length
+    if max_size is not None and (length is None or length > max_size):
+        return False
+
+    if lazy and length is not None:
+        body = TeeInput(request.body_file_raw, length, max_memory)
+        request.body_file_raw = io.BufferedReader(body)
+        request.is_body_seekable = True
+        return True
+
+    if max_memory is None or length is None or length <= max_memory:
+        if max_memory is not None:
+            request.request_body_tempfile_limit = max_memory
+        request.make_body_seekable()
+        return True
+
+    fileobj = tempfile.TemporaryFile()
+    try:
+        shutil.copyfileobj(request.body_file, fileobj)
+        fileobj.flush()
+        body = MappedBody(fileobj)
+    except BaseException:
+        fileobj.close()
+        raise
+    request.body_file_raw = body
+    request.content_length = len(body)
+    request.is_body_seekable = True
+    return True
+
+
+def rewind_body(request):
+    """
+    Rewind the buffered body of ``request`` for the next attempt.
+
+    WebOb keeps the form data parsed into ``request.POST`` for later attempts
+    reading the same body, so the files of its multipart file parts are
+    rewound as well.
+
+    """
+    if request.is_body_seekable:
+        request.body_file_raw.seek(0)
+    parsed = request.environ.get('webob._parsed_post_vars')
+    if parsed is not None:
+        for value in parsed[0].values():
+            fileobj = getattr(value, 'file', None)
+            if fileobj is not None and not fileobj.closed:
+                fileobj.seek(0)
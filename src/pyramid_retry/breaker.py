@@ -0,0 +1,274 @@
+"""
+A circuit breaker which stops retrying a kind of error while retries of it
+keep failing.
+
+When a dependency is down, every retry of the errors it causes is wasted
+work which delays the response to the client. The breaker tracks whether
+the attempts following each kind of :term:`retryable error` succeed over a
+rolling window. Once too few succeed, the circuit for that kind of error
+opens and :func:`pyramid_retry.is_error_retryable` returns ``False`` for it,
+so requests fail fast. After a cooldown the circuit becomes half-open and a
+single request is allowed to retry as a probe. The circuit closes again if
+the probe succeeds and reopens otherwise.
+
+Circuits are keyed by the type of the exception and, optionally, by the name
+of the route matched by the failed attempt. Every change of state is
+announced with a :class:`.CircuitStateChanged` event.
+
+"""
+
+from pyramid.settings import asbool
+import threading
+import time
+from zope.interface import Attribute, Interface, implementer
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class IRetryCircuitBreaker(Interface):
+    """
+    The registry key for the :class:`.RetryCircuitBreaker` configured by
+    :func:`pyramid_retry.includeme`.
+
+    """
+
+
+class ICircuitStateChanged(Interface):
+    """
+    An event emitted when a circuit of a :class:`.RetryCircuitBreaker`
+    changes its state.
+
+    """
+
+    error = Attribute('The type of exception the circuit is tracking.')
+    route = Attribute(
+        'The name of the route the circuit is tracking or ``None``.'
+    )
+    old_state = Attribute('The previous state of the circuit.')
+    state = Attribute(
+        'The new state of the circuit, one of ``closed``, ``open`` or '
+        '``half-open``.'
+    )
+
+
+@implementer(ICircuitStateChanged)
+class CircuitStateChanged(object):
+    """
+    An event emitted when a circuit changes its state. See
+    :class:`.ICircuitStateChanged`.
+
+    """
+
+    __slots__ = ('error', 'route', 'old_state', 'state')
+
+    def __init__(self, error, route, old_state, state):
+        self.error = error
+        self.route = route
+        self.old_state = old_state
+        self.state = state
+
+
+class _Circuit(object):
+    __slots__ = (
+        'state',
+        'epochs',
+        'successes',
+        'failures',
+        'opened_at',
+        'probe_at',
+    )
+
+    def __init__(self, buckets):
+        self.state = CLOSED
+        self.epochs = [None] * buckets
+        self.successes = [0] * buckets
+        self.failures = [0] * buckets
+        self.opened_at = None
+        self.probe_at = None
+
+    def reset(self):
+        buckets = len(self.epochs)
+        self.epochs = [None] * buckets
+        self.successes = [0] * buckets
+        self.failures = [0] * buckets
+
+
+class RetryCircuitBreaker(object):
+    """
+    Open the circuit for a kind of error when fewer than ``threshold`` of
+    the attempts following it succeeded over the last ``window`` seconds,
+    once at least ``min_retries`` attempts were observed.
+
+    An open circuit becomes half-open after ``cooldown`` seconds, allowing a
+    single probe to retry. If the outcome of the probe is not recorded
+    within another ``cooldown`` seconds, another probe is allowed.
+
+    If ``per_route`` is ``True`` each route has its own circuits. At most
+    ``max_keys`` circuits are tracked, errors beyond this limit are always
+    allowed to retry.
+
+    ``notify`` is called with a :class:`.CircuitStateChanged` event whenever
+    a circuit changes its state, usually ``registry.notify``.
+
+    """
+
+    def __init__(
+        self,
+        threshold=0.5,
+        min_retries=20,
+        window=30.0,
+        buckets=6,
+        cooldown=10.0,
+        per_route=False,
+        max_keys=100,
+        notify=None,
+        clock=time.monotonic,
+    ):
+        assert 0 <= threshold <= 1
+        assert window > 0
+        assert buckets > 0
+        self.threshold = threshold
+        self.min_retries = min_retries
+        self.window = window
+        self.buckets = buckets
+        self.cooldown = cooldown
+        self.per_route = per_route
+        self.max_keys = max_keys
+        self.notify = notify
+        self.clock = clock
+        self._width = window / buckets
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def key(self, exc, route_name):
+        """
+        Return the key of the circuit tracking ``exc`` raised by an attempt
+        which matched the route named ``route_name`` or ``None``.
+
+        """
+        if self.per_route:
+            return (exc.__class__, route_name)
+        return (exc.__class__, None)
+
+    def state(self, key):
+        """Return the state of the circuit for ``key``."""
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            return CLOSED
+        return circuit.state
+
+    def _change(self, key, circuit, state):
+        old_state = circuit.state
+        circuit.state = state
+        return CircuitStateChanged(key[0], key[1], old_state, state)
+
+    def _emit(self, event):
+        if event is not None and self.notify is not None:
+            self.notify(event)
+
+    def allow(self, key):
+        """
+        Return ``True`` if an error tracked by the circuit for ``key`` may be
+        retried. A half-open circuit allows a single probe.
+
+        """
+        circuit = self._circuits.get(key)
+        if circuit is None or circuit.state == CLOSED:
+            return True
+
+        event = None
+        now = self.clock()
+        with self._lock:
+            if circuit.state == OPEN:
+                if now - circuit.opened_at < self.cooldown:
+                    return False
+                event = self._change(key, circuit, HALF_OPEN)
+            elif now - circuit.probe_at < self.cooldown:
+                return False
+            circuit.probe_at = now
+        self._emit(event)
+        return True
+
+    def record(self, key, success):
+        """
+        Record whether the attempt following an error tracked by the
+        circuit for ``key`` succeeded.
+
+        """
+        event = None
+        now = self.clock()
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                if len(self._circuits) >= self.max_keys:
+                    return
+                circuit = self._circuits[key] = _Circuit(self.buckets)
+
+            # the outcome of a probe decides the state of a half-open
+            # circuit, outcomes of retries allowed before the circuit
+            # opened are ignored
+            if circuit.state == HALF_OPEN:
+                if success:
+                    circuit.reset()
+                    event = self._change(key, circuit, CLOSED)
+                else:
+                    circuit.opened_at = now
+                    event = self._change(key, circuit, OPEN)
+
+            elif circuit.state == CLOSED:
+                epoch = int(now / self._width)
+                index = epoch % self.buckets
+                if circuit.epochs[index] != epoch:
+                    circuit.epochs[index] = epoch
+                    circuit.successes[index] = 0
+                    circuit.failures[index] = 0
+                if success:
+                    circuit.successes[index] += 1
+                else:
+                    circuit.failures[index] += 1
+
+                oldest = epoch - self.buckets
+                successes = failures = 0
+                for index, bucket_epoch in enumerate(circuit.epochs):
+                    if bucket_epoch is not None and bucket_epoch > oldest:
+                        successes += circuit.successes[index]
+                        failures += circuit.failures[index]
+                total = successes + failures
+                if (
+                    total >= self.min_retries
+                    and successes < self.threshold * total
+                ):
+                    circuit.opened_at = now
+                    event = self._change(key, circuit, OPEN)
+        self._emit(event)
+
+
+def breaker_from_settings(settings, notify=None):
+    """
+    Create a :class:`.RetryCircuitBreaker` from the ``retry.breaker.*``
+    settings.
+
+    Returns ``None`` unless ``retry.breaker.threshold`` is set. The
+    ``retry.breaker.min_retries``, ``retry.breaker.window``,
+    ``retry.breaker.cooldown`` and ``retry.breaker.per_route`` settings are
+    optional.
+
+    """
+    threshold = settings.get('retry.breaker.threshold')
+    if threshold is None:
+        return None
+
+    kw = {'threshold': float(threshold), 'notify': notify}
+    min_retries = settings.get('retry.breaker.min_retries')
+    if min_retries is not None:
+        kw['min_retries'] = int(min_retries)
+    window = settings.get('retry.breaker.window')
+    if window is not None:
+        kw['window'] = float(window)
+    cooldown = settings.get('retry.breaker.cooldown')
+    if cooldown is not None:
+        kw['cooldown'] = float(cooldown)
+    kw['per_route'] = asbool(settings.get('retry.breaker.per_route'))
+    return RetryCircuitBreaker(**kw)
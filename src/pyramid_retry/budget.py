@@ -0,0 +1,239 @@
+"""
+A retry budget limits the number of retries issued by
+:func:`pyramid_retry.RetryableExecutionPolicy` relative to the number of
+requests that were received.
+
+When a dependency degrades, every request that fails would otherwise be
+retried up to ``retry.attempts`` times, multiplying the load on the very
+dependency that is struggling. A budget caps retries to a fraction of the
+recent traffic so that retries can smooth over transient errors without
+turning a brownout into an outage.
+
+The counters backing a budget are stored in a :term:`budget backend`.
+:class:`.InProcessCounters` is used by default and is shared by all threads
+in a process. :class:`.SharedMemoryCounters` is shared by all processes
+forked from the process that created it.
+
+"""
+
+import mmap
+import multiprocessing
+import threading
+import time
+
+REQUESTS = 0
+RETRIES = 1
+
+
+class InProcessCounters(object):
+    """
+    A :term:`budget backend` storing a ring of ``buckets`` windowed counters
+    in the memory of the current process.
+
+    Incrementing a counter holds a lock long enough to recycle a stale slot
+    and bump an integer. Reading the totals does not lock at all, a
+    concurrent update may be missed which is an acceptable error for a
+    budget.
+
+    """
+
+    def __init__(self, buckets):
+        assert buckets > 0
+        self.buckets = buckets
+        self._epochs = [None] * buckets
+        self._counts = [[0] * buckets, [0] * buckets]
+        self._lock = threading.Lock()
+
+    def increment(self, epoch, counter):
+        """
+        Add one to ``counter`` (either ``REQUESTS`` or ``RETRIES``) in the
+        slot for ``epoch``.
+
+        """
+        index = epoch % self.buckets
+        with self._lock:
+            if self._epochs[index] != epoch:
+                for counts in self._counts:
+                    counts[index] = 0
+                self._epochs[index] = epoch
+            self._counts[counter][index] += 1
+
+    def totals(self, oldest):
+        """
+        Return a ``(requests, retries)`` tuple summing every slot with an epoch
+        newer than ``oldest``.
+
+        """
+        requests = retries = 0
+        for index, epoch in enumerate(self._epochs):
+            if epoch is not None and epoch > oldest:
+                requests += self._counts[REQUESTS][index]
+                retries += self._counts[RETRIES][index]
+        return requests, retries
+
+
+class SharedMemoryCounters(object):
+    """
+    A :term:`budget backend` storing a ring of ``buckets`` windowed counters
+    in an anonymous shared memory mapping.
+
+    The mapping is inherited by any process forked after the counters are
+    created, so all workers of a pre-forking server such as gunicorn draw
+    from a single budget as long as the application is loaded before the
+    workers are forked (for example using gunicorn's ``--preload`` option).
+
+    Each slot is three aligned 64-bit integers. Increments are serialized by
+    a process-shared lock while reads are lock-free, mirroring
+    :class:`.InProcessCounters`.
+
+    A worker killed while holding the lock never releases it. An increment
+    waiting longer than ``lock_timeout`` seconds for the lock is skipped
+    instead, and from then on the process no longer waits for the lock,
+    skipping any increment that finds it taken. The budget tolerates missed
+    updates, at worst falling back to ``min_retries_per_second``.
+
+    """
+
+    _fields = 3  # epoch, requests, retries
+
+    #: Seconds an increment waits for the lock before it is skipped.
+    lock_timeout = 0.01
+
+    def __init__(self, buckets):
+        assert buckets > 0
+        self.buckets = buckets
+        self._mmap = mmap.mmap(-1, buckets * self._fields * 8)
+        self._slots = memoryview(self._mmap).cast('q')
+        for index in range(buckets):
+            self._slots[index * self._fields] = -1
+        self._lock = multiprocessing.Lock()
+        self._timeout = self.lock_timeout
+
+    def increment(self, epoch, counter):
+        """
+        Add one to ``counter`` (either ``REQUESTS`` or ``RETRIES``) in the
+        slot for ``epoch``.
+
+        """
+        slots = self._slots
+        offset = (epoch % self.buckets) * self._fields
+        if not self._lock.acquire(timeout=self._timeout):
+            # the lock may have been abandoned by a dead worker, stop waiting
+            self._timeout = 0
+            return
+        try:
+            if slots[offset] != epoch:
+                slots[offset + 1 + REQUESTS] = 0
+                slots[offset + 1 + RETRIES] = 0
+                slots[offset] = epoch
+            slots[offset + 1 + counter] += 1
+        finally:
+            self._lock.release()
+
+    def totals(self, oldest):
+        """
+        Return a ``(requests, retries)`` tuple summing every slot with an epoch
+        newer than ``oldest``.
+
+        """
+        slots = self._slots
+        requests = retries = 0
+        for offset in range(0, len(slots), self._fields):
+            if slots[offset] > oldest:
+                requests += slots[offset + 1 + REQUESTS]
+                retries += slots[offset + 1 + RETRIES]
+        return requests, retries
+
+
+class RetryBudget(object):
+    """
+    Allow at most ``ratio`` retries per request plus ``min_retries_per_second``
+    retries per second, measured over a sliding ``window`` of seconds.
+
+    The window is divided into ``buckets`` slots which are recycled as time
+    passes so that the memory used by the budget is fixed. The slots are
+    stored in a :term:`budget backend` created by calling
+    ``backend(buckets)``, defaulting to :class:`.InProcessCounters`.
+
+    ``clock`` must return seconds from a clock that is consistent between
+    all users of the backend. The default ``time.monotonic`` is system-wide
+    on Linux and is thus safe to use with :class:`.SharedMemoryCounters`.
+
+    """
+
+    def __init__(
+        self,
+        ratio=0.1,
+        min_retries_per_second=10,
+        window=10.0,
+        buckets=10,
+        clock=time.monotonic,
+        backend=InProcessCounters,
+    ):
+        assert ratio >= 0
+        assert min_retries_per_second >= 0
+        assert window > 0
+        self.ratio = ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.window = window
+        self.clock = clock
+        self.counters = backend(buckets)
+        self._width = window / buckets
+
+    def _epoch(self):
+        return int(self.clock() / self._width)
+
+    def record_request(self):
+        """Record that a new request has started its first attempt."""
+        self.counters.increment(self._epoch(), REQUESTS)
+
+    def record_retry(self):
+        """Record that a request is starting another attempt."""
+        self.counters.increment(self._epoch(), RETRIES)
+
+    def can_retry(self):
+        """
+        Return ``True`` if issuing another retry would stay within the budget.
+
+        """
+        oldest = self._epoch() - self.counters.buckets
+        requests, retries = self.counters.totals(oldest)
+        allowed = (
+            requests * self.ratio + self.min_retries_per_second * self.window
+        )
+        return retries < allowed
+
+
+#: A mapping of the names accepted by the ``retry.budget.backend`` setting to
+#: the :term:`budget backend` types they create.
+BUDGET_BACKENDS = {
+    'memory': InProcessCounters,
+    'shared': SharedMemoryCounters,
+}
+
+
+def budget_from_settings(settings, maybe_dotted):
+    """
+    Create a :class:`.RetryBudget` from the ``retry.budget.*`` settings.
+
+    ``retry.budget.backend`` may be ``memory``, ``shared`` or a dotted
+    python name to a :term:`budget backend` factory.
+
+    Returns ``None`` unless ``retry.budget.ratio`` is set.
+
+    """
+    ratio = settings.get('retry.budget.ratio')
+    if ratio is None:
+        return None
+
+    kw = {'ratio': float(ratio)}
+    min_retries = settings.get('retry.budget.min_retries_per_second')
+    if min_retries is not None:
+        kw['min_retries_per_second'] = float(min_retries)
+    window = settings.get('retry.budget.window')
+    if window is not None:
+        kw['window'] = float(window)
+    backend = settings.get('retry.budget.backend')
+    if backend:
+        kw['backend'] = BUDGET_BACKENDS.get(backend) or maybe_dotted(backend)
+    return RetryBudget(**kw)
@@ -0,0 +1,132 @@
+"""
+Serialization of retries which conflict on the same resource.
+
+When several requests fail with a serialization failure on the same hot row,
+retrying them in parallel makes them likely to collide again, sometimes for
+every attempt. A :class:`.ConflictSerializer` derives a conflict key from
+the failed request or its exception, for example the id of the resource or
+the table named by the database error, and runs the later attempts of
+requests with the same key one at a time. Requests with different keys, or
+without a key, still run in parallel.
+
+The locks are kept in a bounded least-recently-used table. A lock is only
+evicted while no request holds or waits for it, so the table may briefly
+grow beyond its bound under heavy contention.
+
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class _Entry(object):
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+class ConflictSerializer(object):
+    """
+    Serialize retried attempts by the conflict key returned by
+    ``key_func(request, exc)``, which may return ``None`` if the failure is
+    not tied to a particular resource.
+
+    At most ``max_keys`` unused locks are kept. A request waits up to
+    ``timeout`` seconds for the lock of its key, or forever if ``timeout``
+    is ``None``, after which the attempt runs as the last attempt for the
+    request without holding the lock. The execution policy waits no longer
+    than the time left before the deadline of the request, if any, minus
+    the estimated duration of an attempt.
+
+    """
+
+    def __init__(self, key_func, max_keys=1024, timeout=5.0):
+        assert max_keys > 0
+        assert timeout is None or timeout >= 0
+        self.key_func = key_func
+        self.max_keys = max_keys
+        self.timeout = timeout
+        self._locks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, request, exc):
+        """
+        Return the conflict key of ``request`` which failed with ``exc`` or
+        ``None``.
+
+        """
+        return self.key_func(request, exc)
+
+    def acquire(self, key, max_wait=None):
+        """
+        Lock ``key``, returning an opaque handle to be passed to
+        :meth:`.release` or ``None`` if the lock could not be acquired
+        within ``timeout`` seconds, or within ``max_wait`` seconds if it is
+        set and shorter.
+
+        """
+        locks = self._locks
+        with self._lock:
+            entry = locks.get(key)
+            if entry is None:
+                entry = locks[key] = _Entry()
+                entry.users += 1
+                if len(locks) > self.max_keys:
+                    self._evict()
+            else:
+                locks.move_to_end(key)
+                entry.users += 1
+
+        timeout = self.timeout
+        if max_wait is not None:
+            max_wait = max(max_wait, 0)
+            timeout = max_wait if timeout is None else min(timeout, max_wait)
+        if entry.lock.acquire(timeout=-1 if timeout is None else timeout):
+            return entry
+        with self._lock:
+            entry.users -= 1
+        return None
+
+    def release(self, entry):
+        """Unlock the handle returned by :meth:`.acquire`."""
+        entry.lock.release()
+        with self._lock:
+            entry.users -= 1
+
+    def _evict(self):
+        locks = self._locks
+        excess = len(locks) - self.max_keys
+        unused = []
+        for key, entry in locks.items():
+            if entry.users == 0:
+                unused.append(key)
+                if len(unused) == excess:
+                    break
+        for key in unused:
+            del locks[key]
+
+
+def serializer_from_settings(settings, maybe_dotted):
+    """
+    Create a :class:`.ConflictSerializer` from the ``retry.conflict_key.*``
+    settings.
+
+    ``retry.conflict_key`` is a dotted python name to the key function.
+    ``retry.conflict_key.max_keys`` and ``retry.conflict_key.timeout`` are
+    optional. Returns ``None`` unless ``retry.conflict_key`` is set.
+
+    """
+    key_func = settings.get('retry.conflict_key')
+    if not key_func:
+        return None
+
+    kw = {}
+    max_keys = settings.get('retry.conflict_key.max_keys')
+    if max_keys is not None:
+        kw['max_keys'] = int(max_keys)
+    timeout = settings.get('retry.conflict_key.timeout')
+    if timeout is not None:
+        kw['timeout'] = float(timeout)
+    return ConflictSerializer(maybe_dotted(key_func), **kw)
@@ -0,0 +1,148 @@
+"""
+Request deadlines which stop :func:`pyramid_retry.RetryableExecutionPolicy`
+from starting attempts that cannot finish in time.
+
+A request is usually abandoned by a load balancer or client after a fixed
+timeout. Once too little time remains to complete another attempt, retrying
+only wastes work on the application and its database. When a deadline is
+known, each attempt is treated as the last attempt, see
+:func:`pyramid_retry.is_last_attempt`, unless the remaining time fits this
+attempt, the backoff before the next one and the next attempt itself.
+
+The deadline of a request is the earliest of:
+
+- ``environ['retry.deadline']``, an absolute ``time.time()`` timestamp set
+  by a WSGI middleware or the server.
+
+- The request header named by ``header``, holding the number of seconds the
+  client is willing to wait, by default ``X-Request-Deadline``.
+
+- ``timeout`` seconds after the policy started handling the request.
+
+The duration of an attempt is estimated from an exponentially weighted
+moving average of recent attempts matching the same route, falling back to
+the average of all attempts for the first attempt of a request, which runs
+before routing, and for routes beyond the bounded number that is tracked.
+
+"""
+
+import time
+
+
+class Deadlines(object):
+    """
+    Compute the deadline of a request and estimate the duration of its
+    attempts.
+
+    ``timeout`` is the default number of seconds a request may take,
+    ``None`` if requests without another deadline are unlimited.
+
+    ``header`` is the name of a request header holding the number of seconds
+    remaining until the deadline, or ``None`` to ignore request headers.
+
+    ``alpha`` is the weight given to the latest duration in the moving
+    averages and ``max_routes`` bounds the number of routes tracked.
+
+    """
+
+    def __init__(
+        self,
+        timeout=None,
+        header='X-Request-Deadline',
+        alpha=0.2,
+        max_routes=100,
+    ):
+        assert timeout is None or timeout > 0
+        assert 0 < alpha <= 1
+        self.timeout = timeout
+        self.header = header
+        self.alpha = alpha
+        self.max_routes = max_routes
+        self._estimates = {}
+
+    def deadline(self, request):
+        """
+        Return the deadline of ``request`` in ``time.monotonic()`` seconds or
+        ``None`` if it has none.
+
+        """
+        now = time.monotonic()
+        remaining = self.timeout
+        if self.header is not None:
+            value = request.headers.get(self.header)
+            if value is not None:
+                try:
+                    value = float(value)
+                except ValueError:
+                    value = None
+                if value is not None and (
+                    remaining is None or value < remaining
+                ):
+                    remaining = value
+        value = request.environ.get('retry.deadline')
+        if value is not None:
+            value = float(value) - time.time()
+            if remaining is None or value < remaining:
+                remaining = value
+        if remaining is None:
+            return None
+        return now + remaining
+
+    def record(self, route_name, duration):
+        """
+        Record the ``duration`` in seconds of an attempt which matched the
+        route named ``route_name`` or ``None``.
+
+        """
+        estimates = self._estimates
+        self._update(None, duration)
+        if route_name is not None and (
+            route_name in estimates or len(estimates) <= self.max_routes
+        ):
+            self._update(route_name, duration)
+
+    def _update(self, key, duration):
+        previous = self._estimates.get(key)
+        if previous is None:
+            self._estimates[key] = duration
+        else:
+            self._estimates[key] = previous + self.alpha * (
+                duration - previous
+            )
+
+    def estimate(self, route_name):
+        """
+        Return the estimated duration in seconds of an attempt matching the
+        route named ``route_name``, or of any attempt if ``route_name`` is
+        ``None`` or not tracked. Returns ``0.0`` until an attempt was
+        recorded.
+
+        """
+        estimates = self._estimates
+        estimate = estimates.get(route_name)
+        if estimate is None:
+            estimate = estimates.get(None, 0.0)
+        return estimate
+
+
+def deadlines_from_settings(settings):
+    """
+    Create a :class:`.Deadlines` from the ``retry.deadline.*`` settings.
+
+    ``retry.deadline`` is the default timeout in seconds and
+    ``retry.deadline.header`` names the request header to read, an empty
+    value disables reading a header. Returns ``None`` unless one of the
+    settings is set.
+
+    """
+    timeout = settings.get('retry.deadline')
+    header = settings.get('retry.deadline.header')
+    if timeout is None and header is None:
+        return None
+
+    kw = {}
+    if timeout is not None:
+        kw['timeout'] = float(timeout)
+    if header is not None:
+        kw['header'] = header or None
+    return Deadlines(**kw)
@@ -0,0 +1,309 @@
+"""
+Hedged attempts for idempotent requests.
+
+When the first attempt of a request matching a retry rule with
+``hedge=True`` has not completed after a latency threshold, a second,
+speculative attempt is started in parallel and whichever attempt completes
+first is used. This trims the tail latency caused by occasionally slow
+dependencies, such as a lagging database replica, which never raise an
+error that could be retried.
+
+Both attempts run on a bounded pool of threads, each with its own copy of
+the ``environ`` and its own request object. The attempt which loses the race
+is cancelled if it has not started yet, otherwise it is flagged via
+``environ['retry.hedge.cancelled']`` and its response is closed once it
+completes. Hedges are drawn from a :class:`pyramid_retry.budget.RetryBudget`
+so that they cannot double the load on a struggling dependency.
+
+Only requests without a body are hedged, and only on their first attempt.
+
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextvars
+import os
+import threading
+import time
+import weakref
+
+from .budget import RetryBudget
+from .stats import Histogram
+
+
+class LatencyEstimator(object):
+    """
+    Estimate the ``percentile`` of the duration of recent attempts.
+
+    Durations are recorded in a pair of fixed-bucket histograms which are
+    rotated every ``window`` seconds, such that the estimate reflects
+    between one and two windows worth of attempts. No estimate is made
+    until at least ``min_samples`` durations were recorded.
+
+    """
+
+    #: The number of seconds an estimate is reused before it is recomputed.
+    refresh = 1.0
+
+    def __init__(
+        self,
+        percentile=0.95,
+        min_samples=20,
+        window=60.0,
+        clock=time.monotonic,
+    ):
+        assert 0 < percentile <= 1
+        assert window > 0
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.clock = clock
+        self._current = Histogram()
+        self._previous = Histogram()
+        self._rotated_at = clock()
+        self._estimate = None
+        self._estimated_at = None
+
+    def _rotate(self, now):
+        if now - self._rotated_at >= self.window:
+            self._previous = self._current
+            self._current = Histogram()
+            self._rotated_at = now
+
+    def record(self, duration):
+        """Record the ``duration`` of an attempt in seconds."""
+        self._rotate(self.clock())
+        self._current.record(duration * 1000)
+
+    def estimate(self):
+        """
+        Return the estimated duration in seconds or ``None`` if there are
+        not enough samples.
+
+        """
+        now = self.clock()
+        estimated_at = self._estimated_at
+        if estimated_at is not None and now - estimated_at < self.refresh:
+            return self._estimate
+
+        self._rotate(now)
+        combined = Histogram()
+        counts = combined.counts
+        for source in (self._previous.counts, self._current.counts):
+            for index, count in enumerate(source):
+                counts[index] += count
+        if sum(counts) < self.min_samples:
+            estimate = None
+        else:
+            estimate = combined.percentile(self.percentile) / 1000
+        self._estimate = estimate
+        self._estimated_at = now
+        return estimate
+
+
+class Hedger(object):
+    """
+    Run the first attempt of a request on a pool of ``max_workers`` threads
+    and start a hedged attempt if it is still running after a threshold.
+
+    The threshold is ``delay`` seconds if set, otherwise it is the
+    ``percentile`` of the durations of recent attempts matching the same
+    rule, see :class:`.LatencyEstimator`. Until enough attempts were
+    observed, requests run as usual in the calling thread.
+
+    Every hedged request is recorded in ``budget`` and each hedge counts as
+    a retry. By default the budget allows hedging 5% of the requests plus
+    one request per second.
+
+    If the pool has no free thread, the request is not hedged and runs in
+    the calling thread. The pool is started on first use, including after
+    the process was forked.
+
+    """
+
+    def __init__(
+        self,
+        max_workers=10,
+        delay=None,
+        percentile=0.95,
+        min_samples=20,
+        window=60.0,
+        budget=None,
+    ):
+        assert max_workers > 1
+        assert delay is None or delay >= 0
+        self.max_workers = max_workers
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        if budget is None:
+            budget = RetryBudget(ratio=0.05, min_retries_per_second=1)
+        self.budget = budget
+        self._estimators = {}
+        self._lock = threading.Lock()
+        self._reset()
+        _hedgers.add(self)
+
+    def _reset(self):
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+
+    def _estimator(self, key):
+        estimator = self._estimators.get(key)
+        if estimator is None:
+            with self._lock:
+                estimator = self._estimators.get(key)
+                if estimator is None:
+                    estimator = self._estimators[key] = LatencyEstimator(
+                        self.percentile, self.min_samples, self.window
+                    )
+        return estimator
+
+    def _submit(self, func, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            return None
+        try:
+            executor = self._executor
+            if executor is None:
+                with self._lock:
+                    executor = self._executor
+                    if executor is None:
+                        executor = self._executor = ThreadPoolExecutor(
+                            self.max_workers,
+                            thread_name_prefix='pyramid_retry-hedge',
+                        )
+            # run the attempt in a copy of the current context such that
+            # context variables, for example the active tracing span, are
+            # visible to the attempt
+            context = contextvars.copy_context()
+            future = executor.submit(context.run, func, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda future: slots.release())
+        return future
+
+    def invoke(self, router, request, key):
+        """
+        Invoke the first attempt of ``request`` via ``router``, hedging it
+        if it takes too long. ``key`` identifies the rule whose latency is
+        used to compute the threshold.
+
+        Returns a ``(request, response)`` tuple from the attempt which
+        completed first, or raises its exception. The returned request is
+        ``request`` itself unless the attempt ran on the pool.
+
+        """
+        self.budget.record_request()
+        estimator = self._estimator(key)
+        threshold = self.delay
+        if threshold is None:
+            threshold = estimator.estimate()
+
+        primary = None
+        if threshold is not None and not request.is_body_readable:
+            primary_environ = dict(request.environ)
+            primary = self._submit(
+                _attempt, router, primary_environ, estimator
+            )
+        if primary is None:
+            started = time.monotonic()
+            try:
+                return request, router.invoke_request(request)
+            finally:
+                estimator.record(time.monotonic() - started)
+
+        done, _ = wait([primary], timeout=threshold)
+        if not done and self.budget.can_retry():
+            environ = dict(request.environ)
+            environ['retry.hedge'] = True
+            hedge = self._submit(_attempt, router, environ, estimator)
+            if hedge is not None:
+                self.budget.record_retry()
+                done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+                if primary in done:
+                    _discard(hedge, environ)
+                else:
+                    _discard(primary, primary_environ)
+                    return hedge.result()
+        return primary.result()
+
+
+def _attempt(router, environ, estimator):
+    started = time.monotonic()
+    request_ctx = router.request_context(environ)
+    request = request_ctx.begin()
+    try:
+        return request, router.invoke_request(request)
+    finally:
+        request_ctx.end()
+        estimator.record(time.monotonic() - started)
+
+
+def _discard(future, environ):
+    if future.cancel():
+        return
+    environ['retry.hedge.cancelled'] = True
+    future.add_done_callback(_close_result)
+
+
+def _close_result(future):
+    if future.exception() is None:
+        _, response = future.result()
+        close = getattr(response.app_iter, 'close', None)
+        if close is not None:
+            close()
+
+
+_hedgers = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for hedger in list(_hedgers):
+        hedger._reset()
+
+
+# os.register_at_fork is not available on Windows
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def hedger_from_settings(settings):
+    """
+    Create a :class:`.Hedger` from the ``retry.hedge.*`` settings.
+
+    Returns ``None`` unless ``retry.hedge.workers`` is set. The
+    ``retry.hedge.delay``, ``retry.hedge.percentile`` and
+    ``retry.hedge.min_samples`` settings tune the threshold while
+    ``retry.hedge.ratio`` and ``retry.hedge.min_per_second`` tune the
+    budget.
+
+    """
+    workers = settings.get('retry.hedge.workers')
+    if workers is None:
+        return None
+
+    kw = {'max_workers': int(workers)}
+    delay = settings.get('retry.hedge.delay')
+    if delay is not None:
+        kw['delay'] = float(delay)
+    percentile = settings.get('retry.hedge.percentile')
+    if percentile is not None:
+        kw['percentile'] = float(percentile)
+    min_samples = settings.get('retry.hedge.min_samples')
+    if min_samples is not None:
+        kw['min_samples'] = int(min_samples)
+
+    budget_kw = {}
+    ratio = settings.get('retry.hedge.ratio')
+    if ratio is not None:
+        budget_kw['ratio'] = float(ratio)
+    min_per_second = settings.get('retry.hedge.min_per_second')
+    if min_per_second is not None:
+        budget_kw['min_retries_per_second'] = float(min_per_second)
+    if budget_kw:
+        budget_kw.setdefault('ratio', 0.05)
+        budget_kw.setdefault('min_retries_per_second', 1)
+        kw['budget'] = RetryBudget(**budget_kw)
+    return Hedger(**kw)
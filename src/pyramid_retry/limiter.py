@@ -0,0 +1,125 @@
+"""
+A limit on the number of requests executing a retry at the same time.
+
+A burst of conflicts, for example on a few hot rows, puts many threads into
+a retry at once, and they are likely to conflict with each other again.
+:class:`.RetryLimiter` caps the number of attempts after the first which
+may run concurrently within a process. A request takes a slot as soon as an
+attempt fails with a retryable error, before any backoff, and holds it until
+its last attempt completes.
+
+A failed attempt which cannot get a slot within a short ``timeout`` is not
+retried, its error is raised or its error response returned as if it was the
+last attempt. While every slot is taken, attempts that are about to start
+are also demoted upfront, so that :func:`pyramid_retry.is_last_attempt` and
+the exception views of the attempt see that it will not be retried.
+
+While an attempt runs, the execution policy stores a :class:`.RetrySlot` in
+the ``environ`` under ``retry.slot``. The tween enabled by the
+``retry.skip_exception_views`` setting takes the slot through it before it
+replaces a retryable error with an empty response, such that an error which
+cannot be retried is still rendered by its exception view.
+
+"""
+
+import threading
+
+
+class RetryLimiter(object):
+    """
+    Allow at most ``max_concurrent`` retried attempts at once, waiting up to
+    ``timeout`` seconds for a slot.
+
+    """
+
+    def __init__(self, max_concurrent, timeout=0.05):
+        assert max_concurrent > 0
+        assert timeout >= 0
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.active = 0
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def saturated(self):
+        """Return ``True`` if every slot is taken."""
+        return self.active >= self.max_concurrent
+
+    def acquire(self):
+        """
+        Take a slot, waiting up to ``timeout`` seconds. Returns ``True`` if a
+        slot was taken which must be given back with :meth:`.release`.
+
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            return False
+        with self._lock:
+            self.active += 1
+        return True
+
+    def release(self):
+        """Give back a slot taken by :meth:`.acquire`."""
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+
+class RetrySlot(object):
+    """
+    The slot of ``limiter`` which the current attempt of a request holds for
+    its next attempt, if ``held`` is ``True``.
+
+    The slot may be taken by any thread running the attempt, including the
+    threads of hedged attempts which share it, until the attempt is over and
+    ``held`` becomes ``None``.
+
+    """
+
+    __slots__ = ('limiter', 'held', '_lock')
+
+    def __init__(self, limiter, held=False):
+        self.limiter = limiter
+        self.held = held
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a slot unless one is held already. Returns ``False`` if no slot
+        could be taken or the attempt is over.
+
+        """
+        with self._lock:
+            if self.held is False:
+                self.held = self.limiter.acquire()
+            return self.held is True
+
+    def close(self):
+        """
+        End the attempt, returning ``True`` if a slot is held which is then
+        owned by the caller.
+
+        """
+        with self._lock:
+            held, self.held = self.held, None
+        return held is True
+
+
+def limiter_from_settings(settings):
+    """
+    Create a :class:`.RetryLimiter` from the ``retry.concurrency.*``
+    settings.
+
+    Returns ``None`` unless ``retry.concurrency.limit`` is set.
+    ``retry.concurrency.timeout`` is the number of seconds to wait for a
+    slot.
+
+    """
+    limit = settings.get('retry.concurrency.limit')
+    if limit is None:
+        return None
+
+    kw = {}
+    timeout = settings.get('retry.concurrency.timeout')
+    if timeout is not None:
+        kw['timeout'] = float(timeout)
+    return RetryLimiter(int(limit), **kw)
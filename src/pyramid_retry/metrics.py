@@ -0,0 +1,279 @@
+"""
+Metrics describing the attempts made by
+:func:`pyramid_retry.RetryableExecutionPolicy`.
+
+The policy reports to a :term:`metrics sink`, any object implementing
+:class:`.IRetryMetrics`. The following metrics are reported, tagged with the
+name of the exception class where one is involved:
+
+``first_attempts``
+    A counter incremented for every request handled by the policy.
+
+``retries``
+    A counter incremented for every attempt after the first.
+
+``exhausted``
+    A counter incremented for every request which failed with a
+    :term:`retryable error` on its last attempt.
+
+``recovered``
+    A counter incremented for every request which succeeded after being
+    retried at least once.
+
+``attempt_duration``
+    A histogram of the time spent in each attempt, in milliseconds. It is
+    also tagged with the name of the matched route, if any.
+
+``attempts_per_request``
+    A histogram of the number of attempts made for each request.
+
+:class:`.BatchingMetrics` aggregates these in memory and hands them to an
+emitter such as :class:`.StatsdEmitter` in batches from a background thread,
+so recording a metric only costs a dictionary update.
+
+"""
+
+import logging
+import os
+import socket
+import threading
+import weakref
+from zope.interface import Interface
+
+log = logging.getLogger(__name__)
+
+
+class IRetryMetrics(Interface):
+    """
+    A :term:`metrics sink` receiving the metrics reported by the
+    ``pyramid_retry`` execution policy. It is also the registry key for the
+    sink configured by :func:`pyramid_retry.includeme`.
+
+    ``tags`` is a tuple of ``(key, value)`` pairs.
+
+    """
+
+    def increment(name, tags=()):
+        """Add one to the counter ``name``."""
+
+    def observe(name, value, tags=()):
+        """Record ``value`` in the histogram ``name``."""
+
+
+class CompositeMetrics(object):
+    """
+    A :term:`metrics sink` passing every metric on to each of ``sinks``.
+
+    """
+
+    def __init__(self, sinks):
+        self.sinks = tuple(sinks)
+
+    def increment(self, name, tags=()):
+        for sink in self.sinks:
+            sink.increment(name, tags)
+
+    def observe(self, name, value, tags=()):
+        for sink in self.sinks:
+            sink.observe(name, value, tags)
+
+
+class BatchingMetrics(object):
+    """
+    A :term:`metrics sink` which aggregates metrics in memory and passes
+    them to ``emitter`` every ``interval`` seconds from a background thread.
+
+    ``emitter`` is called with ``(counters, histograms)`` where
+    ``counters`` maps ``(name, tags)`` keys to the amount the counter grew
+    since the last batch and ``histograms`` maps ``(name, tags)`` keys to a
+    list of the observed values. At most ``max_samples`` values are kept per
+    histogram and batch, later values are dropped.
+
+    The thread is started on first use, including after the process was
+    forked, in which case the metrics aggregated by the parent are dropped
+    from the child.
+
+    """
+
+    def __init__(self, emitter, interval=10.0, max_samples=1000):
+        assert interval > 0
+        self.emitter = emitter
+        self.interval = interval
+        self.max_samples = max_samples
+        self._reset()
+        _batching_sinks.add(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def increment(self, name, tags=()):
+        key = (name, tags)
+        with self._lock:
+            counters = self._counters
+            counters[key] = counters.get(key, 0) + 1
+        if self._thread is None:
+            self._start()
+
+    def observe(self, name, value, tags=()):
+        key = (name, tags)
+        with self._lock:
+            samples = self._histograms.setdefault(key, [])
+            if len(samples) < self.max_samples:
+                samples.append(value)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or self._stopped.is_set():
+                return
+            thread = threading.Thread(
+                target=self._run, name='pyramid_retry metrics', daemon=True
+            )
+            self._thread = thread
+        thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Pass everything aggregated so far to the emitter."""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+        if counters or histograms:
+            try:
+                self.emitter(counters, histograms)
+            except Exception:
+                log.exception('failed to emit pyramid_retry metrics')
+
+    def close(self):
+        """Stop the background thread and emit the last batch."""
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+
+_batching_sinks = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for sink in list(_batching_sinks):
+        sink._reset()
+
+
+# os.register_at_fork is not available on Windows
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class StatsdEmitter(object):
+    """
+    An emitter for :class:`.BatchingMetrics` which sends each batch to a
+    statsd server at ``host`` and ``port`` over UDP.
+
+    Counters are sent as ``c`` metrics and histograms as ``ms`` timers.
+    Tags are appended using the widely supported DogStatsD ``|#key:value``
+    extension. Metric names are prefixed with ``prefix`` followed by a dot.
+    Lines are packed into datagrams of at most ``max_packet_size`` bytes and
+    errors sending a datagram are ignored, as is usual for statsd.
+
+    """
+
+    def __init__(
+        self,
+        host='127.0.0.1',
+        port=8125,
+        prefix='pyramid_retry',
+        max_packet_size=1432,
+    ):
+        family, _, _, _, address = socket.getaddrinfo(
+            host, port, type=socket.SOCK_DGRAM
+        )[0]
+        self.address = address
+        self.prefix = prefix + '.' if prefix else ''
+        self.max_packet_size = max_packet_size
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+
+    def _format(self, name, value, kind, tags):
+        line = '%s%s:%s|%s' % (self.prefix, name, _format_value(value), kind)
+        if tags:
+            line += '|#' + ','.join('%s:%s' % tag for tag in tags)
+        return line.encode('utf-8')
+
+    def __call__(self, counters, histograms):
+        lines = [
+            self._format(name, value, 'c', tags)
+            for (name, tags), value in counters.items()
+        ]
+        for (name, tags), values in histograms.items():
+            for value in values:
+                lines.append(self._format(name, value, 'ms', tags))
+
+        packet = b''
+        for line in lines:
+            if packet and len(packet) + 1 + len(line) > self.max_packet_size:
+                self._send(packet)
+                packet = b''
+            packet = packet + b'\n' + line if packet else line
+        if packet:
+            self._send(packet)
+
+    def _send(self, packet):
+        try:
+            self._socket.sendto(packet, self.address)
+        except OSError:
+            pass
+
+    def close(self):
+        self._socket.close()
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return ('%.3f' % value).rstrip('0').rstrip('.')
+    return str(value)
+
+
+def metrics_from_settings(settings, maybe_dotted):
+    """
+    Create a :term:`metrics sink` from the ``retry.metrics.*`` settings.
+
+    ``retry.metrics`` may be ``statsd`` or a dotted python name to a
+    :term:`metrics sink`. The ``statsd`` sink is a :class:`.BatchingMetrics`
+    flushed every ``retry.metrics.interval`` seconds to a
+    :class:`.StatsdEmitter` configured by ``retry.metrics.statsd.host``,
+    ``retry.metrics.statsd.port`` and ``retry.metrics.statsd.prefix``.
+
+    Returns ``None`` if no metrics are configured.
+
+    """
+    name = settings.get('retry.metrics')
+    if not name:
+        return None
+    if name != 'statsd':
+        return maybe_dotted(name)
+
+    emitter_kw = {}
+    host = settings.get('retry.metrics.statsd.host')
+    if host:
+        emitter_kw['host'] = host
+    port = settings.get('retry.metrics.statsd.port')
+    if port is not None:
+        emitter_kw['port'] = int(port)
+    prefix = settings.get('retry.metrics.statsd.prefix')
+    if prefix is not None:
+        emitter_kw['prefix'] = prefix
+
+    kw = {}
+    interval = settings.get('retry.metrics.interval')
+    if interval is not None:
+        kw['interval'] = float(interval)
+    return BatchingMetrics(StatsdEmitter(**emitter_kw), **kw)
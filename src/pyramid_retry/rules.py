@@ -0,0 +1,204 @@
+"""
+Declarative per-path retry rules.
+
+Rules are added at configuration time via ``config.add_retry_rule`` or the
+``retry.rules`` setting and are compiled into a prefix tree keyed by path
+segment, so that selecting the rule for a request costs a single walk over
+the segments of ``request.path_info`` rather than running arbitrary
+matching code for every request.
+
+"""
+
+from pyramid.exceptions import ConfigurationError
+from zope.interface import Interface
+
+
+class IRetryRules(Interface):
+    """
+    The registry key for the :class:`.RetryRules` used by the execution
+    policy registered by :func:`pyramid_retry.includeme`.
+
+    """
+
+
+class RetryRule(object):
+    """
+    The options selected for requests matching a rule.
+
+    :ivar attempts: The maximum number of attempts for a matching request,
+                    or ``None`` to use the policy's default.
+    :ivar hedge: ``True`` if the first attempt of a matching request may be
+                 hedged, see :mod:`pyramid_retry.hedge`.
+
+    """
+
+    def __init__(self, attempts, hedge=False):
+        self.attempts = attempts
+        self.hedge = hedge
+
+
+class _Node(object):
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        self.rules = {}
+
+
+def _split_path(path):
+    return [segment for segment in path.split('/') if segment]
+
+
+class RetryRules(object):
+    """
+    A table of :class:`.RetryRule` objects indexed by path prefix and
+    request method.
+
+    The rule with the longest matching path prefix wins. Among rules with the
+    same prefix, a rule for the specific request method wins over a rule for
+    any method. Prefixes match whole path segments, so ``/api`` matches
+    ``/api`` and ``/api/users`` but not ``/apis``.
+
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def add(self, path_prefix='/', methods=None, attempts=None, hedge=False):
+        """
+        Add a rule for requests under ``path_prefix``.
+
+        ``methods`` may be a sequence of request methods to limit the rule to,
+        by default the rule applies to any method. A later rule with the same
+        ``path_prefix`` and method replaces an earlier one.
+
+        ``attempts`` may only be omitted from rules which set ``hedge``.
+
+        """
+        if (attempts is None and not hedge) or (
+            attempts is not None and attempts < 1
+        ):
+            raise ConfigurationError(
+                'A retry rule must specify attempts >= 1, got %r.'
+                % (attempts,)
+            )
+        rule = RetryRule(attempts, hedge)
+        node = self._root
+        for segment in _split_path(path_prefix):
+            node = node.children.setdefault(segment, _Node())
+        if methods is None:
+            node.rules[None] = rule
+        else:
+            for method in methods:
+                node.rules[method.upper()] = rule
+
+    def lookup(self, method, path):
+        """
+        Return the :class:`.RetryRule` matching the request ``method`` and
+        ``path`` or ``None`` if no rule matches.
+
+        """
+        node = self._root
+        rules = node.rules
+        best = rules.get(method) or rules.get(None)
+        for segment in path.split('/'):
+            if not segment:
+                continue
+            node = node.children.get(segment)
+            if node is None:
+                break
+            rules = node.rules
+            if rules:
+                best = rules.get(method) or rules.get(None) or best
+        return best
+
+
+def parse_rules(value):
+    """
+    Parse the ``retry.rules`` setting into a list of keyword arguments for
+    :meth:`.RetryRules.add`.
+
+    Each non-empty line is either ``<path_prefix> <attempts>`` or
+    ``<methods> <path_prefix> <attempts>`` where ``methods`` is a
+    comma-separated list of request methods. A line may end with ``hedge``
+    to allow hedging matching requests.
+
+    """
+    result = []
+    for line in value.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        hedge = parts[-1] == 'hedge'
+        if hedge:
+            parts.pop()
+        if len(parts) == 2:
+            methods = None
+        elif len(parts) == 3:
+            methods = [m for m in parts.pop(0).split(',') if m]
+        else:
+            raise ConfigurationError('Invalid retry rule: %r.' % (line,))
+        try:
+            attempts = int(parts[1])
+        except ValueError:
+            raise ConfigurationError('Invalid retry rule: %r.' % (line,))
+        kw = {
+            'path_prefix': parts[0],
+            'methods': methods,
+            'attempts': attempts,
+        }
+        if hedge:
+            kw['hedge'] = True
+        result.append(kw)
+    return result
+
+
+def add_retry_rule(
+    config, path_prefix='/', methods=None, attempts=None, hedge=False
+):
+    """
+    A configurator directive which adds a rule to the :class:`.RetryRules`
+    consulted by the ``pyramid_retry`` execution policy.
+
+    Requests matching the rule use ``attempts`` as the maximum number of
+    attempts instead of the ``retry.attempts`` setting. A value of ``1``
+    disables retries for matching requests, which also avoids copying the
+    request body.
+
+    If ``hedge`` is ``True`` the first attempt of matching requests may be
+    hedged by the :class:`pyramid_retry.hedge.Hedger` configured via the
+    ``retry.hedge.*`` settings. Only mark idempotent requests this way, a
+    hedged request may run twice concurrently. ``attempts`` may be omitted
+    to keep the default number of attempts.
+
+    .. code-block:: python
+
+        config.add_retry_rule(path_prefix='/api', methods=['GET'], attempts=1)
+        config.add_retry_rule(path_prefix='/api/orders', attempts=5)
+        config.add_retry_rule(path_prefix='/search', methods='GET', hedge=True)
+
+    """
+    if isinstance(methods, str):
+        methods = [methods]
+    if methods is not None:
+        methods = tuple(sorted(m.upper() for m in methods))
+    path = '/' + '/'.join(_split_path(path_prefix))
+
+    def register():
+        rules = config.registry.getUtility(IRetryRules)
+        rules.add(
+            path_prefix=path, methods=methods, attempts=attempts, hedge=hedge
+        )
+
+    discriminator = ('pyramid_retry.rule', path, methods)
+    intr = config.introspectable(
+        'retry rules',
+        discriminator,
+        '%s %s' % (','.join(methods or ('*',)), path),
+        'retry rule',
+    )
+    intr['path_prefix'] = path
+    intr['methods'] = methods
+    intr['attempts'] = attempts
+    intr['hedge'] = hedge
+    config.action(discriminator, register, introspectables=(intr,))
@@ -0,0 +1,87 @@
+"""
+A structured record of the attempts of a request.
+
+The execution policy creates a single :class:`.RetryState` per request and
+updates it in place as attempts start and fail. It is stored in the
+``environ`` under ``retry.state`` and exposed as ``request.retry`` by
+:func:`pyramid_retry.includeme`. The ``retry.attempt`` and
+``retry.attempts`` environ keys are still set for every attempt, for
+compatibility with code reading them directly.
+
+"""
+
+
+class RetryState(object):
+    """
+    The attempts of a request made by the execution policy.
+
+    :ivar attempt: The index of the current attempt, starting at ``0``.
+    :ivar attempts: The maximum number of attempts of the request, which
+                    may be lowered while the request is executed. Use
+                    :func:`pyramid_retry.is_last_attempt` to also take the
+                    :class:`pyramid_retry.ErrorPolicy` of a raised
+                    exception into account.
+    :ivar started: The :func:`time.monotonic` time the request started.
+    :ivar attempt_started: The :func:`time.monotonic` time the current
+                           attempt started, after any backoff.
+    :ivar total_backoff: The number of seconds spent waiting between
+                         attempts so far.
+    :ivar errors: A tuple of the exception types of the most recent failed
+                  attempts, oldest first, holding at most
+                  :attr:`max_errors` types.
+    :ivar deadline: The :func:`time.monotonic` deadline of the request or
+                    ``None``.
+    :ivar budget: The :class:`pyramid_retry.budget.RetryBudget` retries of
+                  the request draw from or ``None``.
+
+    """
+
+    __slots__ = (
+        'attempt',
+        'attempts',
+        'started',
+        'attempt_started',
+        'total_backoff',
+        'errors',
+        'deadline',
+        'budget',
+    )
+
+    #: The maximum number of exception types kept in :attr:`errors`.
+    max_errors = 8
+
+    def __init__(self, attempts, started, deadline=None, budget=None):
+        self.attempt = 0
+        self.attempts = attempts
+        self.started = started
+        self.attempt_started = started
+        self.total_backoff = 0.0
+        self.errors = ()
+        self.deadline = deadline
+        self.budget = budget
+
+    def record_error(self, exc):
+        """Remember the type of ``exc`` which failed the current attempt."""
+        errors = self.errors
+        if len(errors) >= self.max_errors:
+            start = len(errors) - self.max_errors + 1
+            errors = errors[start:]
+        self.errors = errors + (exc.__class__,)
+
+    def __repr__(self):
+        return '<RetryState attempt %d of %d>' % (
+            self.attempt + 1,
+            self.attempts,
+        )
+
+
+def retry_state(request):
+    """
+    Return the :class:`.RetryState` of ``request`` or ``None`` if the request
+    is not executed by the ``pyramid_retry`` execution policy.
+
+    It is added to the request as the reified ``request.retry`` property by
+    :func:`pyramid_retry.includeme`.
+
+    """
+    return request.environ.get('retry.state')
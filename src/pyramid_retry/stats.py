@@ -0,0 +1,256 @@
+"""
+In-process statistics about the attempts made by
+:func:`pyramid_retry.RetryableExecutionPolicy`.
+
+:class:`.RetryStats` is a :term:`metrics sink` which aggregates the metrics
+reported by the policy into fixed-size structures, such that it is safe to
+leave enabled in production:
+
+- A latency histogram of attempt durations per route and per exception
+  type, using a fixed set of logarithmic buckets. The number of routes and
+  exception types tracked is bounded, further keys are folded into a single
+  ``(other)`` entry.
+
+- The distribution of the number of attempts made per request.
+
+- The ratio of retried requests which eventually succeeded, over a rolling
+  window of time.
+
+Updates do not take a lock except to recycle a slot of the rolling window or
+to add a new key, a concurrent update may occasionally be lost which is an
+acceptable error for statistics.
+
+"""
+
+from array import array
+from bisect import bisect_left
+import threading
+import time
+from zope.interface import Interface
+
+#: The upper bounds, in milliseconds, of the buckets of a
+#: :class:`.Histogram`. Four buckets per power of two from 1/16ms up to
+#: about two minutes, keeping the relative error of a percentile below 19%.
+HISTOGRAM_BOUNDS = tuple(
+    2.0 ** (exponent / 4.0) for exponent in range(-16, 69)
+)
+
+OTHER = '(other)'
+
+
+class IRetryStats(Interface):
+    """
+    The registry key for the :class:`.RetryStats` configured by
+    :func:`pyramid_retry.includeme`.
+
+    """
+
+
+class Histogram(object):
+    """
+    Count values in the fixed buckets bounded by :data:`.HISTOGRAM_BOUNDS`.
+
+    """
+
+    __slots__ = ('counts',)
+
+    def __init__(self):
+        self.counts = array('q', [0] * (len(HISTOGRAM_BOUNDS) + 1))
+
+    def record(self, value):
+        """Add ``value`` to the bucket containing it."""
+        self.counts[bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+
+    def percentile(self, fraction):
+        """
+        Return the upper bound of the bucket containing the value at
+        ``fraction`` (between ``0`` and ``1``) of the recorded values, or
+        ``None`` if nothing was recorded. Values larger than the last bound
+        are reported as the last bound.
+
+        """
+        counts = self.counts
+        target = fraction * sum(counts)
+        if not target:
+            return None
+        seen = 0
+        last = len(HISTOGRAM_BOUNDS) - 1
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return HISTOGRAM_BOUNDS[min(index, last)]
+
+    def summary(self):
+        """
+        Return a dictionary with the ``count`` of recorded values and the
+        ``p50``, ``p90`` and ``p99`` percentiles.
+
+        """
+        return {
+            'count': sum(self.counts),
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class _ExceptionStats(object):
+    __slots__ = ('retries', 'exhausted', 'durations')
+
+    def __init__(self):
+        self.retries = 0
+        self.exhausted = 0
+        self.durations = Histogram()
+
+
+class RetryStats(object):
+    """
+    A :term:`metrics sink` keeping the statistics described in
+    :mod:`pyramid_retry.stats`.
+
+    At most ``max_keys`` routes and ``max_keys`` exception types are
+    tracked. Requests needing more than ``max_attempts`` attempts are
+    counted together. The success ratio of retried requests is measured over
+    the last ``window`` seconds divided into ``buckets`` slots.
+
+    """
+
+    def __init__(
+        self,
+        max_keys=100,
+        max_attempts=10,
+        window=60.0,
+        buckets=6,
+        clock=time.monotonic,
+    ):
+        assert max_keys > 0
+        assert max_attempts > 0
+        assert window > 0
+        assert buckets > 0
+        self.max_keys = max_keys
+        self.window = window
+        self.clock = clock
+        self.requests = 0
+        self.retries = 0
+        self.attempts = array('q', [0] * max_attempts)
+        self.routes = {}
+        self.exceptions = {}
+        self._width = window / buckets
+        self._epochs = [None] * buckets
+        self._recovered = array('q', [0] * buckets)
+        self._exhausted = array('q', [0] * buckets)
+        self._lock = threading.Lock()
+
+    def _entry(self, table, key, factory):
+        entry = table.get(key)
+        if entry is None:
+            with self._lock:
+                entry = table.get(key)
+                if entry is None:
+                    if len(table) >= self.max_keys:
+                        key = OTHER
+                        entry = table.get(key)
+                    if entry is None:
+                        entry = table[key] = factory()
+        return entry
+
+    def _record_outcome(self, counts):
+        epoch = int(self.clock() / self._width)
+        index = epoch % len(self._epochs)
+        with self._lock:
+            if self._epochs[index] != epoch:
+                self._recovered[index] = 0
+                self._exhausted[index] = 0
+                self._epochs[index] = epoch
+            counts[index] += 1
+
+    def increment(self, name, tags=()):
+        if name == 'first_attempts':
+            self.requests += 1
+        elif name == 'retries':
+            self.retries += 1
+            exc = dict(tags).get('exception')
+            if exc is not None:
+                self._entry(self.exceptions, exc, _ExceptionStats).retries += 1
+        elif name == 'recovered':
+            self._record_outcome(self._recovered)
+        elif name == 'exhausted':
+            self._record_outcome(self._exhausted)
+            exc = dict(tags).get('exception')
+            if exc is not None:
+                entry = self._entry(self.exceptions, exc, _ExceptionStats)
+                entry.exhausted += 1
+
+    def observe(self, name, value, tags=()):
+        if name == 'attempt_duration':
+            for key, tag in tags:
+                if key == 'route':
+                    entry = self._entry(self.routes, tag, Histogram)
+                    entry.record(value)
+                elif key == 'exception':
+                    entry = self._entry(self.exceptions, tag, _ExceptionStats)
+                    entry.durations.record(value)
+        elif name == 'attempts_per_request':
+            attempts = self.attempts
+            attempts[min(value, len(attempts)) - 1] += 1
+
+    def success_ratio(self):
+        """
+        Return a ``(recovered, exhausted)`` tuple counting the retried
+        requests which succeeded and those which ran out of attempts within
+        the window.
+
+        """
+        oldest = int(self.clock() / self._width) - len(self._epochs)
+        recovered = exhausted = 0
+        for index, epoch in enumerate(self._epochs):
+            if epoch is not None and epoch > oldest:
+                recovered += self._recovered[index]
+                exhausted += self._exhausted[index]
+        return recovered, exhausted
+
+    def snapshot(self):
+        """
+        Return the statistics as a dictionary which can be serialized to
+        JSON. Durations are in milliseconds.
+
+        """
+        attempts = {str(n + 1): count for n, count in enumerate(self.attempts)}
+        attempts[str(len(self.attempts)) + '+'] = attempts.pop(
+            str(len(self.attempts))
+        )
+        recovered, exhausted = self.success_ratio()
+        finished = recovered + exhausted
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'attempts': attempts,
+            'window': {
+                'seconds': self.window,
+                'recovered': recovered,
+                'exhausted': exhausted,
+                'success_ratio': recovered / finished if finished else None,
+            },
+            'routes': {
+                name: histogram.summary()
+                for name, histogram in list(self.routes.items())
+            },
+            'exceptions': {
+                name: {
+                    'retries': entry.retries,
+                    'exhausted': entry.exhausted,
+                    'duration': entry.durations.summary(),
+                }
+                for name, entry in list(self.exceptions.items())
+            },
+        }
+
+
+def stats_view(request):
+    """
+    A view returning the :meth:`.RetryStats.snapshot` of the
+    :class:`.RetryStats` registered in the application, to be rendered as
+    JSON.
+
+    """
+    return request.registry.getUtility(IRetryStats).snapshot()
@@ -0,0 +1,142 @@
+"""
+Tracing of the individual attempts made by
+:func:`pyramid_retry.RetryableExecutionPolicy`.
+
+If a :term:`tracer` is configured, each attempt is wrapped in a span named
+``pyramid_retry.attempt`` which is a child of whatever span is active when
+the policy starts, usually the span of the whole request. Spans carry the
+following attributes:
+
+``retry.attempt``
+    The zero-based number of the attempt.
+
+``retry.attempts``
+    The maximum number of attempts at the time the attempt started.
+
+``retry.backoff``
+    The number of seconds spent waiting before the attempt started.
+
+``exception.type``
+    The qualified name of the exception class if the attempt failed.
+
+``retry.squashed``
+    ``True`` if the exception was squashed by an exception view which
+    rendered a response.
+
+``retry.retried``
+    ``True`` if the request is retried after this attempt.
+
+The span of a failed attempt is also available as
+:attr:`pyramid_retry.IBeforeRetry.span` so that subscribers may annotate it.
+
+"""
+
+from zope.interface import Interface
+
+
+class ISpan(Interface):
+    """A span measuring a single attempt."""
+
+    def set_attribute(key, value):
+        """Set the attribute ``key`` of the span to ``value``."""
+
+    def end():
+        """Finish the span."""
+
+
+class ITracer(Interface):
+    """A :term:`tracer` creating an :class:`.ISpan` for each attempt."""
+
+    def start_span(name, attributes):
+        """
+        Start and return a new :class:`.ISpan` called ``name`` with the
+        ``attributes`` dictionary. The span should be made the active span
+        until it is ended, such that spans started by the attempt become its
+        children.
+
+        """
+
+
+class NoopSpan(object):
+    """
+    A span which ignores everything. :data:`.NOOP_SPAN` is used instead of
+    creating spans when no :term:`tracer` is configured.
+
+    """
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self):
+        pass
+
+
+#: The shared :class:`.NoopSpan` instance.
+NOOP_SPAN = NoopSpan()
+
+
+class OpenTelemetrySpan(object):
+    """
+    An :class:`.ISpan` wrapping an OpenTelemetry span which was made the
+    current span when it started.
+
+    :ivar span: The wrapped ``opentelemetry.trace.Span``.
+
+    """
+
+    __slots__ = ('span', '_context', '_token')
+
+    def __init__(self, span, context, token):
+        self.span = span
+        self._context = context
+        self._token = token
+
+    def set_attribute(self, key, value):
+        self.span.set_attribute(key, value)
+
+    def end(self):
+        self._context.detach(self._token)
+        self.span.end()
+
+
+class OpenTelemetryTracer(object):
+    """
+    A :term:`tracer` creating spans using the OpenTelemetry API.
+
+    ``tracer`` is an ``opentelemetry.trace.Tracer`` and defaults to the
+    tracer named ``pyramid_retry`` from the global tracer provider. The
+    ``opentelemetry-api`` package must be installed.
+
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import context, trace
+
+        if tracer is None:
+            tracer = trace.get_tracer('pyramid_retry')
+        self.tracer = tracer
+        self._context = context
+        self._trace = trace
+
+    def start_span(self, name, attributes):
+        span = self.tracer.start_span(name, attributes=attributes)
+        token = self._context.attach(self._trace.set_span_in_context(span))
+        return OpenTelemetrySpan(span, self._context, token)
+
+
+def tracer_from_settings(settings, maybe_dotted):
+    """
+    Create a :term:`tracer` from the ``retry.tracer`` setting.
+
+    ``retry.tracer`` may be ``opentelemetry`` or a dotted python name to a
+    :term:`tracer`. Returns ``None`` if no tracer is configured.
+
+    """
+    name = settings.get('retry.tracer')
+    if not name:
+        return None
+    if name == 'opentelemetry':
+        return OpenTelemetryTracer()
+    return maybe_dotted(name)
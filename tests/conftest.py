@@ -2,6 +2,14 @@ import pyramid.testing
 import pytest
 
 
+class DummyClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
 @pytest.fixture
 def config():
     config = pyramid.testing.setUp(
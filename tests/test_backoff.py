@@ -0,0 +1,97 @@
+import pytest
+
+
+def test_constant_backoff():
+    from pyramid_retry.backoff import ConstantBackoff
+
+    backoff = ConstantBackoff(0.5)
+    assert backoff(0, None) == 0.5
+    assert backoff(5, 0.5) == 0.5
+
+
+def test_exponential_backoff():
+    from pyramid_retry.backoff import ExponentialBackoff
+
+    backoff = ExponentialBackoff(base=0.1, max_delay=1.0)
+    assert backoff(0, None) == pytest.approx(0.1)
+    assert backoff(1, 0.1) == pytest.approx(0.2)
+    assert backoff(2, 0.2) == pytest.approx(0.4)
+    assert backoff(10, 0.8) == 1.0
+
+
+def test_exponential_backoff_overflow_is_capped():
+    from pyramid_retry.backoff import ExponentialBackoff
+
+    backoff = ExponentialBackoff(base=0.1, max_delay=2.0)
+    assert backoff(100000, None) == 2.0
+
+
+def test_full_jitter_backoff_is_within_window():
+    from pyramid_retry.backoff import FullJitterBackoff
+
+    backoff = FullJitterBackoff(base=0.1, max_delay=0.3)
+    for attempt in range(5):
+        ceiling = min(0.3, 0.1 * 2**attempt)
+        for _ in range(50):
+            assert 0 <= backoff(attempt, None) <= ceiling
+
+
+def test_decorrelated_jitter_backoff_grows_from_last_delay():
+    from pyramid_retry.backoff import DecorrelatedJitterBackoff
+
+    backoff = DecorrelatedJitterBackoff(base=0.1, max_delay=1.0)
+    for _ in range(50):
+        assert 0.1 <= backoff(0, None) <= 0.3
+        assert 0.1 <= backoff(1, 0.2) <= 0.6
+        assert backoff(2, 5.0) <= 1.0
+
+
+def test_backoff_from_settings_disabled():
+    from pyramid_retry.backoff import backoff_from_settings
+
+    assert backoff_from_settings({}, None) is None
+
+
+def test_backoff_from_settings_constant():
+    from pyramid_retry.backoff import ConstantBackoff, backoff_from_settings
+
+    backoff = backoff_from_settings(
+        {
+            'retry.backoff': 'constant',
+            'retry.backoff.base': '0.25',
+            'retry.backoff.max_delay': '3',
+        },
+        None,
+    )
+    assert isinstance(backoff, ConstantBackoff)
+    assert backoff.delay == 0.25
+
+
+def test_backoff_from_settings_jitter():
+    from pyramid_retry.backoff import FullJitterBackoff, backoff_from_settings
+
+    backoff = backoff_from_settings(
+        {
+            'retry.backoff': 'full_jitter',
+            'retry.backoff.base': '0.01',
+            'retry.backoff.max_delay': '0.5',
+        },
+        None,
+    )
+    assert isinstance(backoff, FullJitterBackoff)
+    assert backoff.base == 0.01
+    assert backoff.max_delay == 0.5
+
+
+def test_backoff_from_settings_dotted():
+    from pyramid_retry.backoff import backoff_from_settings
+
+    def custom(attempt, last_delay):  # pragma: no cover
+        return 0
+
+    def maybe_dotted(name):
+        assert name == 'myapp.custom'
+        return custom
+
+    settings = {'retry.backoff': 'myapp.custom'}
+    assert backoff_from_settings(settings, maybe_dotted) is custom
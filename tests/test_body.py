@@ -0,0 +1,318 @@
+import io
+import pyramid.request
+import pytest
+import tempfile
+
+
+def _makeMapped(data):
+    from pyramid_retry.body import MappedBody
+
+    fileobj = tempfile.TemporaryFile()
+    fileobj.write(data)
+    fileobj.flush()
+    return MappedBody(fileobj)
+
+
+def _makeRequest(body, **kw):
+    request = pyramid.request.Request.blank('/', method='POST', **kw)
+    request.body_file_raw = io.BytesIO(body)
+    request.content_length = len(body)
+    return request
+
+
+def test_mapped_body_read():
+    body = _makeMapped(b'hello world')
+    assert body.readable()
+    assert body.seekable()
+    assert len(body) == 11
+    assert body.read(5) == b'hello'
+    assert body.tell() == 5
+    assert body.read() == b' world'
+    assert body.read() == b''
+    body.seek(0)
+    assert body.read(None) == b'hello world'
+
+
+def test_mapped_body_seek():
+    body = _makeMapped(b'0123456789')
+    assert body.seek(3) == 3
+    assert body.seek(2, io.SEEK_CUR) == 5
+    assert body.read(1) == b'5'
+    assert body.seek(-2, io.SEEK_END) == 8
+    assert body.read() == b'89'
+    assert body.seek(100) == 10
+    assert body.seek(-100) == 0
+
+
+def test_mapped_body_readline():
+    body = _makeMapped(b'one\ntwo\nthree')
+    assert body.readline() == b'one\n'
+    assert body.readline(2) == b'tw'
+    assert body.readline() == b'o\n'
+    assert body.readline() == b'three'
+    assert body.readline() == b''
+    body.seek(0)
+    assert list(body) == [b'one\n', b'two\n', b'three']
+
+
+def test_mapped_body_readinto():
+    body = _makeMapped(b'abc')
+    buffer = bytearray(5)
+    assert body.readinto(buffer) == 3
+    assert buffer == b'abc\0\0'
+    body.seek(0)
+    wrapped = io.BufferedReader(body)
+    assert wrapped.read() == b'abc'
+
+
+def test_mapped_body_close():
+    body = _makeMapped(b'abc')
+    fileobj = body._file
+    body.close()
+    assert body.closed
+    assert fileobj.closed
+    body.close()
+
+
+def test_make_body_replayable_small_body_in_memory():
+    from pyramid_retry.body import MappedBody, make_body_replayable
+
+    request = _makeRequest(b'abc')
+    assert make_body_replayable(request, max_memory=10)
+    assert request.is_body_seekable
+    assert not isinstance(request.body_file_raw, MappedBody)
+    assert request.body == b'abc'
+
+
+def test_make_body_replayable_default_buffering():
+    from pyramid_retry.body import MappedBody, make_body_replayable
+
+    request = _makeRequest(b'abc')
+    assert make_body_replayable(request)
+    assert request.is_body_seekable
+    assert not isinstance(request.body_file_raw, MappedBody)
+    assert request.body == b'abc'
+
+
+def test_make_body_replayable_large_body_is_mapped():
+    from pyramid_retry.body import MappedBody, make_body_replayable
+
+    data = b'x' * 1000 + b'\n' + b'y' * 1000
+    request = _makeRequest(data)
+    assert make_body_replayable(request, max_memory=100)
+    assert isinstance(request.body_file_raw, MappedBody)
+    assert request.is_body_seekable
+    assert request.content_length == len(data)
+    assert request.body == data
+    assert request.body_file.read(4) == b'xxxx'
+    assert make_body_replayable(request, max_memory=100)
+    assert request.body_file.read(4) == b'xxxx'
+
+
+def test_make_body_replayable_too_large():
+    from pyramid_retry.body import make_body_replayable
+
+    request = _makeRequest(b'abcdef')
+    raw = request.body_file_raw
+    assert not make_body_replayable(request, max_size=5)
+    assert request.body_file_raw is raw
+    assert not request.is_body_seekable
+
+
+def test_make_body_replayable_unknown_size():
+    from pyramid_retry.body import make_body_replayable
+
+    request = pyramid.request.Request.blank('/', method='POST')
+    request.body_file_raw = io.BytesIO(b'abc')
+    request.environ['wsgi.input_terminated'] = True
+    request.environ.pop('CONTENT_LENGTH', None)
+    assert not make_body_replayable(request, max_size=5)
+    assert make_body_replayable(request, max_memory=5)
+    assert request.body == b'abc'
+
+
+def test_make_body_replayable_without_body():
+    from pyramid_retry.body import make_body_replayable
+
+    request = pyramid.request.Request.blank('/')
+    assert make_body_replayable(request, max_memory=0, max_size=0)
+    assert request.body == b''
+
+
+def test_make_body_replayable_disconnect_closes_file(monkeypatch):
+    from webob.request import DisconnectionError
+
+    from pyramid_retry.body import make_body_replayable
+
+    files = []
+    orig_tempfile = tempfile.TemporaryFile
+
+    def make_tempfile():
+        files.append(orig_tempfile())
+        return files[-1]
+
+    monkeypatch.setattr('tempfile.TemporaryFile', make_tempfile)
+    request = _makeRequest(b'abc')
+    request.content_length = 10
+    with pytest.raises(DisconnectionError):
+        make_body_replayable(request, max_memory=1)
+    assert files[0].closed
+
+
+class DummyStream(object):
+    def __init__(self, data, chunk=3):
+        self.data = data
+        self.chunk = chunk
+        self.read_sizes = []
+
+    def read(self, size):
+        size = min(size, self.chunk)
+        self.read_sizes.append(size)
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+def _makeTee(data, length=None, **kw):
+    from pyramid_retry.body import TeeInput
+
+    raw = DummyStream(data)
+    if length is None:
+        length = len(data)
+    return TeeInput(raw, length, **kw), raw
+
+
+def test_tee_input_reads_lazily():
+    tee, raw = _makeTee(b'0123456789')
+    assert tee.readable()
+    assert tee.seekable()
+    assert raw.read_sizes == []
+    assert tee.read(2) == b'01'
+    assert raw.read_sizes == [2]
+    assert tee.tell() == 2
+    assert raw.data == b'23456789'
+
+
+def test_tee_input_replays_prefix_then_remainder():
+    tee, raw = _makeTee(b'0123456789')
+    assert tee.read(4) == b'012'
+    assert tee.seek(0) == 0
+    assert tee.read() == b'0123456789'
+    assert tee.read() == b''
+    tee.seek(0)
+    assert tee.read() == b'0123456789'
+
+
+def test_tee_input_seek_forward_buffers_skipped_bytes():
+    tee, raw = _makeTee(b'0123456789')
+    assert tee.seek(2, io.SEEK_CUR) == 2
+    assert tee.seek(-3, io.SEEK_END) == 7
+    assert raw.read_sizes == []
+    assert tee.read(1) == b'7'
+    assert tee.seek(20) == 10
+    assert tee.seek(-20) == 0
+    assert tee.read() == b'0123456789'
+
+
+def test_tee_input_spools_to_disk():
+    tee, raw = _makeTee(b'0123456789', max_memory=4)
+    assert tee.read() == b'0123456789'
+    assert tee._buffer._rolled
+    tee.seek(0)
+    assert tee.read(5) == b'01234'
+
+
+def test_tee_input_disconnect():
+    from webob.request import DisconnectionError
+
+    tee, raw = _makeTee(b'0123', length=10)
+    with pytest.raises(DisconnectionError):
+        tee.read()
+
+
+def test_tee_input_close():
+    tee, raw = _makeTee(b'0123')
+    buffer = tee._buffer
+    tee.close()
+    assert tee.closed
+    assert buffer.closed
+    tee.close()
+
+
+def test_make_body_replayable_lazy():
+    from pyramid_retry.body import make_body_replayable
+
+    request = _makeRequest(b'abcdef')
+    raw = request.body_file_raw
+    assert make_body_replayable(request, lazy=True)
+    assert request.is_body_seekable
+    assert raw.tell() == 0
+    assert request.body_file.read(2) == b'ab'
+    assert request.body == b'abcdef'
+    assert make_body_replayable(request, lazy=True)
+    assert request.body_file.read(2) == b'ab'
+
+
+def test_make_body_replayable_lazy_respects_max_size():
+    from pyramid_retry.body import make_body_replayable
+
+    request = _makeRequest(b'abcdef')
+    assert not make_body_replayable(request, max_size=5, lazy=True)
+    assert not request.is_body_seekable
+
+
+def test_rewind_body():
+    import webtest
+
+    from pyramid_retry.body import rewind_body
+
+    # a body which is not buffered cannot be rewound
+    request = _makeRequest(b'abcdef')
+    request.body_file_raw.read(2)
+    rewind_body(request)
+    assert request.body_file_raw.tell() == 2
+
+    content_type, body = webtest.TestApp(None).encode_multipart(
+        [('name', 'value')], [('upload', 'a.txt', b'abc')]
+    )
+    request = pyramid.request.Request.blank(
+        '/', method='POST', content_type=content_type, body=body
+    )
+    upload = request.POST['upload']
+    assert upload.file.read() == b'abc'
+    rewind_body(request)
+    assert request.body_file_raw.tell() == 0
+    assert upload.file.read() == b'abc'
+    upload.file.close()
+    rewind_body(request)
+
+
+def test_form_file_parts_are_rewound_across_attempts(config):
+    import webtest
+
+    from pyramid_retry import RetryableException
+
+    forms = []
+
+    def form_view(request):
+        forms.append(request.POST)
+        data = request.POST['upload'].file.read()
+        if len(forms) % 3:
+            raise RetryableException
+        return data.decode('ascii')
+
+    config.add_route('form', '/form')
+    config.add_route('view_retry', '/view_retry')
+    config.add_view(form_view, route_name='form', renderer='string')
+    config.add_view(
+        form_view, route_name='view_retry', renderer='string', retry=3
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    upload_files = [('upload', 'a.txt', b'abc')]
+    response = app.post('/form', upload_files=upload_files)
+    assert response.text == 'abc'
+    # the form is parsed once and reused by every attempt
+    assert forms[0] is forms[1] is forms[2]
+
+    response = app.post('/view_retry', upload_files=upload_files)
+    assert response.text == 'abc'
+    assert forms[3] is forms[4] is forms[5]
@@ -0,0 +1,231 @@
+import pytest
+import webtest
+
+from pyramid_retry.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    ICircuitStateChanged,
+    RetryCircuitBreaker,
+)
+
+from .conftest import DummyClock
+
+
+def _makeBreaker(**kw):
+    events = []
+    clock = DummyClock()
+    kw.setdefault('min_retries', 4)
+    breaker = RetryCircuitBreaker(
+        window=10,
+        buckets=2,
+        cooldown=5,
+        notify=events.append,
+        clock=clock,
+        **kw,
+    )
+    return breaker, clock, events
+
+
+def _transitions(events):
+    return [(event.old_state, event.state) for event in events]
+
+
+def test_key():
+    breaker, _, _ = _makeBreaker()
+    assert breaker.key(ValueError(), 'home') == (ValueError, None)
+    breaker, _, _ = _makeBreaker(per_route=True)
+    assert breaker.key(ValueError(), 'home') == (ValueError, 'home')
+
+
+def test_opens_when_retries_fail():
+    breaker, _, events = _makeBreaker()
+    key = (ValueError, None)
+    assert breaker.state(key) == CLOSED
+    for success in (True, False, False):
+        breaker.record(key, success)
+    assert breaker.state(key) == CLOSED
+    assert breaker.allow(key)
+    breaker.record(key, False)
+    assert breaker.state(key) == OPEN
+    assert not breaker.allow(key)
+    (event,) = events
+    assert ICircuitStateChanged.providedBy(event)
+    assert event.error is ValueError
+    assert event.route is None
+    assert _transitions(events) == [(CLOSED, OPEN)]
+    # late outcomes of earlier retries do not change an open circuit
+    breaker.record(key, True)
+    assert breaker.state(key) == OPEN
+
+
+def test_stays_closed_while_retries_succeed():
+    breaker, _, _ = _makeBreaker()
+    key = (ValueError, None)
+    for success in (True, True, False, False, True, False):
+        breaker.record(key, success)
+    assert breaker.state(key) == CLOSED
+
+
+def test_forgets_outcomes_outside_window():
+    breaker, clock, _ = _makeBreaker()
+    key = (ValueError, None)
+    for _ in range(3):
+        breaker.record(key, False)
+    clock.now += 10
+    breaker.record(key, False)
+    assert breaker.state(key) == CLOSED
+
+
+def test_half_open_probe():
+    breaker, clock, events = _makeBreaker(min_retries=1)
+    key = (ValueError, None)
+    breaker.record(key, False)
+    clock.now += 5
+    assert breaker.allow(key)
+    assert breaker.state(key) == HALF_OPEN
+    assert not breaker.allow(key)
+
+    # a probe which never reports back is replaced after the cooldown
+    clock.now += 5
+    assert breaker.allow(key)
+    breaker.record(key, False)
+    assert breaker.state(key) == OPEN
+    assert not breaker.allow(key)
+
+    clock.now += 5
+    assert breaker.allow(key)
+    breaker.record(key, True)
+    assert breaker.state(key) == CLOSED
+    assert breaker.allow(key)
+    assert _transitions(events) == [
+        (CLOSED, OPEN),
+        (OPEN, HALF_OPEN),
+        (HALF_OPEN, OPEN),
+        (OPEN, HALF_OPEN),
+        (HALF_OPEN, CLOSED),
+    ]
+    # the outcomes which opened the circuit were discarded
+    breaker.record(key, True)
+    assert breaker.state(key) == CLOSED
+
+
+def test_bounds_circuits():
+    breaker, _, _ = _makeBreaker(min_retries=1, max_keys=1)
+    breaker.record((ValueError, None), False)
+    breaker.record((KeyError, None), False)
+    assert breaker.state((ValueError, None)) == OPEN
+    assert breaker.state((KeyError, None)) == CLOSED
+    assert breaker.allow((KeyError, None))
+
+
+def test_breaker_from_settings():
+    from pyramid_retry.breaker import breaker_from_settings
+
+    assert breaker_from_settings({}) is None
+    breaker = breaker_from_settings({'retry.breaker.threshold': '0.2'})
+    assert breaker.threshold == 0.2
+    assert breaker.min_retries == 20
+    assert not breaker.per_route
+    assert breaker.notify is None
+    breaker = breaker_from_settings(
+        {
+            'retry.breaker.threshold': '0.2',
+            'retry.breaker.min_retries': '5',
+            'retry.breaker.window': '60',
+            'retry.breaker.cooldown': '2',
+            'retry.breaker.per_route': 'true',
+        },
+        notify=print,
+    )
+    assert breaker.min_retries == 5
+    assert breaker.window == 60.0
+    assert breaker.cooldown == 2.0
+    assert breaker.per_route
+    assert breaker.notify is print
+
+
+def test_policy_fails_fast_when_open(config):
+    from pyramid_retry import RetryableException
+    from pyramid_retry.breaker import IRetryCircuitBreaker
+
+    calls = []
+    events = []
+
+    def bad_view(request):
+        calls.append('fail')
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.breaker.threshold': '0.5',
+            'retry.breaker.min_retries': '2',
+            'retry.breaker.per_route': 'true',
+        }
+    )
+    config.add_subscriber(events.append, ICircuitStateChanged)
+    config.add_route('home', '/')
+    config.add_view(bad_view, route_name='home')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert len(calls) == 3
+    (event,) = events
+    assert (event.error, event.route) == (RetryableException, 'home')
+    assert event.state == OPEN
+
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert len(calls) == 4
+    breaker = config.registry.getUtility(IRetryCircuitBreaker)
+    assert breaker.state((RetryableException, 'home')) == OPEN
+
+
+def test_policy_records_successful_retry(config):
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+
+    calls = []
+
+    def view(request):
+        calls.append('call')
+        if len(calls) % 2:
+            raise RetryableException
+        return 'ok'
+
+    breaker, _, _ = _makeBreaker(min_retries=1)
+    config.add_view(view, renderer='string')
+    config.commit()
+    config.set_execution_policy(RetryableExecutionPolicy(breaker=breaker))
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    app.get('/')
+    app.get('/')
+    assert len(calls) == 4
+    assert breaker.state((RetryableException, None)) == CLOSED
+
+
+def test_is_error_retryable_remembers_probe(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import RetryableException, is_error_retryable
+    from pyramid_retry.breaker import IRetryCircuitBreaker
+
+    breaker, clock, _ = _makeBreaker(min_retries=1)
+    breaker.record((RetryableException, None), False)
+    clock.now += 5
+    config.registry.registerUtility(breaker, IRetryCircuitBreaker)
+
+    def make_request():
+        request = Request.blank('/')
+        request.registry = config.registry
+        request.environ['retry.attempt'] = 0
+        request.environ['retry.attempts'] = 3
+        return request
+
+    # the probe is taken once and the verdict is remembered
+    request = make_request()
+    exc = RetryableException()
+    assert is_error_retryable(request, exc)
+    assert is_error_retryable(request, exc)
+    assert not is_error_retryable(make_request(), RetryableException())
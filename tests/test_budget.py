@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import pytest
+import time
+
+from pyramid_retry.budget import InProcessCounters, SharedMemoryCounters
+
+from .conftest import DummyClock
+
+backends = pytest.mark.parametrize(
+    'backend', [InProcessCounters, SharedMemoryCounters]
+)
+
+
+def _makeOne(**kw):
+    from pyramid_retry.budget import RetryBudget
+
+    clock = DummyClock()
+    kw.setdefault('clock', clock)
+    return RetryBudget(**kw), clock
+
+
+@backends
+def test_budget_allows_min_retries_without_traffic(backend):
+    budget, clock = _makeOne(
+        ratio=0, min_retries_per_second=1, window=2, backend=backend
+    )
+    assert budget.can_retry()
+    budget.record_retry()
+    assert budget.can_retry()
+    budget.record_retry()
+    assert not budget.can_retry()
+
+
+@backends
+def test_budget_grows_with_requests(backend):
+    budget, clock = _makeOne(
+        ratio=0.5, min_retries_per_second=0, backend=backend
+    )
+    assert not budget.can_retry()
+    budget.record_request()
+    budget.record_request()
+    assert budget.can_retry()
+    budget.record_retry()
+    assert not budget.can_retry()
+
+
+@backends
+def test_budget_forgets_old_traffic(backend):
+    budget, clock = _makeOne(
+        ratio=0, min_retries_per_second=1, window=1, buckets=4, backend=backend
+    )
+    budget.record_retry()
+    assert not budget.can_retry()
+    clock.now += 0.5
+    assert not budget.can_retry()
+    clock.now += 0.5
+    assert budget.can_retry()
+
+
+@backends
+def test_budget_recycles_slots(backend):
+    budget, clock = _makeOne(
+        ratio=1, min_retries_per_second=0, window=1, buckets=2, backend=backend
+    )
+    budget.record_request()
+    budget.record_request()
+    clock.now += 1.0
+    budget.record_retry()
+    oldest = budget._epoch() - 2
+    assert budget.counters.totals(oldest) == (0, 1)
+    assert not budget.can_retry()
+
+
+def _record_retries(counters, epoch, count):  # pragma: no cover
+    from pyramid_retry.budget import RETRIES
+
+    for _ in range(count):
+        counters.increment(epoch, RETRIES)
+
+
+@pytest.mark.skipif(
+    'fork' not in multiprocessing.get_all_start_methods(),
+    reason='requires fork',
+)
+def test_shared_memory_counters_are_shared_between_processes():
+    from pyramid_retry.budget import REQUESTS
+
+    ctx = multiprocessing.get_context('fork')
+    counters = SharedMemoryCounters(4)
+    counters.increment(100, REQUESTS)
+    workers = [
+        ctx.Process(target=_record_retries, args=(counters, 100, 250))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    assert counters.totals(96) == (1, 1000)
+
+
+def _hold_lock(counters):  # pragma: no cover
+    counters._lock.acquire()
+    os._exit(0)
+
+
+@pytest.mark.skipif(
+    'fork' not in multiprocessing.get_all_start_methods(),
+    reason='requires fork',
+)
+def test_shared_memory_counters_skip_increments_on_abandoned_lock():
+    from pyramid_retry.budget import REQUESTS
+
+    ctx = multiprocessing.get_context('fork')
+    counters = SharedMemoryCounters(4)
+    counters.increment(100, REQUESTS)
+    worker = ctx.Process(target=_hold_lock, args=(counters,))
+    worker.start()
+    worker.join()
+    start = time.monotonic()
+    counters.increment(100, REQUESTS)
+    assert counters._timeout == 0
+    counters.increment(100, REQUESTS)
+    assert time.monotonic() - start < 1
+    assert counters.totals(96) == (1, 0)
+
+
+def test_shared_memory_counters_keep_counting_after_timeout():
+    from pyramid_retry.budget import REQUESTS
+
+    counters = SharedMemoryCounters(4)
+    counters._timeout = 0
+    counters.increment(100, REQUESTS)
+    assert counters.totals(96) == (1, 0)
+
+
+def test_budget_from_settings_disabled():
+    from pyramid_retry.budget import budget_from_settings
+
+    assert budget_from_settings({}, None) is None
+
+
+def test_budget_from_settings():
+    from pyramid_retry.budget import RetryBudget, budget_from_settings
+
+    budget = budget_from_settings(
+        {
+            'retry.budget.ratio': '0.2',
+            'retry.budget.min_retries_per_second': '5',
+            'retry.budget.window': '30',
+            'retry.budget.backend': 'shared',
+        },
+        None,
+    )
+    assert isinstance(budget, RetryBudget)
+    assert budget.ratio == 0.2
+    assert budget.min_retries_per_second == 5
+    assert budget.window == 30
+    assert isinstance(budget.counters, SharedMemoryCounters)
+
+
+def test_budget_from_settings_defaults():
+    from pyramid_retry.budget import budget_from_settings
+
+    budget = budget_from_settings({'retry.budget.ratio': '0.1'}, None)
+    assert budget.min_retries_per_second == 10
+    assert budget.window == 10
+    assert isinstance(budget.counters, InProcessCounters)
+
+
+def test_budget_from_settings_dotted_backend():
+    from pyramid_retry.budget import budget_from_settings
+
+    def maybe_dotted(name):
+        assert name == 'myapp.Counters'
+        return InProcessCounters
+
+    budget = budget_from_settings(
+        {
+            'retry.budget.ratio': '0.1',
+            'retry.budget.backend': 'myapp.Counters',
+        },
+        maybe_dotted,
+    )
+    assert isinstance(budget.counters, InProcessCounters)
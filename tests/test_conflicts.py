@@ -0,0 +1,225 @@
+import pytest
+import threading
+import time
+import webtest
+
+from pyramid_retry.conflicts import ConflictSerializer
+
+
+def conflict_key(request, exc):
+    return request.params.get('row')
+
+
+def test_ConflictSerializer_locks_by_key():
+    serializer = ConflictSerializer(conflict_key, timeout=0)
+    entry = serializer.acquire('a')
+    assert entry is not None
+    assert serializer.acquire('a') is None
+    other = serializer.acquire('b')
+    assert other is not None
+    serializer.release(entry)
+    serializer.release(other)
+    entry = serializer.acquire('a')
+    assert entry is not None
+    serializer.release(entry)
+
+
+def test_ConflictSerializer_max_wait():
+    serializer = ConflictSerializer(conflict_key, timeout=None)
+    entry = serializer.acquire('a')
+    start = time.monotonic()
+    assert serializer.acquire('a', max_wait=0.01) is None
+    assert serializer.acquire('a', max_wait=-1) is None
+    assert time.monotonic() - start < 1.0
+    serializer.timeout = 0
+    assert serializer.acquire('a', max_wait=10) is None
+    serializer.release(entry)
+    assert serializer._locks['a'].users == 0
+
+
+def test_ConflictSerializer_evicts_unused_locks():
+    serializer = ConflictSerializer(conflict_key, max_keys=2)
+    held = serializer.acquire('a')
+    serializer.release(serializer.acquire('b'))
+    serializer.release(serializer.acquire('c'))
+    assert list(serializer._locks) == ['a', 'c']
+    # locks in use are kept even beyond the bound
+    also_held = serializer.acquire('c')
+    serializer.release(serializer.acquire('d'))
+    assert list(serializer._locks) == ['a', 'c', 'd']
+    serializer.release(held)
+    serializer.release(also_held)
+    # the table shrinks back to its bound once a new key is added
+    serializer.release(serializer.acquire('e'))
+    assert list(serializer._locks) == ['d', 'e']
+
+
+def test_serializer_from_settings():
+    from pyramid.path import DottedNameResolver
+
+    from pyramid_retry.conflicts import serializer_from_settings
+
+    resolve = DottedNameResolver().maybe_resolve
+    assert serializer_from_settings({}, resolve) is None
+    serializer = serializer_from_settings(
+        {'retry.conflict_key': 'tests.test_conflicts.conflict_key'}, resolve
+    )
+    assert serializer.key_func is conflict_key
+    assert serializer.max_keys == 1024
+    assert serializer.timeout == 5.0
+    serializer = serializer_from_settings(
+        {
+            'retry.conflict_key': 'tests.test_conflicts.conflict_key',
+            'retry.conflict_key.max_keys': '10',
+            'retry.conflict_key.timeout': '1',
+        },
+        resolve,
+    )
+    assert serializer.max_keys == 10
+    assert serializer.timeout == 1.0
+
+
+def test_policy_serializes_conflicting_retries(config):
+    from pyramid_retry import RetryableException
+
+    first_attempts = threading.Barrier(2, timeout=5)
+    lock = threading.Lock()
+    active = []
+    overlaps = []
+
+    def view(request):
+        if request.environ['retry.attempt'] == 0:
+            first_attempts.wait()
+            raise RetryableException
+        with lock:
+            active.append(request)
+            overlaps.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.remove(request)
+        return 'ok'
+
+    config.add_settings(
+        {'retry.conflict_key': 'tests.test_conflicts.conflict_key'}
+    )
+    config.add_view(view, renderer='string')
+    app = webtest.TestApp(config.make_wsgi_app())
+
+    results = []
+
+    def run():
+        results.append(app.get('/?row=1').text)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == ['ok', 'ok']
+    assert overlaps == [1, 1]
+
+
+def test_policy_demotes_attempt_without_lock(config):
+    from pyramid_retry import (
+        RetryableException,
+        RetryableExecutionPolicy,
+        is_last_attempt,
+    )
+
+    calls = []
+
+    def view(request):
+        calls.append(is_last_attempt(request))
+        raise RetryableException
+
+    serializer = ConflictSerializer(conflict_key, timeout=0)
+    held = serializer.acquire('1')
+    config.add_view(view)
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(serializer=serializer)
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(RetryableException):
+        app.get('/?row=1')
+    assert calls == [False, True]
+    serializer.release(held)
+
+    # requests without a key are not serialized
+    calls[:] = []
+    held = serializer.acquire(None)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == [False, False, True]
+
+
+def test_policy_releases_lock_if_attempt_fails_to_start(config):
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+    from pyramid_retry.limiter import RetryLimiter
+
+    class BrokenTracer(object):
+        def start_span(self, name, attributes):
+            if attributes['retry.attempt'] > 0:
+                raise RuntimeError('tracing failed')
+            return DummySpan()
+
+    class DummySpan(object):
+        def set_attribute(self, key, value):
+            pass
+
+        def end(self):
+            pass
+
+    def view(request):
+        raise RetryableException
+
+    serializer = ConflictSerializer(conflict_key, timeout=0)
+    limiter = RetryLimiter(1)
+    config.add_view(view)
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(
+            serializer=serializer, limiter=limiter, tracer=BrokenTracer()
+        )
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(RuntimeError):
+        app.get('/?row=1')
+    assert serializer._locks['1'].users == 0
+    assert limiter.active == 0
+    held = serializer.acquire('1')
+    assert held is not None
+    serializer.release(held)
+
+
+def test_policy_waits_for_lock_until_deadline(config):
+    from pyramid_retry import (
+        RetryableException,
+        RetryableExecutionPolicy,
+        is_last_attempt,
+    )
+    from pyramid_retry.deadline import Deadlines
+
+    calls = []
+
+    def view(request):
+        calls.append(is_last_attempt(request))
+        raise RetryableException
+
+    serializer = ConflictSerializer(conflict_key, timeout=5.0)
+    deadlines = Deadlines(timeout=0.2)
+    deadlines.record(None, 0.05)
+    held = serializer.acquire('1')
+    config.add_view(view)
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(serializer=serializer, deadlines=deadlines)
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    start = time.monotonic()
+    with pytest.raises(RetryableException):
+        app.get('/?row=1')
+    # the lock is not waited for past the time needed by another attempt
+    assert time.monotonic() - start < 1.0
+    assert calls == [False, True]
+    serializer.release(held)
@@ -0,0 +1,130 @@
+from pyramid.request import Request
+import pytest
+import time
+import webtest
+
+from pyramid_retry.deadline import Deadlines
+
+
+def test_deadline_without_sources():
+    deadlines = Deadlines()
+    assert deadlines.deadline(Request.blank('/')) is None
+
+
+def test_deadline_earliest_source_wins():
+    deadlines = Deadlines(timeout=30)
+    before = time.monotonic()
+    request = Request.blank('/')
+    assert before + 30 <= deadlines.deadline(request) <= time.monotonic() + 30
+
+    request.headers['X-Request-Deadline'] = '5'
+    assert deadlines.deadline(request) <= time.monotonic() + 5
+    request.headers['X-Request-Deadline'] = '50'
+    assert deadlines.deadline(request) <= time.monotonic() + 30
+    request.headers['X-Request-Deadline'] = 'soon'
+    assert deadlines.deadline(request) > time.monotonic() + 29
+
+    request.environ['retry.deadline'] = time.time() + 2
+    assert deadlines.deadline(request) <= time.monotonic() + 2
+    request.environ['retry.deadline'] = time.time() + 200
+    assert deadlines.deadline(request) > time.monotonic() + 29
+
+
+def test_deadline_ignores_header_if_disabled():
+    deadlines = Deadlines(header=None)
+    request = Request.blank('/', headers={'X-Request-Deadline': '5'})
+    assert deadlines.deadline(request) is None
+    request.environ['retry.deadline'] = str(time.time() + 2)
+    assert deadlines.deadline(request) <= time.monotonic() + 2
+
+
+def test_estimate():
+    deadlines = Deadlines(alpha=0.5, max_routes=1)
+    assert deadlines.estimate(None) == 0.0
+    deadlines.record('a', 2.0)
+    deadlines.record('a', 4.0)
+    deadlines.record(None, 6.0)
+    assert deadlines.estimate('a') == 3.0
+    assert deadlines.estimate(None) == 4.5
+    # further routes are not tracked and use the overall estimate
+    deadlines.record('b', 1.0)
+    assert deadlines.estimate('b') == 2.75
+    assert deadlines.estimate('a') == 3.0
+
+
+def test_deadlines_from_settings():
+    from pyramid_retry.deadline import deadlines_from_settings
+
+    assert deadlines_from_settings({}) is None
+    deadlines = deadlines_from_settings({'retry.deadline': '30'})
+    assert deadlines.timeout == 30.0
+    assert deadlines.header == 'X-Request-Deadline'
+    deadlines = deadlines_from_settings({'retry.deadline.header': 'X-Timeout'})
+    assert deadlines.timeout is None
+    assert deadlines.header == 'X-Timeout'
+    deadlines = deadlines_from_settings({'retry.deadline.header': ''})
+    assert deadlines.header is None
+
+
+@pytest.fixture
+def make_app(config):
+    from pyramid_retry import (
+        RetryableException,
+        RetryableExecutionPolicy,
+        is_last_attempt,
+    )
+
+    calls = []
+
+    def view(request):
+        calls.append(is_last_attempt(request))
+        raise RetryableException
+
+    def make_app(deadlines):
+        config.add_route('slow', '/slow')
+        config.add_view(view, route_name='slow')
+        config.commit()
+        config.set_execution_policy(
+            RetryableExecutionPolicy(attempts=3, deadlines=deadlines)
+        )
+        return webtest.TestApp(config.make_wsgi_app())
+
+    make_app.calls = calls
+    return make_app
+
+
+def test_policy_demotes_attempt_without_time(make_app):
+    from pyramid_retry import RetryableException
+
+    deadlines = Deadlines(timeout=15)
+    deadlines.record(None, 10.0)
+    app = make_app(deadlines)
+    with pytest.raises(RetryableException):
+        app.get('/slow')
+    assert make_app.calls == [True]
+
+
+def test_policy_uses_route_estimate(make_app):
+    from pyramid_retry import RetryableException
+
+    deadlines = Deadlines(timeout=15)
+    deadlines.record(None, 0.1)
+    deadlines.record('slow', 10.0)
+    app = make_app(deadlines)
+    with pytest.raises(RetryableException):
+        app.get('/slow')
+    # the first attempt fits the overall estimate but the second cannot fit
+    # another attempt of the slow route
+    assert make_app.calls == [False, True]
+    assert deadlines.estimate('slow') < 8.0
+
+
+def test_policy_retries_within_deadline(make_app):
+    from pyramid_retry import RetryableException
+
+    deadlines = Deadlines()
+    deadlines.record('slow', 10.0)
+    app = make_app(deadlines)
+    with pytest.raises(RetryableException):
+        app.get('/slow', headers={'X-Request-Deadline': '100'})
+    assert make_app.calls == [False, False, True]
@@ -0,0 +1,261 @@
+from concurrent.futures import Future
+from pyramid.response import Response
+import pytest
+import threading
+import webtest
+
+from pyramid_retry.hedge import Hedger, LatencyEstimator
+
+from .conftest import DummyClock
+
+
+class ClosingIter(object):
+    def __init__(self, body):
+        self.body = body
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return iter([self.body])
+
+    def close(self):
+        self.closed.set()
+
+
+def test_LatencyEstimator():
+    clock = DummyClock()
+    estimator = LatencyEstimator(min_samples=10, window=10, clock=clock)
+    for _ in range(9):
+        estimator.record(0.001)
+    assert estimator.estimate() is None
+    estimator.record(1.0)
+    # the estimate is reused until it is refreshed
+    assert estimator.estimate() is None
+    clock.now += 1
+    assert 1.0 <= estimator.estimate() < 1.2
+    for _ in range(90):
+        estimator.record(0.001)
+    clock.now += 1
+    assert estimator.estimate() < 0.0012
+    # samples are forgotten after two windows
+    clock.now += 10
+    assert estimator.estimate() is not None
+    clock.now += 10
+    assert estimator.estimate() is None
+
+
+def test_hedger_from_settings():
+    from pyramid_retry.hedge import hedger_from_settings
+
+    assert hedger_from_settings({}) is None
+    hedger = hedger_from_settings({'retry.hedge.workers': '4'})
+    assert hedger.max_workers == 4
+    assert hedger.delay is None
+    assert hedger.budget.ratio == 0.05
+    hedger = hedger_from_settings(
+        {
+            'retry.hedge.workers': '4',
+            'retry.hedge.delay': '0.1',
+            'retry.hedge.percentile': '0.9',
+            'retry.hedge.min_samples': '5',
+            'retry.hedge.min_per_second': '2',
+        }
+    )
+    assert hedger.delay == 0.1
+    assert hedger.percentile == 0.9
+    assert hedger.min_samples == 5
+    assert hedger.budget.ratio == 0.05
+    assert hedger.budget.min_retries_per_second == 2
+    hedger = hedger_from_settings(
+        {'retry.hedge.workers': '4', 'retry.hedge.ratio': '0.2'}
+    )
+    assert hedger.budget.ratio == 0.2
+    assert hedger.budget.min_retries_per_second == 1
+
+
+def test_Hedger_submit_without_free_thread():
+    hedger = Hedger(max_workers=2)
+    assert hedger._slots.acquire(blocking=False)
+    assert hedger._slots.acquire(blocking=False)
+    assert hedger._submit(lambda: None) is None
+
+
+def test_Hedger_submit_releases_thread_on_error():
+    hedger = Hedger(max_workers=2)
+    assert hedger._submit(lambda: 1).result() == 1
+    hedger._executor.shutdown()
+    with pytest.raises(RuntimeError):
+        hedger._submit(lambda: None)
+    hedger._executor = None
+    release = threading.Event()
+    futures = [hedger._submit(release.wait, 5) for _ in range(2)]
+    assert None not in futures
+    release.set()
+    hedger._executor.shutdown(wait=False)
+
+
+def test_Hedger_resets_after_fork():
+    from pyramid_retry.hedge import _after_fork_in_child
+
+    hedger = Hedger()
+    hedger._submit(lambda: None).result()
+    executor = hedger._executor
+    _after_fork_in_child()
+    assert hedger._executor is None
+    executor.shutdown()
+
+
+def test_discard_cancels_pending_attempt():
+    from pyramid_retry.hedge import _discard
+
+    environ = {}
+    _discard(Future(), environ)
+    assert environ == {}
+
+
+def test_discard_ignores_failed_attempt():
+    from pyramid_retry.hedge import _discard
+
+    environ = {}
+    future = Future()
+    future.set_running_or_notify_cancel()
+    _discard(future, environ)
+    future.set_exception(ValueError())
+    assert environ == {'retry.hedge.cancelled': True}
+
+
+def _makeApp(config, view, settings=None, **kw):
+    config.add_settings(
+        {'retry.hedge.workers': '2', 'retry.hedge.delay': '0.01'}
+    )
+    if settings:
+        config.add_settings(settings)
+    rule = {'methods': ['GET'], 'hedge': True}
+    rule.update(kw)
+    config.add_retry_rule('/', **rule)
+    config.add_view(view)
+    return webtest.TestApp(config.make_wsgi_app())
+
+
+def test_hedge_wins(config):
+    release = threading.Event()
+    environs = []
+    primary_body = ClosingIter(b'primary')
+
+    def view(request):
+        environs.append(request.environ)
+        if 'retry.hedge' in request.environ:
+            return Response(app_iter=ClosingIter(b'hedge'))
+        release.wait(5)
+        return Response(app_iter=primary_body)
+
+    app = _makeApp(config, view)
+    assert app.get('/').body == b'hedge'
+    primary, hedge = environs
+    assert primary['retry.hedge.cancelled']
+    assert 'retry.hedge.cancelled' not in hedge
+    assert primary['retry.attempt'] == hedge['retry.attempt'] == 0
+    release.set()
+    assert primary_body.closed.wait(5)
+
+
+def test_primary_wins(config):
+    hedge_started = threading.Event()
+    release = threading.Event()
+    environs = []
+
+    def view(request):
+        environs.append(request.environ)
+        if 'retry.hedge' in request.environ:
+            hedge_started.set()
+            release.wait(5)
+            return Response(b'hedge')
+        hedge_started.wait(5)
+        return Response(b'primary')
+
+    app = _makeApp(config, view)
+    assert app.get('/').body == b'primary'
+    primary, hedge = environs
+    assert 'retry.hedge.cancelled' not in primary
+    assert hedge['retry.hedge.cancelled']
+    release.set()
+
+
+def test_hedged_attempt_may_be_retried(config):
+    from pyramid_retry import RetryableException
+
+    release = threading.Event()
+    calls = []
+
+    def view(request):
+        calls.append(request.environ.get('retry.hedge', False))
+        if request.environ['retry.attempt'] > 0:
+            return Response(b'retried')
+        if 'retry.hedge' in request.environ:
+            raise RetryableException
+        release.wait(5)
+        return Response(b'primary')
+
+    app = _makeApp(config, view)
+    assert app.get('/').body == b'retried'
+    assert calls == [False, True, False]
+    release.set()
+
+
+def test_hedge_not_sent_without_budget(config):
+    calls = []
+
+    def view(request):
+        calls.append(request)
+        threading.Event().wait(0.05)
+        return Response(b'primary')
+
+    app = _makeApp(
+        config,
+        view,
+        {'retry.hedge.ratio': '0', 'retry.hedge.min_per_second': '0'},
+    )
+    assert app.get('/').body == b'primary'
+    assert len(calls) == 1
+
+
+def test_not_hedged_without_estimate(config):
+    from pyramid_retry import RetryableExecutionPolicy
+    from pyramid_retry.rules import IRetryRules
+
+    threads = []
+
+    def view(request):
+        threads.append(threading.current_thread())
+        return Response(b'ok')
+
+    hedger = Hedger(max_workers=2, min_samples=2)
+    config.add_retry_rule('/', hedge=True)
+    config.add_view(view)
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(
+            rules=config.registry.getUtility(IRetryRules),
+            hedger=hedger,
+        )
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    app.get('/')
+    app.get('/')
+    assert threads == [threading.current_thread()] * 2
+    (estimator,) = hedger._estimators.values()
+    estimator._estimated_at = None
+    assert estimator.estimate() is not None
+    app.get('/')
+    assert threads[-1] is not threading.current_thread()
+
+
+def test_not_hedged_with_body(config):
+    threads = []
+
+    def view(request):
+        threads.append(threading.current_thread())
+        return Response(b'ok')
+
+    app = _makeApp(config, view, methods=None)
+    app.post('/', 'body')
+    assert threads == [threading.current_thread()]
@@ -375,3 +375,1510 @@ def test_mark_error_retryable_on_non_error():
 
     with pytest.raises(ValueError):
         mark_error_retryable('some string')
+
+
+def test_backoff_sleeps_between_attempts(config, monkeypatch):
+    from pyramid_retry import RetryableException
+
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.backoff': 'exponential',
+            'retry.backoff.base': '0.1',
+            'retry.backoff.max_delay': '10',
+        }
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == ['fail', 'fail', 'fail']
+    assert sleeps == [pytest.approx(0.1), pytest.approx(0.2)]
+
+
+def test_backoff_total_is_capped(config, monkeypatch):
+    from pyramid_retry import RetryableException
+
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+
+    def bad_view(request):
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.attempts': 5,
+            'retry.backoff': 'constant',
+            'retry.backoff.base': '0.4',
+            'retry.backoff.max_total': '1',
+        }
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert sleeps == [0.4, 0.4, pytest.approx(0.2)]
+
+
+def test_retry_after_overrides_backoff(config, monkeypatch):
+    from pyramid_retry import RetryableException, mark_error_retryable
+
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    calls = []
+
+    class LockTimeout(Exception):
+        pass
+
+    def bad_view(request):
+        calls.append('fail')
+        if len(calls) == 1:
+            raise RetryableException(retry_after=0.5)
+        if len(calls) == 2:
+            exc = LockTimeout()
+            mark_error_retryable(exc, retry_after=30)
+            raise exc
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.attempts': 4,
+            'retry.backoff': 'constant',
+            'retry.backoff.base': '0.1',
+            'retry.backoff.max_retry_after': '2',
+        }
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert sleeps == [0.5, 2.0, 0.1]
+
+
+def test_retry_after_header_of_http_exception_is_ignored(config, monkeypatch):
+    from pyramid.httpexceptions import HTTPServiceUnavailable
+
+    from pyramid_retry import mark_error_retryable
+
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        # webob parses the Retry-After header of the response into a datetime
+        exc = HTTPServiceUnavailable()
+        exc.retry_after = 120
+        mark_error_retryable(exc)
+        raise exc
+
+    config.add_settings(
+        {'retry.backoff': 'constant', 'retry.backoff.base': '0.1'}
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(HTTPServiceUnavailable):
+        app.get('/')
+    assert calls == ['fail'] * 3
+    assert sleeps == [0.1, 0.1]
+
+
+def test_retry_after_must_be_a_number(config, monkeypatch):
+    from pyramid_retry import RetryableException, mark_error_retryable
+
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    hints = ['1', True, 0.5]
+
+    def bad_view(request):
+        exc = RetryableException()
+        if hints:
+            mark_error_retryable(exc, retry_after=hints.pop(0))
+        raise exc
+
+    config.add_settings(
+        {
+            'retry.attempts': 4,
+            'retry.backoff': 'constant',
+            'retry.backoff.base': '0.1',
+        }
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert sleeps == [0.1, 0.1, 0.5]
+
+
+def test_retry_after_is_capped_by_deadline(config, monkeypatch):
+    from pyramid_retry import RetryableException
+
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        raise RetryableException(retry_after=60)
+
+    config.add_settings({'retry.attempts': 2, 'retry.deadline': '10'})
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == ['fail', 'fail']
+    assert 9.0 < sleeps[0] <= 10.0
+
+
+def test_retryable_false_prevents_retry(config):
+    from pyramid_retry import (
+        RetryableException,
+        is_error_retryable,
+        mark_error_retryable,
+    )
+
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        raise RetryableException('gone', retryable=False)
+
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == ['fail']
+
+    request = pyramid.request.Request.blank('/')
+    request.environ['retry.attempt'] = 0
+    request.environ['retry.attempts'] = 3
+    exc = ValueError()
+    mark_error_retryable(exc)
+    exc.retryable = False
+    assert not is_error_retryable(request, exc)
+
+
+def test_exhausted_budget_makes_attempt_last(config):
+    from pyramid_retry import RetryableException, is_last_attempt
+
+    calls = []
+
+    def bad_view(request):
+        calls.append(is_last_attempt(request))
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.budget.ratio': '0',
+            'retry.budget.min_retries_per_second': '0.1',
+            'retry.budget.window': '10',
+        }
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    # one retry fits in the budget, the second attempt becomes the last
+    assert calls == [False, True]
+    del calls[:]
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == [True]
+
+
+def test_retry_rules_from_settings(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        calls.append(request.method)
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.rules': '''
+                GET /api 1
+                POST /api 2
+            ''',
+        }
+    )
+    config.add_route('all', '/*subpath')
+    config.add_view(bad_view, route_name='all')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/api/foo')
+    assert calls == ['GET']
+    del calls[:]
+    with pytest.raises(RetryableException):
+        app.post('/api/foo')
+    assert calls == ['POST', 'POST']
+    del calls[:]
+    with pytest.raises(RetryableException):
+        app.get('/other')
+    assert calls == ['GET', 'GET', 'GET']
+
+
+def test_add_retry_rule_directive(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        calls.append(request.environ['retry.attempts'])
+        raise RetryableException
+
+    config.add_retry_rule(path_prefix='/api/', methods='get', attempts=1)
+    config.add_retry_rule(path_prefix='/api/orders', attempts=5)
+    config.add_route('all', '/*subpath')
+    config.add_view(bad_view, route_name='all')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/api/users')
+    assert calls == [1]
+    del calls[:]
+    with pytest.raises(RetryableException):
+        app.get('/api/orders/1')
+    assert calls == [5] * 5
+
+    introspector = config.registry.introspector
+    intrs = introspector.get_category('retry rules')
+    assert [i['introspectable']['attempts'] for i in intrs] == [1, 5]
+    assert intrs[0]['introspectable']['methods'] == ('GET',)
+
+
+def test_activate_hook_overrides_retry_rules(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.activate_hook': lambda request: 2,
+            'retry.rules': '/ 1',
+        }
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == ['fail', 'fail']
+
+
+def test_large_body_is_mapped_and_replayed(config):
+    from pyramid_retry import RetryableException
+    from pyramid_retry.body import MappedBody
+
+    calls = []
+    data = b'x' * 5000
+
+    def final_view(request):
+        calls.append(request.body)
+        return 'ok'
+
+    def bad_view(request):
+        assert isinstance(request.body_file_raw, MappedBody)
+        calls.append(request.body_file.read(10))
+        raise RetryableException
+
+    config.add_settings({'retry.body.max_memory': '1000'})
+    config.add_view(bad_view, last_retry_attempt=False)
+    config.add_view(final_view, last_retry_attempt=True, renderer='string')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    response = app.post('/', data)
+    assert response.body == b'ok'
+    assert calls == [b'x' * 10, b'x' * 10, data]
+
+
+def test_body_larger_than_max_size_gets_single_attempt(config):
+    from pyramid_retry import RetryableException, is_last_attempt
+
+    calls = []
+
+    def bad_view(request):
+        calls.append(is_last_attempt(request))
+        assert not request.is_body_seekable
+        raise RetryableException
+
+    config.add_settings({'retry.body.max_size': '10'})
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.post('/', b'x' * 11)
+    assert calls == [True]
+
+
+def test_lazy_body_is_replayed(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def final_view(request):
+        calls.append(request.body)
+        return 'ok'
+
+    def bad_view(request):
+        calls.append(request.body_file.read(3))
+        raise RetryableException
+
+    config.add_settings({'retry.body.lazy': 'true'})
+    config.add_view(bad_view, last_retry_attempt=False)
+    config.add_view(final_view, last_retry_attempt=True, renderer='string')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    response = app.post('/', b'abcdef')
+    assert response.body == b'ok'
+    assert calls == [b'abc', b'abc', b'abcdef']
+
+
+def test_bodyless_request_is_not_buffered(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        calls.append(request.is_body_seekable)
+        raise RetryableException
+
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == [False, False, False]
+
+
+def test_ErrorClassifier_caches_verdict_per_type():
+    from pyramid_retry import (
+        ErrorClassifier,
+        RetryableException,
+        mark_error_retryable,
+    )
+
+    class Base(RetryableException):
+        pass
+
+    class Deep(Base):
+        pass
+
+    class Marked(Exception):
+        pass
+
+    class DeepMarked(Marked):
+        pass
+
+    mark_error_retryable(Marked)
+    classifier = ErrorClassifier()
+    assert classifier.classify(Deep())
+    assert classifier.classify(DeepMarked())
+    assert list(classifier._cache) == [DeepMarked]
+    assert not classifier.classify(ValueError())
+    assert classifier._cache[ValueError] == (None, False)
+    assert not classifier.classify(None)
+
+
+def test_ErrorClassifier_is_invalidated_by_marking_a_type():
+    from pyramid_retry import ErrorClassifier, mark_error_retryable
+
+    class MyError(Exception):
+        pass
+
+    class MySubError(MyError):
+        pass
+
+    classifier = ErrorClassifier()
+    assert not classifier.classify(MySubError())
+    mark_error_retryable(MyError)
+    assert classifier.classify(MySubError())
+
+
+def test_ErrorClassifier_checks_marked_instances():
+    from pyramid_retry import ErrorClassifier, mark_error_retryable
+
+    class MyError(Exception):
+        pass
+
+    classifier = ErrorClassifier()
+    assert not classifier.classify(MyError())
+    exc = MyError()
+    mark_error_retryable(exc)
+    assert classifier.classify(exc)
+    assert not classifier.classify(MyError())
+
+
+def test_ErrorClassifier_cache_is_bounded():
+    from pyramid_retry import ErrorClassifier
+
+    classifier = ErrorClassifier()
+    classifier.max_cache_size = 2
+    classifier.classify(KeyError())
+    classifier.classify(ValueError())
+    assert len(classifier._cache) == 2
+    classifier.classify(TypeError())
+    assert classifier._cache == {TypeError: (None, False)}
+
+
+def test_is_error_retryable_memoizes_on_request(monkeypatch):
+    from pyramid_retry import (
+        ErrorPolicy,
+        RetryableException,
+        is_error_retryable,
+    )
+
+    calls = []
+    request = pyramid.request.Request.blank('/')
+    request.environ['retry.attempt'] = 0
+    request.environ['retry.attempts'] = 2
+
+    def lookup(exc):
+        calls.append(exc)
+        return ErrorPolicy()
+
+    monkeypatch.setattr('pyramid_retry._default_classifier.lookup', lookup)
+    exc = RetryableException()
+    assert is_error_retryable(request, exc)
+    assert is_error_retryable(request, exc)
+    assert calls == [exc]
+    other = RetryableException()
+    assert is_error_retryable(request, other)
+    assert calls == [exc, other]
+
+
+class DummyDatabaseError(Exception):
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+def is_serialization_failure(exc):
+    return exc.pgcode in ('40001', '40P01')
+
+
+def test_ErrorClassifier_retryable_attribute():
+    from pyramid_retry import ErrorClassifier, mark_error_retryable
+
+    class Gone(Exception):
+        retryable = False
+
+    mark_error_retryable(Gone)
+    classifier = ErrorClassifier()
+    assert not classifier.classify(Gone())
+    # the verdict of the class is cached with its type
+    assert not classifier.classify(Gone())
+
+    # an instance attribute takes precedence over the class
+    exc = Gone()
+    exc.retryable = True
+    assert classifier.classify(exc)
+    exc.retryable = False
+    assert not classifier.classify(exc)
+
+
+def test_ErrorClassifier_caches_marked_instances():
+    from zope.interface import alsoProvides
+
+    from pyramid_retry import ErrorClassifier, IRetryableError
+
+    class IDeadlock(IRetryableError):
+        pass
+
+    class Plain(Exception):
+        pass
+
+    classifier = ErrorClassifier()
+    classifier.add_error(IDeadlock, attempts=5)
+    first, second, plain = Plain(), Plain(), Plain()
+    alsoProvides(first, IDeadlock)
+    alsoProvides(second, IDeadlock)
+    assert classifier.lookup(first).attempts == 5
+    # instances marked alike share their declaration and its cache entry
+    assert classifier.lookup(second).attempts == 5
+    assert len(classifier._cache) == 1
+    assert classifier.lookup(plain) is None
+    assert len(classifier._cache) == 2
+
+
+def test_ErrorClassifier_invokes_registered_classifier():
+    from pyramid_retry import ErrorClassifier
+
+    class SubError(DummyDatabaseError):
+        pass
+
+    classifier = ErrorClassifier(
+        [
+            {
+                'error': DummyDatabaseError,
+                'classifier': is_serialization_failure,
+            },
+            {'error': KeyError},
+        ]
+    )
+    assert classifier.classify(DummyDatabaseError('40001'))
+    assert classifier.classify(SubError('40P01'))
+    assert not classifier.classify(SubError('23505'))
+    assert classifier.classify(KeyError())
+    assert not classifier.classify(ValueError())
+
+
+def test_ErrorClassifier_closest_registration_wins():
+    from pyramid_retry import (
+        ErrorClassifier,
+        RetryableException,
+        mark_error_retryable,
+    )
+
+    class Base(Exception):
+        pass
+
+    class Marked(Base):
+        pass
+
+    class Registered(Marked):
+        pass
+
+    mark_error_retryable(Marked)
+    classifier = ErrorClassifier(
+        [{'error': Base, 'classifier': lambda exc: False}]
+    )
+    assert not classifier.classify(Base())
+    assert classifier.classify(Marked())
+    classifier.add_error(Registered, lambda exc: False)
+    assert not classifier.classify(Registered())
+    classifier.add_error(Exception, lambda exc: False)
+    assert classifier.classify(RetryableException())
+
+
+def test_ErrorClassifier_registered_type_still_honors_marked_instance():
+    from pyramid_retry import ErrorClassifier, mark_error_retryable
+
+    classifier = ErrorClassifier(
+        [{'error': DummyDatabaseError, 'classifier': lambda exc: False}]
+    )
+    exc = DummyDatabaseError('23505')
+    assert not classifier.classify(exc)
+    mark_error_retryable(exc)
+    assert classifier.classify(exc)
+
+
+def test_ErrorClassifier_add_error_rejects_non_types():
+    from pyramid_retry import ErrorClassifier
+
+    classifier = ErrorClassifier()
+    with pytest.raises(ValueError):
+        classifier.add_error(KeyError())
+    with pytest.raises(ValueError):
+        classifier.add_error(object)
+
+
+def test_parse_errors():
+    from pyramid.path import DottedNameResolver
+
+    from pyramid_retry import parse_errors
+
+    resolve = DottedNameResolver().maybe_resolve
+    result = parse_errors(
+        '''
+        tests.test_it.DummyDatabaseError tests.test_it:is_serialization_failure
+
+        builtins.KeyError
+        ''',
+        resolve,
+    )
+    assert result == [
+        {'error': DummyDatabaseError, 'classifier': is_serialization_failure},
+        {'error': KeyError},
+    ]
+
+
+@pytest.mark.parametrize(
+    'value',
+    ['builtins.KeyError a b', 'tests.test_it.is_serialization_failure'],
+)
+def test_parse_errors_invalid(value):
+    from pyramid.exceptions import ConfigurationError
+    from pyramid.path import DottedNameResolver
+
+    from pyramid_retry import parse_errors
+
+    with pytest.raises(ConfigurationError):
+        parse_errors(value, DottedNameResolver().maybe_resolve)
+
+
+def test_retry_errors_setting(config):
+    from pyramid_retry import is_error_retryable
+
+    calls = []
+    codes = []
+
+    def bad_view(request):
+        code = codes.pop(0)
+        calls.append(code)
+        raise DummyDatabaseError(code)
+
+    def exc_view(request):
+        calls.append(is_error_retryable(request, request.exception))
+        raise request.exception
+
+    config.add_settings(
+        {
+            'retry.errors': (
+                'tests.test_it.DummyDatabaseError '
+                'tests.test_it.is_serialization_failure'
+            ),
+        }
+    )
+    config.add_view(bad_view)
+    config.add_exception_view(exc_view, retryable_error=True)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    codes[:] = ['40001', '23505']
+    with pytest.raises(DummyDatabaseError):
+        app.get('/')
+    # the first error is retried, the second exits the loop immediately
+    assert calls == ['40001', True, '23505']
+
+
+def test_ErrorClassifier_error_policies():
+    from zope.interface import implementer
+
+    from pyramid_retry import ErrorClassifier, IRetryableError
+
+    class IDeadlock(IRetryableError):
+        pass
+
+    @implementer(IDeadlock)
+    class DeadlockError(Exception):
+        pass
+
+    class SubDeadlockError(DeadlockError):
+        pass
+
+    classifier = ErrorClassifier()
+    assert classifier.lookup(DeadlockError()).attempts is None
+    classifier.add_error(IDeadlock, attempts=5)
+    assert classifier.lookup(SubDeadlockError()).attempts == 5
+    classifier.add_error(SubDeadlockError, attempts=2, backoff=min)
+    policy = classifier.lookup(SubDeadlockError())
+    assert policy.attempts == 2
+    assert policy.backoff is min
+    assert classifier.lookup(DeadlockError()).attempts == 5
+    assert classifier.lookup(ValueError()) is None
+
+
+def test_ErrorClassifier_error_policy_of_marked_instance():
+    from zope.interface import Interface, alsoProvides
+
+    from pyramid_retry import ErrorClassifier, IRetryableError
+
+    class IDeadlock(IRetryableError):
+        pass
+
+    classifier = ErrorClassifier([{'error': IDeadlock, 'attempts': 4}])
+    exc = DummyDatabaseError('40P01')
+    assert classifier.lookup(exc) is None
+    alsoProvides(exc, Interface)
+    assert classifier.lookup(exc) is None
+    alsoProvides(exc, IDeadlock)
+    assert classifier.lookup(exc).attempts == 4
+
+
+def test_ErrorClassifier_add_error_rejects_invalid_policies():
+    from zope.interface import Interface
+
+    from pyramid_retry import ErrorClassifier
+
+    classifier = ErrorClassifier()
+    with pytest.raises(ValueError):
+        classifier.add_error(Interface)
+    with pytest.raises(ValueError):
+        classifier.add_error(KeyError, attempts=0)
+
+
+def test_parse_errors_with_options():
+    from pyramid.path import DottedNameResolver
+
+    from pyramid_retry import IRetryableError, parse_errors
+    from pyramid_retry.backoff import ConstantBackoff
+
+    resolve = DottedNameResolver().maybe_resolve
+    result = parse_errors(
+        'tests.test_it.DummyDatabaseError '
+        'tests.test_it:is_serialization_failure attempts=6\n'
+        'builtins.KeyError attempts=2 backoff=constant backoff.base=0.5\n'
+        'pyramid_retry.IRetryableError backoff=builtins.max\n',
+        resolve,
+    )
+    assert result[0] == {
+        'error': DummyDatabaseError,
+        'classifier': is_serialization_failure,
+        'attempts': 6,
+    }
+    assert result[1]['error'] is KeyError
+    assert result[1]['attempts'] == 2
+    assert isinstance(result[1]['backoff'], ConstantBackoff)
+    assert result[1]['backoff'].delay == 0.5
+    assert result[2] == {'error': IRetryableError, 'backoff': max}
+
+
+@pytest.mark.parametrize(
+    'value',
+    [
+        'builtins.KeyError attempts=many',
+        'builtins.KeyError tries=2',
+        'zope.interface.Interface',
+    ],
+)
+def test_parse_errors_invalid_options(value):
+    from pyramid.exceptions import ConfigurationError
+    from pyramid.path import DottedNameResolver
+
+    from pyramid_retry import parse_errors
+
+    with pytest.raises(ConfigurationError):
+        parse_errors(value, DottedNameResolver().maybe_resolve)
+
+
+def test_error_policy_overrides_attempts_and_backoff(config, monkeypatch):
+    import time
+
+    calls = []
+    sleeps = []
+    codes = []
+
+    def bad_view(request):
+        code = codes.pop(0)
+        calls.append((code, request.environ['retry.attempts']))
+        raise DummyDatabaseError(code)
+
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    config.add_settings(
+        {
+            'retry.attempts': 2,
+            'retry.errors': (
+                'tests.test_it.DummyDatabaseError attempts=4 '
+                'backoff=constant backoff.base=0.5'
+            ),
+        }
+    )
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    codes[:] = ['40001', '40001', '40001', '40001']
+    with pytest.raises(DummyDatabaseError):
+        app.get('/')
+    assert calls == [('40001', 2), ('40001', 4), ('40001', 4), ('40001', 4)]
+    assert sleeps == [0.5, 0.5, 0.5]
+
+
+def test_error_policy_lowers_attempts_and_last_attempt(config):
+    from pyramid_retry import IErrorClassifier, RetryableException
+
+    calls = []
+
+    class ConnectionLost(Exception):
+        pass
+
+    def bad_view(request):
+        calls.append(request.environ['retry.attempt'])
+        if len(calls) == 1:
+            raise RetryableException
+        raise ConnectionLost
+
+    def exc_view(request):
+        calls.append('last' if request.environ['retry.attempt'] else 'first')
+        raise request.exception
+
+    config.add_view(bad_view)
+    config.add_exception_view(exc_view, last_retry_attempt=True)
+    config.add_settings({'retry.attempts': 5})
+    config.commit()
+    classifier = config.registry.getUtility(IErrorClassifier)
+    classifier.add_error(ConnectionLost, attempts=2)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(ConnectionLost):
+        app.get('/')
+    # the second attempt is the last one allowed after a lost connection
+    assert calls == [0, 1, 'last']
+
+
+def test_skip_exception_views_on_retried_attempts(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        raise RetryableException
+
+    def exc_view(request):
+        calls.append('exc_view')
+        return 'error'
+
+    config.add_settings({'retry.skip_exception_views': 'true'})
+    config.add_view(bad_view)
+    config.add_exception_view(exc_view, renderer='string')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    response = app.get('/')
+    assert response.body == b'error'
+    assert calls == ['fail', 'fail', 'fail', 'exc_view']
+
+
+def test_skip_exception_views_passes_through_other_errors(config):
+    from pyramid_retry import IBeforeRetry, RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        if len(calls) == 1:
+            raise RetryableException
+        raise ValueError
+
+    def exc_view(request):
+        calls.append(request.exception.__class__.__name__)
+        return 'error'
+
+    def retry_subscriber(event):
+        calls.append(
+            (event.exception is event.request.exception, event.response.status)
+        )
+
+    config.add_settings({'retry.skip_exception_views': 'true'})
+    config.add_subscriber(retry_subscriber, IBeforeRetry)
+    config.add_view(bad_view)
+    config.add_exception_view(exc_view, renderer='string')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    response = app.get('/')
+    assert response.body == b'error'
+    assert calls == [
+        'fail',
+        (True, '500 Internal Server Error'),
+        'fail',
+        'ValueError',
+    ]
+
+
+def test_exception_views_render_on_every_attempt_by_default(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        raise RetryableException
+
+    def exc_view(request):
+        calls.append('exc_view')
+        return 'error'
+
+    config.add_view(bad_view)
+    config.add_exception_view(exc_view, renderer='string')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    app.get('/')
+    assert calls == ['exc_view', 'exc_view', 'exc_view']
+
+
+def test_BeforeRetry_is_not_created_without_subscribers(config, monkeypatch):
+    from pyramid_retry import BeforeRetry, IBeforeRetry, RetryableException
+
+    calls = []
+    created = []
+    notified = []
+
+    def bad_view(request):
+        calls.append('fail')
+        raise RetryableException
+
+    def factory(*args, **kwargs):
+        created.append(args)
+        return BeforeRetry(*args, **kwargs)
+
+    monkeypatch.setattr('pyramid_retry.BeforeRetry', factory)
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert len(calls) == 3
+    assert created == []
+
+    # subscribers added later are noticed
+    config.add_subscriber(notified.append, IBeforeRetry)
+    config.commit()
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert len(created) == 2
+    assert len(notified) == 2
+    assert not hasattr(notified[0], '__dict__')
+
+
+def test_BeforeRetry_subscriber_for_class_is_found(config):
+    from pyramid_retry import BeforeRetry, RetryableException
+
+    events = []
+
+    def bad_view(request):
+        raise RetryableException
+
+    config.add_subscriber(events.append, BeforeRetry)
+    config.add_view(bad_view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert len(events) == 2
+
+
+def test_has_retry_subscribers_without_generation():
+    from pyramid_retry import _has_retry_subscribers
+
+    class DummyAdapters(object):
+        subscribers = []
+
+        def subscriptions(self, required, provided):
+            return self.subscribers
+
+    class DummyRegistry(object):
+        adapters = DummyAdapters()
+
+    registry = DummyRegistry()
+    assert not _has_retry_subscribers(registry)
+    DummyAdapters.subscribers = [object()]
+    assert _has_retry_subscribers(registry)
+
+
+def test_retry_view_option_retries_only_the_view(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import (
+        IBeforeViewRetry,
+        RetryableException,
+        is_last_attempt,
+    )
+
+    factory_calls = []
+    calls = []
+    events = []
+
+    def request_factory(environ):
+        factory_calls.append(environ)
+        return Request(environ)
+
+    def view(request):
+        calls.append(
+            (
+                request.environ['retry.attempt'],
+                request.environ['retry.attempts'],
+                is_last_attempt(request),
+                request.body,
+            )
+        )
+        request.response.headers['X-Failed'] = str(len(calls))
+        if len(calls) < 4:
+            raise RetryableException
+        return 'ok'
+
+    config.set_request_factory(request_factory)
+    config.add_subscriber(events.append, IBeforeViewRetry)
+    config.add_view(view, renderer='string', retry=5)
+    app = webtest.TestApp(config.make_wsgi_app())
+    response = app.post('/', 'abc')
+    assert response.text == 'ok'
+    assert response.headers['X-Failed'] == '4'
+    assert len(factory_calls) == 1
+    assert calls == [
+        (0, 5, False, b'abc'),
+        (1, 5, False, b'abc'),
+        (2, 5, False, b'abc'),
+        (3, 5, False, b'abc'),
+    ]
+    assert len(events) == 3
+    assert isinstance(events[0].exception, RetryableException)
+    assert not hasattr(events[0], '__dict__')
+
+
+def test_retry_view_option_exhausted_does_not_retry_request(config):
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def view(request):
+        calls.append(request.environ['retry.attempt'])
+        raise RetryableException
+
+    config.add_view(view, retry=True)
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == [0, 1, 2]
+
+
+def test_retry_view_option_restores_environ(config):
+    from pyramid.events import NewResponse
+
+    from pyramid_retry import RetryableException, is_last_attempt
+
+    calls = []
+
+    def view(request):
+        calls.append('view')
+        if len(calls) == 1:
+            raise RetryableException
+        return 'ok'
+
+    def new_response(event):
+        environ = event.request.environ
+        calls.append(
+            (
+                environ['retry.attempt'],
+                environ['retry.attempts'],
+                is_last_attempt(event.request),
+            )
+        )
+
+    config.add_subscriber(new_response, NewResponse)
+    config.add_view(view, renderer='string', retry=2)
+    app = webtest.TestApp(config.make_wsgi_app())
+    app.get('/')
+    assert calls == ['view', 'view', (0, 3, False)]
+
+
+def test_retry_view_option_passes_through_other_errors(config):
+    calls = []
+
+    def view(request):
+        calls.append(request.environ['retry.attempt'])
+        raise ValueError
+
+    config.add_view(view, retry=3)
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(ValueError):
+        app.get('/')
+    assert calls == [0]
+
+
+def test_retry_view_option_without_execution_policy():
+    from pyramid.config import Configurator
+
+    from pyramid_retry import RetryableException
+
+    calls = []
+
+    def view(request):
+        calls.append(request.body)
+        if len(calls) == 1:
+            raise RetryableException
+        return 'ok'
+
+    with Configurator() as config:
+        config.add_view_deriver('pyramid_retry.retry_view_deriver')
+        config.add_view(view, renderer='string', retry=2)
+        app = webtest.TestApp(config.make_wsgi_app())
+    assert app.post('/', 'abc').text == 'ok'
+    assert calls == [b'abc', b'abc']
+
+
+def test_retry_view_option_reports_to_breaker(config):
+    from pyramid_retry import RetryableException
+    from pyramid_retry.breaker import IRetryCircuitBreaker, RetryCircuitBreaker
+
+    outcomes = []
+
+    class DummyBreaker(RetryCircuitBreaker):
+        def record(self, key, success):
+            outcomes.append(success)
+
+    config.registry.registerUtility(DummyBreaker(), IRetryCircuitBreaker)
+    calls = []
+
+    def view(request):
+        calls.append('view')
+        if len(calls) < 3:
+            raise RetryableException
+        return 'ok'
+
+    config.add_view(view, renderer='string', retry=3)
+    app = webtest.TestApp(config.make_wsgi_app())
+    app.get('/')
+    assert outcomes == [False, True]
+
+
+def test_retry_view_option_draws_from_budget(config):
+    from pyramid_retry import RetryableException, is_last_attempt
+
+    calls = []
+
+    def view(request):
+        calls.append(is_last_attempt(request))
+        raise RetryableException
+
+    config.add_settings(
+        {
+            'retry.budget.ratio': '0',
+            'retry.budget.min_retries_per_second': '0.1',
+            'retry.budget.window': '10',
+        }
+    )
+    config.add_view(view, retry=5)
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(RetryableException):
+        app.get('/')
+    # one retry of the view fits in the budget and is recorded
+    assert calls == [False, True]
+    del calls[:]
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert calls == [True]
+
+
+def test_retry_view_option_respects_deadline(config, monkeypatch):
+    from pyramid_retry import RetryableException, is_last_attempt
+
+    from .conftest import DummyClock
+
+    clock = DummyClock()
+    monkeypatch.setattr('time.monotonic', clock)
+    calls = []
+
+    def view(request):
+        calls.append(is_last_attempt(request))
+        clock.now += 4.0
+        raise RetryableException
+
+    config.add_settings({'retry.attempts': 1, 'retry.deadline': '10'})
+    config.add_view(view, retry=5)
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(RetryableException):
+        app.get('/')
+    # after the first call 6 seconds are left, enough for only one more call
+    assert calls == [False, True]
+
+
+@pytest.mark.parametrize('value', [0, -1, 'yes', 1.5])
+def test_retry_view_option_invalid(config, value):
+    from pyramid.exceptions import ConfigurationError
+
+    config.add_view(lambda request: 'ok', renderer='string', retry=value)
+    with pytest.raises(ConfigurationError):
+        config.commit()
+
+
+def test_invoke_subrequest_with_retry(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import (
+        IBeforeRetry,
+        RetryableException,
+        invoke_subrequest_with_retry,
+        is_last_attempt,
+    )
+
+    calls = []
+    events = []
+
+    def item_view(request):
+        calls.append(
+            (
+                request.environ['retry.attempt'],
+                request.environ['retry.attempts'],
+                is_last_attempt(request),
+                request.body,
+            )
+        )
+        if len(calls) < 4:
+            raise RetryableException
+        return 'ok'
+
+    def batch_view(request):
+        calls.append(('batch', request.environ['retry.attempt']))
+        subrequest = Request.blank('/item', POST='abc')
+        response = invoke_subrequest_with_retry(request, subrequest)
+        assert 'retry.attempt' not in subrequest.environ
+        return response.text
+
+    config.add_subscriber(events.append, IBeforeRetry)
+    config.add_route('batch', '/batch')
+    config.add_route('item', '/item')
+    config.add_view(batch_view, route_name='batch', renderer='string')
+    config.add_view(item_view, route_name='item', renderer='string')
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/batch').text == 'ok'
+    assert calls == [
+        ('batch', 0),
+        (0, 3, False, b'abc'),
+        (1, 3, False, b'abc'),
+        (2, 3, True, b'abc'),
+    ]
+    assert len(events) == 2
+    assert events[0].request is not events[1].request
+
+
+def test_invoke_subrequest_with_retry_exhausted(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import RetryableException, invoke_subrequest_with_retry
+    from pyramid_retry.breaker import IRetryCircuitBreaker, RetryCircuitBreaker
+
+    calls = []
+    outcomes = []
+
+    class DummyBreaker(RetryCircuitBreaker):
+        def record(self, key, success):
+            outcomes.append(success)
+
+    def item_view(request):
+        calls.append('item')
+        raise RetryableException
+
+    def batch_view(request):
+        calls.append('batch')
+        invoke_subrequest_with_retry(
+            request, Request.blank('/item'), attempts=2
+        )
+
+    config.registry.registerUtility(DummyBreaker(), IRetryCircuitBreaker)
+    config.add_route('batch', '/batch')
+    config.add_route('item', '/item')
+    config.add_view(batch_view, route_name='batch', renderer='string')
+    config.add_view(item_view, route_name='item', renderer='string')
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(RetryableException):
+        app.get('/batch')
+    # the outer request is not retried again
+    assert calls == ['batch', 'item', 'item']
+    assert outcomes == [False]
+
+
+def test_invoke_subrequest_with_retry_other_errors(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import invoke_subrequest_with_retry
+
+    calls = []
+
+    def item_view(request):
+        calls.append('item')
+        raise ValueError
+
+    def batch_view(request):
+        calls.append('batch')
+        invoke_subrequest_with_retry(request, Request.blank('/item'))
+
+    config.add_route('batch', '/batch')
+    config.add_route('item', '/item')
+    config.add_view(batch_view, route_name='batch', renderer='string')
+    config.add_view(item_view, route_name='item', renderer='string')
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(ValueError):
+        app.get('/batch')
+    assert calls == ['batch', 'item']
+
+
+def test_invoke_subrequest_with_retry_squashed_by_tweens(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import (
+        RetryableException,
+        invoke_subrequest_with_retry,
+    )
+    from pyramid_retry.breaker import IRetryCircuitBreaker, RetryCircuitBreaker
+
+    calls = []
+    outcomes = []
+
+    class DummyBreaker(RetryCircuitBreaker):
+        def record(self, key, success):
+            outcomes.append(success)
+
+    def item_view(request):
+        calls.append('item')
+        if len(calls) < 3:
+            raise RetryableException
+        return 'ok'
+
+    def exc_view(request):
+        return 'failed'
+
+    def batch_view(request):
+        response = invoke_subrequest_with_retry(
+            request, Request.blank('/item'), use_tweens=True
+        )
+        return response.text
+
+    config.registry.registerUtility(DummyBreaker(), IRetryCircuitBreaker)
+    config.add_route('batch', '/batch')
+    config.add_route('item', '/item')
+    config.add_view(batch_view, route_name='batch', renderer='string')
+    config.add_view(item_view, route_name='item', renderer='string')
+    config.add_exception_view(exc_view, renderer='string')
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/batch').text == 'ok'
+    assert calls == ['item', 'item', 'item']
+    assert outcomes == [False, True]
+
+
+def test_discarded_attempts_release_memory(config):
+    import tracemalloc
+
+    from pyramid_retry import IBeforeRetry, RetryableException
+
+    exceptions = []
+    closed = []
+
+    class ClosingIter(object):
+        def __iter__(self):
+            return iter([b'failed'])
+
+        def close(self):
+            closed.append(True)
+
+    def bad_view(request):
+        payload = bytearray(1024 * 1024)  # noqa: F841
+        try:
+            raise ValueError
+        except ValueError:
+            raise RetryableException
+
+    def exc_view(request):
+        response = request.response
+        response.app_iter = ClosingIter()
+        return response
+
+    # a subscriber keeping the exceptions around no longer keeps the
+    # memory referenced by the frames of the failed attempts
+    config.add_subscriber(
+        lambda event: exceptions.append(event.exception), IBeforeRetry
+    )
+    config.add_settings({'retry.attempts': 20})
+    config.add_view(bad_view)
+    config.add_exception_view(exc_view, context=RetryableException)
+    app = webtest.TestApp(config.make_wsgi_app())
+
+    tracemalloc.start()
+    try:
+        app.get('/', status=200)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(exceptions) == 19
+    assert peak < 5 * 1024 * 1024
+    # the response of the last attempt is closed by the server
+    assert len(closed) == 20
+
+    exc = exceptions[0]
+    assert exc.__traceback__ is None
+    assert exc.__context__.__traceback__ is None
+    assert exc.retry_traceback[-1].name == 'bad_view'
+
+
+def test_discarded_request_is_collected_before_backoff(config):
+    import gc
+    import weakref
+
+    from pyramid_retry import RetryableExecutionPolicy, mark_error_retryable
+    from pyramid_retry.breaker import RetryCircuitBreaker
+
+    requests = []
+    alive = []
+
+    def view(request):
+        requests.append(weakref.ref(request))
+        exc = ValueError()
+        mark_error_retryable(exc)
+        raise exc
+
+    def backoff(attempt, last_delay):
+        gc.collect()
+        alive.append([ref() is not None for ref in requests])
+        return 0
+
+    # the circuit breaker remembers its verdict next to the exception
+    config.add_view(view)
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(
+            backoff=backoff, breaker=RetryCircuitBreaker()
+        )
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(ValueError):
+        app.get('/')
+    assert alive == [[False], [False, False]]
+
+
+def test_discard_leaves_handled_exception_alone(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import (
+        IBeforeRetry,
+        IBeforeViewRetry,
+        RetryableException,
+        invoke_subrequest_with_retry,
+        retry_view_deriver,
+    )
+
+    outer = []
+    events = []
+
+    def item_view(request):
+        raise RetryableException
+
+    class DummyViewDeriverInfo(object):
+        options = {'retry': 2}
+        registry = config.registry
+
+    item_view_with_retry = retry_view_deriver(
+        lambda context, request: item_view(request), DummyViewDeriverInfo
+    )
+
+    def batch_view(request):
+        try:
+            raise KeyError('outer')
+        except KeyError as exc:
+            outer.append(exc)
+            with pytest.raises(RetryableException):
+                invoke_subrequest_with_retry(request, Request.blank('/item'))
+            with pytest.raises(RetryableException):
+                item_view_with_retry(None, request)
+        return 'ok'
+
+    config.add_subscriber(events.append, IBeforeRetry)
+    config.add_subscriber(events.append, IBeforeViewRetry)
+    config.add_route('batch', '/batch')
+    config.add_route('item', '/item')
+    config.add_view(batch_view, route_name='batch', renderer='string')
+    config.add_view(item_view, route_name='item')
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/batch').text == 'ok'
+    assert len(events) == 3
+    for event in events:
+        assert event.exception.__traceback__ is None
+        assert event.exception.__context__ is outer[0]
+    assert outer[0].__traceback__ is not None
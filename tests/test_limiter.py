@@ -0,0 +1,265 @@
+import pytest
+import threading
+import time
+import webtest
+
+from pyramid_retry.limiter import RetryLimiter
+
+
+def test_RetryLimiter():
+    limiter = RetryLimiter(2, timeout=0)
+    assert not limiter.saturated()
+    assert limiter.acquire()
+    assert limiter.acquire()
+    assert limiter.saturated()
+    assert not limiter.acquire()
+    limiter.release()
+    assert not limiter.saturated()
+    assert limiter.active == 1
+
+
+def test_RetrySlot():
+    from pyramid_retry.limiter import RetrySlot
+
+    limiter = RetryLimiter(1, timeout=0)
+    slot = RetrySlot(limiter)
+    assert slot.acquire()
+    assert slot.acquire()
+    assert limiter.active == 1
+    assert slot.close()
+    assert not slot.acquire()
+    assert not slot.close()
+    limiter.release()
+
+    # an attempt which is over cannot take a slot anymore
+    slot = RetrySlot(limiter)
+    assert not slot.close()
+    assert not slot.acquire()
+    assert limiter.active == 0
+
+
+def test_limiter_from_settings():
+    from pyramid_retry.limiter import limiter_from_settings
+
+    assert limiter_from_settings({}) is None
+    limiter = limiter_from_settings({'retry.concurrency.limit': '4'})
+    assert limiter.max_concurrent == 4
+    assert limiter.timeout == 0.05
+    limiter = limiter_from_settings(
+        {'retry.concurrency.limit': '4', 'retry.concurrency.timeout': '0.5'}
+    )
+    assert limiter.timeout == 0.5
+
+
+class DummyLimiter(object):
+    def __init__(self, slots):
+        self.slots = list(slots)
+        self.released = 0
+
+    def saturated(self):
+        return False
+
+    def acquire(self):
+        return self.slots.pop(0)
+
+    def release(self):
+        self.released += 1
+
+
+@pytest.fixture
+def make_app(config):
+    from pyramid_retry import (
+        RetryableException,
+        RetryableExecutionPolicy,
+        is_last_attempt,
+    )
+
+    calls = []
+
+    def view(request):
+        calls.append(is_last_attempt(request))
+        raise RetryableException
+
+    def make_app(limiter):
+        config.add_view(view)
+        config.commit()
+        config.set_execution_policy(RetryableExecutionPolicy(limiter=limiter))
+        return webtest.TestApp(config.make_wsgi_app())
+
+    make_app.calls = calls
+    return make_app
+
+
+def test_policy_holds_slot_during_retries(make_app):
+    from pyramid_retry import RetryableException
+
+    limiter = RetryLimiter(1)
+    app = make_app(limiter)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert make_app.calls == [False, False, True]
+    assert limiter.active == 0
+
+
+def test_policy_demotes_attempt_while_saturated(make_app):
+    from pyramid_retry import RetryableException
+
+    limiter = RetryLimiter(1)
+    limiter.acquire()
+    app = make_app(limiter)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert make_app.calls == [True]
+
+
+def test_policy_does_not_retry_without_slot(make_app):
+    from pyramid_retry import RetryableException
+
+    # the slot taken after the first failure is kept by the later attempts
+    limiter = DummyLimiter([True])
+    app = make_app(limiter)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert make_app.calls == [False, False, True]
+    assert limiter.released == 1
+
+    # a failed attempt which cannot get a slot is not retried
+    make_app.calls[:] = []
+    limiter.slots = [False]
+    with pytest.raises(RetryableException):
+        app.get('/')
+    assert make_app.calls == [False]
+    assert limiter.released == 1
+
+
+def test_policy_does_not_retry_squashed_error_without_slot(config):
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+
+    calls = []
+
+    def view(request):
+        calls.append('view')
+        raise RetryableException
+
+    config.add_view(view)
+    config.add_exception_view(lambda request: 'failed', renderer='string')
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(limiter=DummyLimiter([False]))
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/').text == 'failed'
+    assert calls == ['view']
+
+
+def test_policy_gives_back_slot_if_attempt_cannot_start(config):
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+    from pyramid_retry.backoff import ConstantBackoff
+
+    class FailingBackoff(ConstantBackoff):
+        def __call__(self, attempt, last_delay):
+            raise KeyboardInterrupt
+
+    def view(request):
+        raise RetryableException
+
+    limiter = RetryLimiter(1)
+    config.add_view(view)
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(limiter=limiter, backoff=FailingBackoff())
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    with pytest.raises(KeyboardInterrupt):
+        app.get('/')
+    assert limiter.active == 0
+
+
+def test_policy_caps_concurrent_retries(config):
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+    from pyramid_retry.backoff import ConstantBackoff
+
+    first_attempts = threading.Barrier(4, timeout=5)
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+
+    def view(request):
+        if request.environ['retry.attempt'] == 0:
+            first_attempts.wait()
+            raise RetryableException
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return 'ok'
+
+    limiter = RetryLimiter(1, timeout=0.01)
+    config.add_view(view, renderer='string')
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(
+            limiter=limiter, backoff=ConstantBackoff(0.05)
+        )
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    statuses = []
+
+    def run():
+        try:
+            statuses.append(app.get('/').text)
+        except RetryableException:
+            statuses.append('failed')
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(statuses) == 4
+    assert 'ok' in statuses
+    assert peak[0] <= limiter.max_concurrent
+    assert limiter.active == 0
+
+
+def test_skipped_exception_view_renders_error_without_slot(config):
+    from pyramid.response import Response
+
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+
+    limiter = RetryLimiter(1, timeout=0)
+    calls = []
+
+    def view(request):
+        calls.append('view')
+        if request.params.get('steal'):
+            # another request takes the last slot while this attempt runs
+            assert limiter.acquire()
+        elif len(calls) > 1:
+            assert limiter.active == 1
+            return Response('ok')
+        raise RetryableException
+
+    def exc_view(request):
+        calls.append('exc_view')
+        return Response('rendered error page', status=503)
+
+    config.add_settings({'retry.skip_exception_views': 'true'})
+    config.add_view(view)
+    config.add_exception_view(exc_view, RetryableException)
+    config.commit()
+    config.set_execution_policy(RetryableExecutionPolicy(limiter=limiter))
+    app = webtest.TestApp(config.make_wsgi_app())
+    # the slot taken by the tween is used by the next attempt
+    assert app.get('/').text == 'ok'
+    assert calls == ['view', 'view']
+    assert limiter.active == 0
+
+    calls[:] = []
+    response = app.get('/?steal=1', status=503)
+    assert response.text == 'rendered error page'
+    assert calls == ['view', 'exc_view']
+    limiter.release()
+    assert limiter.active == 0
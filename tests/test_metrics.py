@@ -0,0 +1,223 @@
+import pytest
+import socket
+import threading
+import webtest
+
+from pyramid_retry.metrics import BatchingMetrics, StatsdEmitter
+
+
+class DummyEmitter(object):
+    def __init__(self):
+        self.batches = []
+        self.emitted = threading.Event()
+
+    def __call__(self, counters, histograms):
+        self.batches.append((counters, histograms))
+        self.emitted.set()
+
+
+class DummyMetrics(object):
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, tags=()):
+        key = (name, tags)
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def observe(self, name, value, tags=()):
+        self.histograms.setdefault((name, tags), []).append(value)
+
+
+@pytest.fixture
+def udp_server():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+    yield sock
+    sock.close()
+
+
+def test_BatchingMetrics_aggregates_until_flushed():
+    emitter = DummyEmitter()
+    metrics = BatchingMetrics(emitter, interval=60, max_samples=2)
+    metrics.increment('retries', (('exception', 'E'),))
+    metrics.increment('retries', (('exception', 'E'),))
+    metrics.increment('first_attempts')
+    metrics.observe('attempt_duration', 1.5)
+    metrics.observe('attempt_duration', 2.5)
+    metrics.observe('attempt_duration', 3.5)
+    assert emitter.batches == []
+    metrics.close()
+    assert emitter.batches == [
+        (
+            {
+                ('retries', (('exception', 'E'),)): 2,
+                ('first_attempts', ()): 1,
+            },
+            {('attempt_duration', ()): [1.5, 2.5]},
+        )
+    ]
+    metrics.flush()
+    assert len(emitter.batches) == 1
+
+
+def test_BatchingMetrics_flushes_in_background():
+    emitter = DummyEmitter()
+    metrics = BatchingMetrics(emitter, interval=0.01)
+    metrics.increment('first_attempts')
+    assert emitter.emitted.wait(5)
+    metrics.close()
+    assert emitter.batches[0] == ({('first_attempts', ()): 1}, {})
+
+
+def test_BatchingMetrics_does_not_restart_after_close():
+    metrics = BatchingMetrics(DummyEmitter())
+    metrics.close()
+    metrics.observe('attempt_duration', 1)
+    assert metrics._thread is None
+
+
+def test_BatchingMetrics_logs_emitter_errors(caplog):
+    def emitter(counters, histograms):
+        raise ValueError
+
+    metrics = BatchingMetrics(emitter)
+    metrics.increment('first_attempts')
+    metrics.close()
+    assert 'failed to emit' in caplog.text
+
+
+def test_BatchingMetrics_resets_after_fork():
+    from pyramid_retry.metrics import _after_fork_in_child
+
+    emitter = DummyEmitter()
+    metrics = BatchingMetrics(emitter, interval=60)
+    metrics.increment('first_attempts')
+    thread = metrics._thread
+    assert thread is not None
+    _after_fork_in_child()
+    assert metrics._thread is None
+    assert metrics._counters == {}
+    metrics.close()
+    thread.join(0)
+    assert emitter.batches == []
+
+
+def test_StatsdEmitter_sends_batches(udp_server):
+    emitter = StatsdEmitter(*udp_server.getsockname(), prefix='app')
+    emitter(
+        {('retries', (('exception', 'Deadlock'),)): 2},
+        {('attempt_duration', ()): [1.25, 3.0], ('attempts', ()): [2]},
+    )
+    emitter.close()
+    data = udp_server.recv(65535)
+    assert data.split(b'\n') == [
+        b'app.retries:2|c|#exception:Deadlock',
+        b'app.attempt_duration:1.25|ms',
+        b'app.attempt_duration:3|ms',
+        b'app.attempts:2|ms',
+    ]
+
+
+def test_StatsdEmitter_splits_packets(udp_server):
+    emitter = StatsdEmitter(
+        *udp_server.getsockname(), prefix='', max_packet_size=45
+    )
+    emitter({}, {('attempt_duration', ()): [1, 2, 3]})
+    emitter.close()
+    assert udp_server.recv(65535) == (
+        b'attempt_duration:1|ms\nattempt_duration:2|ms'
+    )
+    assert udp_server.recv(65535) == b'attempt_duration:3|ms'
+
+
+def test_StatsdEmitter_ignores_send_errors():
+    emitter = StatsdEmitter()
+    emitter._socket.close()
+    emitter({('retries', ()): 1}, {})
+
+
+def test_metrics_from_settings():
+    from pyramid.path import DottedNameResolver
+
+    from pyramid_retry.metrics import metrics_from_settings
+
+    resolve = DottedNameResolver().maybe_resolve
+    assert metrics_from_settings({}, resolve) is None
+    metrics = metrics_from_settings(
+        {
+            'retry.metrics': 'statsd',
+            'retry.metrics.interval': '5',
+            'retry.metrics.statsd.host': 'localhost',
+            'retry.metrics.statsd.port': '9125',
+            'retry.metrics.statsd.prefix': 'app',
+        },
+        resolve,
+    )
+    assert metrics.interval == 5.0
+    assert metrics.emitter.address[1] == 9125
+    assert metrics.emitter.prefix == 'app.'
+    metrics = metrics_from_settings({'retry.metrics': 'statsd'}, resolve)
+    assert metrics.interval == 10.0
+    assert metrics.emitter.address == ('127.0.0.1', 8125)
+    assert metrics.emitter.prefix == 'pyramid_retry.'
+    metrics = metrics_from_settings(
+        {'retry.metrics': 'tests.test_metrics.dummy_metrics'}, resolve
+    )
+    assert metrics is dummy_metrics
+
+
+dummy_metrics = DummyMetrics()
+
+
+def test_policy_reports_metrics(config):
+    from pyramid_retry import RetryableException
+    from pyramid_retry.metrics import IRetryMetrics
+
+    calls = []
+
+    def view(request):
+        calls.append(request.path)
+        if request.path == '/recover' and len(calls) == 1:
+            raise RetryableException
+        if request.path == '/exhaust':
+            raise RetryableException
+        if request.path == '/error':
+            raise ValueError
+        return 'ok'
+
+    dummy_metrics.__init__()
+    config.add_settings({'retry.metrics': 'tests.test_metrics.dummy_metrics'})
+    config.add_route('all', '/*subpath')
+    config.add_view(view, route_name='all', renderer='string')
+    config.commit()
+    assert config.registry.getUtility(IRetryMetrics) is dummy_metrics
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    app.get('/recover')
+    app.get('/ok')
+    with pytest.raises(RetryableException):
+        app.get('/exhaust')
+    with pytest.raises(ValueError):
+        app.get('/error')
+
+    tags = (('exception', 'RetryableException'),)
+    assert dummy_metrics.counters == {
+        ('first_attempts', ()): 4,
+        ('retries', tags): 3,
+        ('recovered', ()): 1,
+        ('exhausted', tags): 1,
+    }
+    assert dummy_metrics.histograms[('attempts_per_request', ())] == [
+        2,
+        1,
+        3,
+        1,
+    ]
+    durations = dummy_metrics.histograms
+    route = ('route', 'all')
+    assert len(durations[('attempt_duration', (route,))]) == 2
+    assert len(durations[('attempt_duration', tags + (route,))]) == 4
+    error_tags = (('exception', 'ValueError'), route)
+    assert len(durations[('attempt_duration', error_tags)]) == 1
@@ -0,0 +1,106 @@
+from pyramid.exceptions import ConfigurationError
+import pytest
+
+
+def _makeRules(*rules):
+    from pyramid_retry.rules import RetryRules
+
+    table = RetryRules()
+    for kw in rules:
+        table.add(**kw)
+    return table
+
+
+def test_lookup_without_rules():
+    rules = _makeRules()
+    assert rules.lookup('GET', '/') is None
+    assert rules.lookup('GET', '/foo/bar') is None
+
+
+def test_lookup_longest_prefix_wins():
+    rules = _makeRules(
+        {'path_prefix': '/', 'attempts': 2},
+        {'path_prefix': '/api', 'attempts': 3},
+        {'path_prefix': '/api/orders/', 'attempts': 5},
+    )
+    assert rules.lookup('GET', '/').attempts == 2
+    assert rules.lookup('GET', '/other').attempts == 2
+    assert rules.lookup('GET', '/api').attempts == 3
+    assert rules.lookup('GET', '/api/users').attempts == 3
+    assert rules.lookup('GET', '/api/orders').attempts == 5
+    assert rules.lookup('GET', '/api/orders/1').attempts == 5
+    assert rules.lookup('GET', '/apis').attempts == 2
+
+
+def test_lookup_method_specific_rule_wins():
+    rules = _makeRules(
+        {'path_prefix': '/api', 'attempts': 3},
+        {'path_prefix': '/api', 'methods': ['get', 'HEAD'], 'attempts': 1},
+        {'path_prefix': '/api/orders', 'methods': ['POST'], 'attempts': 5},
+    )
+    assert rules.lookup('GET', '/api/users').attempts == 1
+    assert rules.lookup('HEAD', '/api/users').attempts == 1
+    assert rules.lookup('POST', '/api/users').attempts == 3
+    assert rules.lookup('POST', '/api/orders').attempts == 5
+    # the deeper rule does not apply to GET so the shallower one is used
+    assert rules.lookup('GET', '/api/orders').attempts == 1
+
+
+def test_later_rule_replaces_earlier():
+    rules = _makeRules(
+        {'path_prefix': '/api', 'attempts': 3},
+        {'path_prefix': '/api/', 'attempts': 4},
+    )
+    assert rules.lookup('GET', '/api').attempts == 4
+
+
+@pytest.mark.parametrize('attempts', [None, 0])
+def test_add_rejects_invalid_attempts(attempts):
+    with pytest.raises(ConfigurationError):
+        _makeRules({'path_prefix': '/', 'attempts': attempts})
+
+
+def test_parse_rules():
+    from pyramid_retry.rules import parse_rules
+
+    result = parse_rules('''
+        GET,HEAD /api 1
+
+        /api/orders 5
+        ''')
+    assert result == [
+        {'path_prefix': '/api', 'methods': ['GET', 'HEAD'], 'attempts': 1},
+        {'path_prefix': '/api/orders', 'methods': None, 'attempts': 5},
+    ]
+
+
+@pytest.mark.parametrize('line', ['/api', 'GET /api 1 2', '/api many'])
+def test_parse_rules_invalid(line):
+    from pyramid_retry.rules import parse_rules
+
+    with pytest.raises(ConfigurationError):
+        parse_rules(line)
+
+
+def test_hedge_rule_without_attempts():
+    rules = _makeRules(
+        {'path_prefix': '/api', 'attempts': 3},
+        {'path_prefix': '/api/search', 'methods': ['GET'], 'hedge': True},
+    )
+    rule = rules.lookup('GET', '/api/search')
+    assert rule.hedge
+    assert rule.attempts is None
+    assert not rules.lookup('GET', '/api').hedge
+
+
+def test_parse_rules_hedge():
+    from pyramid_retry.rules import parse_rules
+
+    assert parse_rules('GET /search 2 hedge') == [
+        {
+            'path_prefix': '/search',
+            'methods': ['GET'],
+            'attempts': 2,
+            'hedge': True,
+        }
+    ]
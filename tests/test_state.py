@@ -0,0 +1,162 @@
+import webtest
+
+from pyramid_retry.state import RetryState
+
+
+def test_RetryState():
+    state = RetryState(3, 100.0)
+    assert not hasattr(state, '__dict__')
+    assert (state.attempt, state.attempts) == (0, 3)
+    assert state.started == state.attempt_started == 100.0
+    assert state.total_backoff == 0.0
+    assert state.errors == ()
+    assert state.deadline is None
+    assert state.budget is None
+    assert repr(state) == '<RetryState attempt 1 of 3>'
+
+
+def test_RetryState_errors_are_bounded():
+    class SmallRetryState(RetryState):
+        __slots__ = ()
+        max_errors = 2
+
+    state = SmallRetryState(20, 0.0)
+    state.record_error(ValueError())
+    assert state.errors == (ValueError,)
+    state.record_error(KeyError())
+    state.record_error(TypeError())
+    assert state.errors == (KeyError, TypeError)
+
+
+def test_retry_state_of_plain_request():
+    from pyramid.request import Request
+
+    from pyramid_retry.state import retry_state
+
+    assert retry_state(Request.blank('/')) is None
+
+
+def test_policy_updates_retry_state(config):
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+    from pyramid_retry.backoff import ConstantBackoff
+
+    seen = []
+
+    def view(request):
+        state = request.retry
+        assert state is request.environ['retry.state']
+        seen.append(
+            (
+                state.attempt,
+                state.attempts,
+                state.errors,
+                state.total_backoff,
+                state.started <= state.attempt_started,
+            )
+        )
+        if state.attempt < 2:
+            raise RetryableException
+        return 'ok'
+
+    config.add_view(view, renderer='string')
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(backoff=ConstantBackoff(0.001))
+    )
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/').text == 'ok'
+    assert seen == [
+        (0, 3, (), 0.0, True),
+        (1, 3, (RetryableException,), 0.001, True),
+        (2, 3, (RetryableException,) * 2, 0.002, True),
+    ]
+
+
+def test_demotion_updates_retry_state(config):
+    from pyramid_retry import RetryableException, is_last_attempt
+
+    calls = []
+
+    def view(request):
+        calls.append('view')
+        raise RetryableException
+
+    def exc_view(request):
+        state = request.retry
+        calls.append((state.attempt, state.attempts, is_last_attempt(request)))
+        return 'failed'
+
+    config.add_view(view, retry=2)
+    config.add_exception_view(exc_view, renderer='string')
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/').text == 'failed'
+    # the exhausted view made the first attempt of the request its last one
+    assert calls == ['view', 'view', (0, 1, True)]
+
+
+def test_view_retry_state(config):
+    from pyramid.events import NewRequest, NewResponse
+
+    from pyramid_retry import RetryableException, is_last_attempt
+
+    seen = []
+
+    def view(request):
+        state = request.retry
+        seen.append(
+            (
+                state.attempt,
+                state.attempts,
+                state.errors,
+                is_last_attempt(request),
+            )
+        )
+        if state.attempt == 0:
+            raise RetryableException
+        return 'ok'
+
+    def on_new_request(event):
+        started.append(event.request.retry.attempt_started)
+
+    def on_new_response(event):
+        state = event.request.retry
+        seen.append((state.attempt, state.attempts, state.attempt_started))
+
+    started = []
+    config.add_view(view, renderer='string', retry=2)
+    config.add_subscriber(on_new_request, NewRequest)
+    config.add_subscriber(on_new_response, NewResponse)
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/').text == 'ok'
+    assert seen == [
+        (0, 2, (), False),
+        (1, 2, (RetryableException,), True),
+        # the attempt of the request is restored after the view
+        (0, 3, started[0]),
+    ]
+
+
+def test_subrequest_retry_state(config):
+    from pyramid.request import Request
+
+    from pyramid_retry import RetryableException, invoke_subrequest_with_retry
+
+    seen = []
+
+    def item_view(request):
+        state = request.retry
+        seen.append((state.attempt, state.errors))
+        if state.attempt == 0:
+            raise RetryableException
+        return 'ok'
+
+    def batch_view(request):
+        return invoke_subrequest_with_retry(request, Request.blank('/item'))
+
+    config.add_route('batch', '/batch')
+    config.add_route('item', '/item')
+    config.add_view(batch_view, route_name='batch')
+    config.add_view(item_view, route_name='item', renderer='string')
+    app = webtest.TestApp(config.make_wsgi_app())
+    assert app.get('/batch').text == 'ok'
+    assert seen == [(0, ()), (1, (RetryableException,))]
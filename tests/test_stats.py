@@ -0,0 +1,145 @@
+import pyramid.testing
+import pytest
+import webtest
+
+from pyramid_retry.stats import HISTOGRAM_BOUNDS, Histogram, RetryStats
+
+from .conftest import DummyClock
+
+
+def test_Histogram_percentiles():
+    histogram = Histogram()
+    assert histogram.percentile(0.5) is None
+    for value in [1.0] * 90 + [100.0] * 9 + [1e9]:
+        histogram.record(value)
+    assert histogram.percentile(0.5) == 1.0
+    assert 100.0 <= histogram.percentile(0.99) < 120.0
+    assert histogram.percentile(1.0) == HISTOGRAM_BOUNDS[-1]
+    assert histogram.summary() == {
+        'count': 100,
+        'p50': 1.0,
+        'p90': 1.0,
+        'p99': histogram.percentile(0.99),
+    }
+
+
+def test_RetryStats_bounds_keys():
+    stats = RetryStats(max_keys=2)
+    for name in ['a', 'b', 'c', 'd']:
+        stats.observe('attempt_duration', 1.0, (('route', name),))
+    assert sorted(stats.routes) == ['(other)', 'a', 'b']
+    assert sum(stats.routes['(other)'].counts) == 2
+
+
+def test_RetryStats_attempt_distribution():
+    stats = RetryStats(max_attempts=3)
+    for attempts in [1, 1, 2, 3, 7]:
+        stats.observe('attempts_per_request', attempts)
+    assert stats.snapshot()['attempts'] == {'1': 2, '2': 1, '3+': 2}
+
+
+def test_RetryStats_success_ratio_window():
+    clock = DummyClock()
+    stats = RetryStats(window=10, buckets=2, clock=clock)
+    stats.increment('recovered')
+    stats.increment('exhausted', (('exception', 'E'),))
+    stats.increment('exhausted')
+    assert stats.success_ratio() == (1, 2)
+    clock.now += 5
+    stats.increment('recovered')
+    assert stats.success_ratio() == (2, 2)
+    clock.now += 5
+    assert stats.success_ratio() == (1, 0)
+    stats.increment('exhausted')
+    assert stats.success_ratio() == (1, 1)
+    window = stats.snapshot()['window']
+    assert window == {
+        'seconds': 10,
+        'recovered': 1,
+        'exhausted': 1,
+        'success_ratio': 0.5,
+    }
+    clock.now += 20
+    assert stats.snapshot()['window']['success_ratio'] is None
+
+
+def test_RetryStats_ignores_unknown_metrics():
+    stats = RetryStats()
+    stats.increment('other')
+    stats.observe('other', 1)
+    assert stats.snapshot()['requests'] == 0
+
+
+@pytest.fixture
+def stats_config():
+    config = pyramid.testing.setUp(
+        settings={'retry.stats.path': '/_retry/stats'},
+        autocommit=False,
+    )
+    config.include('pyramid_retry')
+    yield config
+    pyramid.testing.tearDown()
+
+
+def test_stats_view(stats_config):
+    from pyramid_retry import RetryableException
+    from pyramid_retry.stats import IRetryStats
+
+    config = stats_config
+
+    calls = []
+
+    def view(request):
+        calls.append('fail')
+        if len(calls) < 3:
+            raise RetryableException
+        return 'ok'
+
+    config.add_route('home', '/')
+    config.add_view(view, route_name='home', renderer='string')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    app.get('/')
+    assert config.registry.getUtility(IRetryStats).retries == 2
+    result = app.get('/_retry/stats').json
+    assert result['requests'] == 2
+    assert result['retries'] == 2
+    assert result['attempts']['3'] == 1
+    # the attempt serving the stats is recorded once it finishes
+    assert result['attempts']['1'] == 0
+    assert result['window']['success_ratio'] == 1.0
+    assert result['routes']['home']['count'] == 3
+    assert result['exceptions']['RetryableException']['retries'] == 2
+    assert result['exceptions']['RetryableException']['duration']['count'] == 2
+
+
+def test_stats_with_metrics(config):
+    from pyramid_retry import RetryableException
+    from pyramid_retry.metrics import CompositeMetrics, IRetryMetrics
+    from pyramid_retry.stats import IRetryStats
+
+    from .test_metrics import dummy_metrics
+
+    def view(request):
+        raise RetryableException
+
+    dummy_metrics.__init__()
+    config.add_settings(
+        {
+            'retry.stats': 'true',
+            'retry.stats.window': '30',
+            'retry.metrics': 'tests.test_metrics.dummy_metrics',
+        }
+    )
+    config.add_view(view)
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(RetryableException):
+        app.get('/')
+    stats = config.registry.getUtility(IRetryStats)
+    assert stats.window == 30.0
+    metrics = config.registry.getUtility(IRetryMetrics)
+    assert isinstance(metrics, CompositeMetrics)
+    assert metrics.sinks == (dummy_metrics, stats)
+    assert dummy_metrics.counters[('first_attempts', ())] == 1
+    assert stats.snapshot()['window']['exhausted'] == 1
@@ -0,0 +1,181 @@
+import pytest
+import webtest
+
+from pyramid_retry.tracing import NOOP_SPAN
+
+
+class DummySpan(object):
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.ended = False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.ended = True
+
+
+class DummyTracer(object):
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, attributes):
+        span = DummySpan(name, attributes)
+        self.spans.append(span)
+        return span
+
+
+dummy_tracer = DummyTracer()
+
+
+def test_noop_span():
+    NOOP_SPAN.set_attribute('a', 1)
+    NOOP_SPAN.end()
+
+
+def test_tracer_from_settings():
+    from pyramid.path import DottedNameResolver
+
+    from pyramid_retry.tracing import OpenTelemetryTracer, tracer_from_settings
+
+    resolve = DottedNameResolver().maybe_resolve
+    assert tracer_from_settings({}, resolve) is None
+    tracer = tracer_from_settings({'retry.tracer': 'opentelemetry'}, resolve)
+    assert isinstance(tracer, OpenTelemetryTracer)
+    tracer = tracer_from_settings(
+        {'retry.tracer': 'tests.test_tracing.dummy_tracer'}, resolve
+    )
+    assert tracer is dummy_tracer
+
+
+def test_policy_traces_attempts(config, monkeypatch):
+    import time
+
+    from pyramid_retry import IBeforeRetry, RetryableException
+
+    calls = []
+
+    def bad_view(request):
+        calls.append('fail')
+        if len(calls) == 1:
+            raise RetryableException
+        raise ValueError
+
+    def exc_view(request):
+        return 'error'
+
+    def retry_subscriber(event):
+        event.span.set_attribute('app.note', 'retrying')
+
+    dummy_tracer.__init__()
+    monkeypatch.setattr(time, 'sleep', lambda delay: None)
+    config.add_settings(
+        {
+            'retry.tracer': 'tests.test_tracing.dummy_tracer',
+            'retry.backoff': 'constant',
+            'retry.backoff.base': '0.25',
+        }
+    )
+    config.add_subscriber(retry_subscriber, IBeforeRetry)
+    config.add_view(bad_view)
+    config.add_exception_view(
+        exc_view, context=RetryableException, renderer='string'
+    )
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with pytest.raises(ValueError):
+        app.get('/')
+
+    first, second = dummy_tracer.spans
+    assert first.name == 'pyramid_retry.attempt'
+    assert first.ended
+    assert first.attributes == {
+        'retry.attempt': 0,
+        'retry.attempts': 3,
+        'retry.backoff': 0.0,
+        'exception.type': 'pyramid_retry.RetryableException',
+        'retry.squashed': True,
+        'retry.retried': True,
+        'app.note': 'retrying',
+    }
+    assert second.ended
+    assert second.attributes == {
+        'retry.attempt': 1,
+        'retry.attempts': 3,
+        'retry.backoff': 0.25,
+        'exception.type': 'builtins.ValueError',
+        'retry.squashed': False,
+        'retry.retried': False,
+    }
+
+
+def test_policy_traces_successful_attempt(config):
+    def view(request):
+        return 'ok'
+
+    dummy_tracer.__init__()
+    config.add_settings({'retry.tracer': 'tests.test_tracing.dummy_tracer'})
+    config.add_view(view, renderer='string')
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    app.get('/')
+    (span,) = dummy_tracer.spans
+    assert span.ended
+    assert span.attributes == {
+        'retry.attempt': 0,
+        'retry.attempts': 3,
+        'retry.backoff': 0.0,
+        'retry.retried': False,
+    }
+
+
+def test_OpenTelemetryTracer(config):
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    from pyramid_retry import RetryableException, RetryableExecutionPolicy
+    from pyramid_retry.tracing import OpenTelemetryTracer
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    otel_tracer = provider.get_tracer('tests')
+    calls = []
+
+    def view(request):
+        with otel_tracer.start_as_current_span('view'):
+            calls.append('view')
+            if len(calls) == 1:
+                raise RetryableException
+        return 'ok'
+
+    config.add_view(view, renderer='string')
+    config.commit()
+    config.set_execution_policy(
+        RetryableExecutionPolicy(
+            tracer=OpenTelemetryTracer(otel_tracer),
+        )
+    )
+    app = config.make_wsgi_app()
+    app = webtest.TestApp(app)
+    with otel_tracer.start_as_current_span('request'):
+        app.get('/')
+
+    spans = {}
+    for span in exporter.get_finished_spans():
+        spans.setdefault(span.name, []).append(span)
+    (request_span,) = spans['request']
+    first, second = spans['pyramid_retry.attempt']
+    assert first.parent.span_id == request_span.context.span_id
+    assert second.parent.span_id == request_span.context.span_id
+    assert first.attributes['retry.retried'] is True
+    assert second.attributes['retry.retried'] is False
+    assert [span.parent.span_id for span in spans['view']] == [
+        first.context.span_id,
+        second.context.span_id,
+    ]